@@ -97,6 +97,18 @@
 # runs separate from the main thread, and in order to be thread safe, callbacks have to be
 # executed from within the main thread.  The exceptions to this are messages like pings and acks, 
 # because those don't need to be escalated to the main thread, but do need an immediate response.
+#
+# If your game would rather not have a second thread at all, create the transport with
+# mode=M_INLINE (see transport/base.py).  The transport thread is then never started, and
+# every call to DispatcherBase.Update polls the socket, maintains connections and flushes
+# outgoing messages before pumping events.  Since everything runs in the main thread, no locks
+# are taken, which matters when the game simulation is already fighting for the GIL.
+#
+# Games and services that already run an asyncio event loop should use the AsyncUdp transport
+# instead.  Start the dispatcher with `await dispatcher.StartAsync()` and call
+# `await dispatcher.UpdateAsync(timestep)` from your loop.  Datagrams are processed as the
+# event loop delivers them, and the protocol runs connection maintenance and the send flush
+# as asyncio tasks, waiting on the socket whenever its write buffer fills up.
 # 
 # @section messagesdetail Messages, in detail
 # 
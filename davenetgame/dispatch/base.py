@@ -18,6 +18,8 @@
 
 '''
 
+import asyncio
+
 from davenetgame import callback
 
 ## @file dispatcher
@@ -59,20 +61,49 @@ class DispatcherBase(object):
     def GetConnections(self):
         return self.__core_protocol.ConnectionList()
     
+    ## Returns a dictionary of statistics from the core protocol.  See ProtocolBase.Stats.
+    def Stats(self):
+        return self.__core_protocol.Stats()
+    
     ## Call this every time your game loop loops to keep events moving.  It is not optional.
+    #  If the core protocol's transport is inline (see transport.base.M_INLINE), this is also
+    #  where the socket is polled, connections are maintained and outgoing messages are sent.
     def Update(self, timestep):
+        transport = self.__core_protocol.Transport()
+        
+        if transport.IsInline():
+            transport.Step()
+        
         self.__core_protocol.Update(timestep)
     
+    ## The awaitable version of Update, for games running in an asyncio event loop.  Events
+    #  are pumped, then control is given back to the event loop so the transport's tasks can
+    #  run.
+    async def UpdateAsync(self, timestep):
+        self.__core_protocol.Update(timestep)
+        
+        await asyncio.sleep(0)
+    
     def AddProtocol(self, protocol):
         self.__protocols.append(protocol)
         
     def Start(self):
+        self.__setupProtocols()
+        self.__core_protocol._start()
+        
+    ## Starts the core protocol on the running asyncio event loop.  Use this instead of Start
+    #  when the core protocol's transport is driven by asyncio, such as AsyncUdp.
+    async def StartAsync(self):
+        self.__setupProtocols()
+        await self.__core_protocol._start_async()
+    
+    ## Hooks up the event callbacks of every protocol and finds the core protocol.
+    def __setupProtocols(self):
         for prot in self.__protocols:
             prot.RegisterEventCallback(self.ProcessEvent)
             if prot.IsCore():
                 if self.__core_protocol is None:
                     self.__core_protocol = prot
-        self.__core_protocol._start()
         
     def Stop(self):
         self.__core_protocol._stop()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import multiprocessing, os, queue, time
+
+## @file shard
+#
+#  This file contains the ShardSupervisor, which runs one game server as several worker
+#  processes that all listen on the same UDP port.  Each worker binds its socket with
+#  SO_REUSEPORT (pass reuseport=True to the Udp transport), and the kernel then spreads
+#  clients between the workers by hashing each client's address, so a given client always
+#  lands on the same worker.  Every worker has its own RealtimeServer, ConnectionList and
+#  game objects; the workers share nothing, so this only suits games where each shard can
+#  run its own world, such as lobbies or independent matches.
+#
+#  A worker that dies is restarted, but its connections die with it.  The kernel's hash also
+#  depends on which sockets are bound, so while a worker is down, and again once it's back, some
+#  clients are hashed to a different worker than the one they logged in to.  That worker has no
+#  connection for them and doesn't treat their messages as coming from a logged in client, so
+#  clients must be ready to log in again when they stop hearing from the server.
+#
+#  You give the supervisor a factory function that builds a complete, unstarted dispatcher
+#  for one worker.  It's called inside the worker process with the worker's index, so it must
+#  be a module-level function if your platform spawns processes rather than forking them.
+#  For example:
+#
+#      def MakeShard(index):
+#          theServer = dispatcher.EventDispatcher()
+#          theProtocol = realtime.RealtimeServer(core = True)
+#          theTransport = udp.Udp(isserver=True, clienthost='', clientport=8888,
+#                                 reuseport=True, owner=theProtocol)
+#          theProtocol.SetTransport(theTransport)
+#          theProtocol.BindTransport()
+#          theServer.AddProtocol(theProtocol)
+#          return theServer
+#
+#      supervisor = shard.ShardSupervisor(factory=MakeShard)
+#      supervisor.Start()
+#      while keepGoing:
+#          supervisor.Update()
+#          time.sleep(0.5)
+#      supervisor.Stop()
+
+## Stats that are the largest of something rather than counts, so the workers' values are
+#  combined by taking the largest.
+MAXIMUM_STATS = ('processing_delay_max', 'tick')
+
+## Stats that are averages rather than counts, so the workers' values are combined by averaging
+#  them, each weighted by another of the worker's stats, or equally if the weight is None.
+AVERAGE_STATS = { 'network_rtt' : 'connections',
+                  'processing_delay' : None,
+                }
+
+## Runs one worker.  This is the target of each worker process and should not be called
+#  directly.
+#
+#  @param factory the function that builds the worker's dispatcher.
+#  @param index the index of this worker, passed to the factory.
+#  @param stopEvent a multiprocessing Event that is set when the worker must quit.
+#  @param statsQueue a multiprocessing Queue the worker reports its stats on.
+#  @param interval how often, in seconds, the worker reports its stats.
+def _RunShard(factory, index, stopEvent, statsQueue, interval):
+    theServer = factory(index)
+    theServer.Start()
+    
+    lastReport = 0.0
+    
+    try:
+        while not stopEvent.is_set():
+            timestep = time.time()
+            
+            theServer.Update(timestep)
+            
+            if (timestep - lastReport) >= interval:
+                statsQueue.put( (index, os.getpid(), theServer.Stats() ) )
+                lastReport = timestep
+            
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    
+    theServer.Stop()
+
+## Starts, watches and restarts the worker processes of a sharded server, and adds up the stats
+#  they report.
+class ShardSupervisor(object):
+    ## The function that builds a dispatcher for one worker.
+    __factory = None
+    
+    ## The number of workers.
+    __count = None
+    
+    ## How often, in seconds, workers report their stats.
+    __interval = None
+    
+    ## The worker processes, indexed by worker index.
+    __workers = None
+    
+    ## The most recent stats reported by each worker, indexed by worker index.
+    __stats = None
+    
+    ## How many times each worker has been restarted, indexed by worker index.
+    __restarts = None
+    
+    ## Set to tell the workers to quit.
+    __stopEvent = None
+    
+    ## Workers report their stats here.
+    __statsQueue = None
+    
+    ## The multiprocessing context used to create workers.
+    __context = None
+    
+    ## Pass any of the following keyword arguments:
+    #      factory : a function taking the worker index and returning an unstarted dispatcher.
+    #                Required.
+    #      workers : the number of worker processes.  Defaults to the number of CPUs.
+    #      interval : how often, in seconds, workers report their stats.  Default is 1.0.
+    #      context : a multiprocessing context, if you need a particular start method.
+    def __init__(self, **args):
+        self.__factory = args['factory']
+        
+        self.__count = os.cpu_count() or 1
+        if 'workers' in args:
+            self.__count = int(args['workers'])
+        
+        self.__interval = 1.0
+        if 'interval' in args:
+            self.__interval = args['interval']
+        
+        self.__context = multiprocessing.get_context()
+        if 'context' in args:
+            self.__context = args['context']
+        
+        self.__workers = {}
+        self.__stats = {}
+        self.__restarts = {}
+        
+        self.__stopEvent = self.__context.Event()
+        self.__statsQueue = self.__context.Queue()
+    
+    ## Starts every worker.
+    def Start(self):
+        for index in range(self.__count):
+            self.__restarts[index] = 0
+            self.__spawn(index)
+    
+    ## Call this regularly from the supervising process.  It restarts any worker that has died
+    #  and collects the stats the workers have reported since the last call.
+    def Update(self):
+        if not self.__stopEvent.is_set():
+            for index, worker in list(self.__workers.items() ):
+                if not worker.is_alive():
+                    print("Shard " + str(index) + " exited with code " + str(worker.exitcode) + ", restarting.")
+                    worker.join()
+                    
+                    self.__stats.pop(index, None)
+                    self.__restarts[index] += 1
+                    self.__spawn(index)
+        
+        self.__collect()
+    
+    ## Takes the stats the workers have reported off the queue.
+    def __collect(self):
+        while True:
+            try:
+                index, pid, stats = self.__statsQueue.get_nowait()
+            except queue.Empty:
+                break
+            
+            # Ignore late reports from a worker that has since been replaced.
+            if index in self.__workers and self.__workers[index].pid == pid:
+                self.__stats[index] = stats
+    
+    ## Stops every worker.  Workers that don't quit within timeout seconds are terminated.
+    def Stop(self, timeout=5.0):
+        self.__stopEvent.set()
+        
+        deadline = time.time() + timeout
+        
+        # A worker can't exit until everything it put on the queue has gone down the pipe, so the
+        # queue is drained while they quit.
+        while self.Alive() > 0 and time.time() < deadline:
+            self.__collect()
+            time.sleep(0.01)
+        
+        self.__collect()
+        
+        for worker in self.__workers.values():
+            if worker.is_alive():
+                worker.terminate()
+            
+            worker.join()
+        
+        self.__workers = {}
+    
+    ## Returns the number of workers that are currently running.
+    def Alive(self):
+        return len([w for w in self.__workers.values() if w.is_alive()])
+    
+    ## Returns the most recent stats reported by one worker, or None if it hasn't reported yet.
+    #
+    #  @param index the index of the worker.
+    def ShardStats(self, index):
+        if index in self.__stats:
+            return dict(self.__stats[index])
+        
+        return None
+    
+    ## Returns the stats of every worker added together, except for those in MAXIMUM_STATS and
+    #  AVERAGE_STATS, which are combined as those describe, and delta_cache_hit_rate, which is
+    #  worked out again from the total hits and misses.  There are also a few keys describing
+    #  the shards themselves:
+    #      'workers' : the number of workers running
+    #      'reporting' : the number of workers that have reported stats
+    #      'restarts' : the total number of times workers have been restarted
+    def Stats(self):
+        total = {}
+        
+        for stats in self.__stats.values():
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        
+        for key in MAXIMUM_STATS:
+            values = [ stats[key] for stats in self.__stats.values() if key in stats ]
+            
+            if len(values) > 0:
+                total[key] = max(values)
+        
+        for key, weightKey in AVERAGE_STATS.items():
+            reporting = [ stats for stats in self.__stats.values() if key in stats ]
+            
+            if len(reporting) == 0:
+                continue
+            
+            weights = [ stats.get(weightKey, 0) if weightKey is not None else 1 for stats in reporting ]
+            
+            if sum(weights) > 0:
+                total[key] = sum(stats[key] * weight for stats, weight in zip(reporting, weights) ) / sum(weights)
+            else:
+                total[key] = sum(stats[key] for stats in reporting) / len(reporting)
+        
+        # A ratio of two counts, so it's worked out again from their totals.
+        if 'delta_cache_hit_rate' in total:
+            lookups = total['delta_cache_hits'] + total['delta_cache_misses']
+            total['delta_cache_hit_rate'] = total['delta_cache_hits'] / lookups if lookups > 0 else 0.0
+        
+        total['workers'] = self.Alive()
+        total['reporting'] = len(self.__stats)
+        total['restarts'] = sum(self.__restarts.values() )
+        
+        return total
+    
+    ## Creates and starts the worker process for one index.
+    def __spawn(self, index):
+        worker = self.__context.Process(target=_RunShard,
+                                        args=(self.__factory,
+                                              index,
+                                              self.__stopEvent,
+                                              self.__statsQueue,
+                                              self.__interval),
+                                        name="shard-" + str(index),
+                                        daemon=True)
+        worker.start()
+        
+        self.__workers[index] = worker
@@ -44,6 +44,11 @@ class dngCallbackNotImplemented(dngException, NotImplementedError):
 class dngSyncAttributeTypeError(dngException, TypeError):
     pass
 
+## Thrown when someone tries to set an nSyncObject's attribute to a value outside the range it
+#  was declared with.
+class dngSyncAttributeRangeError(dngException, ValueError):
+    pass
+
 ## Thrown when someone tries to add an attribute to an nSyncObject that has already been added.
 class dngSyncObjectAttributeError(dngException, Exception):
     pass
@@ -18,123 +18,214 @@
 
 '''
 
-import struct
+
+import operator, struct
 
 from davenetgame import exceptions
 
-## This class stores attributes that will be synced over the network.  It is a generic class
-#  that supports the standard built-in Python types.  As long as you only need those, then this
-#  class is all you need.
+## Returns the name of the slot that holds the value of the attribute with the given name.
+def SlotName(name):
+    return '_sv_' + name
+
+## This class declares an attribute that will be synced over the network.  Attributes are declared
+#  in the body of an nSyncObject subclass, and the class keeps one instance per attribute, not one
+#  per object:
+#
+#      class Ship(sync.nSyncObject):
+#          x = builtin.nSyncAttributeFloat(initial=0.0)
+#          hp = builtin.nSyncAttributeInt(initial=100)
+#
+#  The value of each attribute is kept in a slot of the object.  Until the class is registered
+#  with sync.RegisterGameObjectType, the declaration itself is the descriptor for the attribute,
+#  which works but is slow.  Registering the class compiles each attribute into a descriptor that
+#  reads the slot directly and only does the bookkeeping needed for syncing when it's written:
+#  the attribute's bit is set in the object's dirty mask, and the object is added to the set of
+#  objects that changed since the last sync.
+#
+#  Subclasses provide the type and the encoding.  It's a generic class that supports the
+#  standard built-in Python types, see builtin.py.
 class nSyncAttributeBase(object):
-    ## The name of the attribute.  This probably isn't useful for this class to know, but hey,
-    #  someday an instance of this class may need to go where everybody knows your name, and that
-    #  won't be true of the instance doesn't know its own name.
+    ## The name of the attribute, as it's declared in the class.
     _name = None
     
     ## The id for this attribute.  It'll be used to encode the attribute to send over the wire.
+    #  Attributes are numbered in the order they're declared, starting with the base classes.
     _id = None
     
-    ## The actual value of the attribute.
-    _value = None
+    ## The initial value of the attribute in every new object.
+    _initial = None
     
     ## The type of the attribute.  Must be a type object.
     _type = None
     
-    ## Marks whether or not the attribute has been changed since it was last synced.
-    _isdirty = None
+    ## The name of the slot that holds the value.
+    _slot = None
+    
+    ## The slot's own descriptor, which reads and writes the value without any bookkeeping.
+    _member = None
+    
+    ## The struct format of the value, for attributes whose values are always the same size.
+    #  Attributes with values of varying size, like strings, leave it None and implement
+    #  EncodeValue and DecodeValue instead.
+    _format = None
     
-    ## Initializes the class.  attrDesc should be a dictionary describing the attribute that this
-    #  object will represent.  Consult nSyncObject for the description of this dictionary.
-    #  The attribute will be marked dirty initially, because it is dirty when created new.  This will
-    #  result in the entire nSyncObject being synced with initial values as soon as it is created,
-    #  and this is desired behavior.
+    ## True for attributes that are only ever sent bit-packed.  An object type with any of them is
+    #  laid out by layout.nBitLayout.  See packed.py.
+    _packed = False
+    
+    ## True for attributes whose values must be in a range.  Every value they're set to is
+    #  checked, not only values that aren't exactly of the attribute's type.
+    _ranged = False
+    
+    ## Declares the attribute.  attrDesc is a dictionary describing the attribute:
+    #
+    #      'initial' : The initial value.  This is required, and it must be an instance of the
+    #                  attribute's type.
+    #      'type' : The type of the attribute.  Must be a type object.  Subclasses for the
+    #               builtin types set this themselves.
     def __init__(self, **attrDesc):
-        self._name = attrDesc['name']
-        self._type = attrDesc['type']
-        self._value = attrDesc['value']
-        self._isdirty = True
-        self._id = attrDesc['id']
+        if 'type' in attrDesc:
+            self._type = attrDesc['type']
         
-    ## Just a generic way to return a string.  Subclasses should reimplement this, of course.
-    def __str__(self):
-        return str(self._value)
+        if 'initial' not in attrDesc:
+            raise exceptions.dngSyncObjectAttributeError("Sync attributes must have an initial value")
         
+        self._initial = self.Check(attrDesc['initial'])
+    
+    ## Called by Python when the class declaring the attribute is created.
+    def __set_name__(self, owner, name):
+        self._name = name
+        self._slot = SlotName(name)
+    
+    ## Just a generic way to return a string.
+    def __str__(self):
+        return self._name
+    
     ## Returns the id for this attribute
     def id(self):
         return self._id
     
-    def GetFormatString(self):
-        raise dngExceptionNotImplemented("GetFormatString must be implemented in nSyncAttribute classes")
-        
-    ## Encode the data in this attribute.  Must be implemented by subclasses.
-    def Encode(self):
-        raise dngExceptionNotImplemented("Encode must be implemented in nSyncAttribute classes")
+    ## Returns the name of this attribute
+    def Name(self):
+        return self._name
     
-    ## Checks to see if this attribute has been changed since the last time it was synced.
-    def IsDirty(self):
-        return self._isdirty
+    ## Returns the name of the slot that holds the value
+    def Slot(self):
+        return self._slot
     
-    ## Change the dirty bit.  By default, it sets the dirty bit to False, making it clean.
-    def SetDirty(self, dirty = False):
-        self._isdirty = dirty
+    ## Returns the initial value
+    def Initial(self):
+        return self._initial
     
     ## This is the method that should be called when you want to know the type of the attribute
-    #  that this class represents.  It would break all sorts of things if we override python's
-    #  builtins to hide the fact that the actual type of this object is nSyncAttribute.
+    #  that this class represents.
     def Type(self):
         return self._type
     
-    ## Gets the value of the attribute for syncing.  Automatically changes the _isdirty value to false,
-    #  indicating that the attribute has been synced.  Further calls will still return the value,
-    #  but in the case of a multi-threaded situation, the value might change, resulting in inconsistent
-    #  syncs, so it is best for the calling code to cache the value so that it can create all of the
-    #  sync messages it needs to send after calling this method only once.
-    def _get_attribute_sync(self):
-        self._isdirty = False
-        return self._value
-    
-    ## Sets the value of the attribute during syncing.  This sets the _isdirty flag to false and
-    #  should only be used internally.  This should only be called in response to receiving a network
-    #  sync message.
-    def _sync_attribute(self, value):
-        self._isdirty = False
-        self._value = value
-    
-    ## Overrides the default __getattribute__ behavior.  There's actually not a lot of point of doing
-    #  this, really, but we do it anyway.
-    def __getattribute__(self, name):
-        # The entire purpose of this if statement is to protect the name "_value" from being overridden.
-        # It's not perfect, but a programmer would be dumb to bother changing it.
-        if name == "_value":
-            self.GetAttribute("_value")
-        else:
-            return super().__getattribute__(name)
-    
-    ## Called to set the actual attribute.  This will only be called when it is the syncable
-    #  attribute, and it will never be called for regular python attributes.  Type-checking will
-    #  be done before this call, so all subclasses need to worry about is setting the attribute
-    #  correctly.  Default implementation should work for most cases.
-    def SetAttribute(self, name, value):
-        super().__setattr__(name, value)
+    ## Called by the nSyncObject metaclass once the class is created and the slot exists.
+    #
+    #  @param attrId the id of the attribute.
+    #  @param member the slot's descriptor.
+    def _bind(self, attrId, member):
+        if self._id is not None and self._id != attrId:
+            raise exceptions.dngSyncObjectAttributeError("Sync attribute " + self._name + " can't have two ids")
+        
+        self._id = attrId
+        self._member = member
+    
+    ## Type checks a value, and converts it if there's a lossless conversion.  We throw an
+    #  exception to make sure nobody tries to give us a type that we can't later encode into a
+    #  network message.  This is also where all other possible options for attributes get checked
+    #  and enforced, if need be.
+    #
+    #  @returns the value to store.
+    def Check(self, value):
+        if not isinstance(value, self._type):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be " + self._type.__name__)
+        
+        return value
+    
+    ## Returns the struct format of every value of this attribute, or None if their size varies.
+    #  Used by gameobjects.layout to pack the values of an object together.
+    def Format(self):
+        return self._format
+    
+    ## Returns True if the attribute is only ever sent bit-packed.
+    def Packed(self):
+        return self._packed
+    
+    ## Returns the struct format of the value.  Must be implemented by subclasses.
+    def GetFormatString(self, value):
+        raise exceptions.dngExceptionNotImplemented("GetFormatString must be implemented in nSyncAttribute classes")
+    
+    ## Encode a value of this attribute, along with the attribute's id.
+    def Encode(self, value):
+        return struct.pack("!I" + self.GetFormatString(value), self._id, value)
+    
+    ## Encode a value of this attribute, without the id.
+    def EncodeValue(self, value):
+        return struct.pack("!" + self.GetFormatString(value), value)
+    
+    ## Decodes a value encoded by EncodeValue.
+    #
+    #  @param data the buffer holding the value.
+    #  @param offset where the value starts in data.
+    #  @returns a tuple of the value and the offset just past it.
+    def DecodeValue(self, data, offset):
+        fmt = struct.Struct("!" + self.GetFormatString(self._initial) )
+        
+        return (fmt.unpack_from(data, offset)[0], offset + fmt.size)
+    
+    ## Writes a value to a bits.nBitWriter, for types laid out by layout.nBitLayout.  Attributes
+    #  that aren't packed write the value as EncodeValue encodes it.
+    def WriteBits(self, writer, value):
+        writer.WriteBytes(self.EncodeValue(value) )
+    
+    ## Reads a value written by WriteBits from a bits.nBitReader.
+    def ReadBits(self, reader):
+        fmt = struct.Struct("!" + self.GetFormatString(self._initial) )
+        
+        return fmt.unpack(reader.ReadBytes(fmt.size) )[0]
+    
+    ## Returns this attribute's bit in an object's dirty mask.
+    def Bit(self):
+        return 1 << self._id
+    
+    ## Builds the descriptor that replaces this declaration in a registered class.  Reads go
+    #  straight to the slot through a C-level getter, so they cost about as much as reading any
+    #  instance attribute.  Writes are type checked, and range checked for ranged attributes, and
+    #  mark the attribute dirty.  An object is only added to the dirty set when its first
+    #  attribute changes.
+    #
+    #  @param objType the class being registered.
+    #  @param dirtySet the set of objects that changed since the last sync.
+    def Compile(self, objType, dirtySet):
+        store = self._member.__set__
+        check = self.Check
+        exact = None if self._ranged else self._type
+        bit = self.Bit()
+        mark = dirtySet.add
+        
+        def setter(obj, value):
+            if type(value) is not exact:
+                value = check(value)
+            
+            store(obj, value)
+            
+            mask = obj._dirty
+            if not mask:
+                mark(obj)
+            obj._dirty = mask | bit
+        
+        return property(operator.attrgetter(self._slot), setter, None, "Synced attribute " + self._name)
+    
+    ## The descriptor used before the class is registered.
+    def __get__(self, obj, objType=None):
+        if obj is None:
+            return self
         
-    ## Called to get the value of an attribute.  Most subclasses can ignore this.  Like
-    #  SetAttribute, it will only be called on syncable attributes.  All other attributes
-    #  are handled through python's normal mechanisms.
-    def GetAttribute(self, name):
-        return super().__getattribute__(name)
-    
-    ## Overrides the default __setattr__ behavior to make sure we do the necessary housekeeping
-    #  when the actual value of the attribute being synced is done.  Also, we type check that value
-    #  and throw an exception to make sure nobody tries to give us a type that we can't later encode
-    #  into a network message.  This is also where all other possible options for attributes
-    #  get checked and enforced, if need be.
-    def __setattr__(self, name, value):
-        if name == "_value":
-            if isinstance(value, self._type):
-                super().__setattr__("_isdirty", True)
-                self.SetAttribute("_value", value)
-            else:
-                raise exceptions.dngSyncAttributeTypeError
-        else:
-            super().__setattr__(name, value)
+        return self._member.__get__(obj, objType)
     
+    def __set__(self, obj, value):
+        self._member.__set__(obj, self.Check(value) )
+        obj._MarkDirty(self.Bit() )
@@ -18,83 +18,85 @@
 
 '''
 
+
 import struct
 
+from davenetgame import exceptions
 from davenetgame.gameobjects.attributes import base
 
 ## @file This file provides attribute classes for all of python's builtin types.
 
-## Integer attributes.
+## The length in front of an encoded string.
+_LENGTH = struct.Struct("!H")
+
+## Integer attributes.  Sent as a signed 64-bit integer.
 class nSyncAttributeInt(base.nSyncAttributeBase):
-    ## Initializes the class.  attrDesc should be a dictionary describing the attribute that this
-    #  object will represent.  Consult nSyncObject for the description of this dictionary.
-    #  The attribute will be marked dirty initially, because it is dirty when created new.  This will
-    #  result in the entire nSyncObject being synced with initial values as soon as it is created,
-    #  and this is desired behavior.
+    _format = "q"
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always int, regardless of what was passed in.
     def __init__(self, **attrDesc):
-        # Force the type to be an int, regardless of what was passed in.
-        attrdesc['type'] = int
-        super().__init__(attrDesc)
-        
-    def __str__(self):
-        return str(self._value)
-        
-    def GetFormatString(self):
-        return "Iq"
-            
-    def Encode(self):
-        fmt = self.GetFormatString()
+        attrDesc['type'] = int
+        super().__init__(**attrDesc)
+    
+    ## bool is an int to Python, but not to us.
+    def Check(self, value):
+        if type(value) is bool or not isinstance(value, int):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be int")
         
-        if fmt is not None:
-            return struct.pack("!" + fmt, self._id, self._value)
+        return int(value)
     
+    def GetFormatString(self, value):
+        return "q"
+
+## Float attributes.  Sent as a double.
 class nSyncAttributeFloat(base.nSyncAttributeBase):
-    ## Initializes the class.  attrDesc should be a dictionary describing the attribute that this
-    #  object will represent.  Consult nSyncObject for the description of this dictionary.
-    #  The attribute will be marked dirty initially, because it is dirty when created new.  This will
-    #  result in the entire nSyncObject being synced with initial values as soon as it is created,
-    #  and this is desired behavior.
+    _format = "d"
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always float, regardless of what was passed in.
     def __init__(self, **attrDesc):
-        # Force the type to be an float, regardless of what was passed in.
-        attrdesc['type'] = float
-        super().__init__(attrDesc)
-        
-    def __str__(self):
-        return str(self._value)
-        
-    def GetFormatString(self):
-        return "Id"
-
-    def Encode(self):
-        fmt = self.GetFormatString()
+        attrDesc['type'] = float
+        super().__init__(**attrDesc)
+    
+    ## Ints are accepted and stored as floats.
+    def Check(self, value):
+        if type(value) is bool or not isinstance(value, (int, float) ):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be float")
         
-        if fmt is not None:
-            return struct.pack("!" + fmt, self._id, self._value)
+        return float(value)
     
+    def GetFormatString(self, value):
+        return "d"
+
+## String attributes.  Sent as UTF-8, after its length.
 class nSyncAttributeString(base.nSyncAttributeBase):
-    ## Initializes the class.  attrDesc should be a dictionary describing the attribute that this
-    #  object will represent.  Consult nSyncObject for the description of this dictionary.
-    #  The attribute will be marked dirty initially, because it is dirty when created new.  This will
-    #  result in the entire nSyncObject being synced with initial values as soon as it is created,
-    #  and this is desired behavior.
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always str, regardless of what was passed in.
     def __init__(self, **attrDesc):
-        # Force the type to be an float, regardless of what was passed in.
-        attrdesc['type'] = unicode
-        super().__init__(attrDesc)
-        
-    def __str__(self):
-        return str(self._value)
+        attrDesc['type'] = str
+        super().__init__(**attrDesc)
+    
+    def GetFormatString(self, value):
+        return "H" + str(len(value.encode('utf-8') ) ) + "s"
+    
+    def Encode(self, value):
+        data = value.encode('utf-8')
         
-    def GetFormatString(self):
+        return struct.pack("!IH" + str(len(data) ) + "s", self._id, len(data), data)
+    
+    def EncodeValue(self, value):
+        data = value.encode('utf-8')
         
-        return "Id"
-
-    def Encode(self):
-        fmt = self.GetFormatString()
+        return _LENGTH.pack(len(data) ) + data
+    
+    def DecodeValue(self, data, offset):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
         
-        if fmt is not None:
-            return struct.pack("!" + fmt, self._id, self._value)
+        return (bytes(data[offset:offset + length]).decode('utf-8'), offset + length)
     
-
-
-            
+    def ReadBits(self, reader):
+        length, = _LENGTH.unpack(reader.ReadBytes(_LENGTH.size) )
+        
+        return reader.ReadBytes(length).decode('utf-8')
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+
+import math
+
+from davenetgame import exceptions
+from davenetgame.gameobjects.attributes import base
+
+## @file This file provides attribute classes that are sent bit-packed, in as few bits as their
+#  declarations allow.  An object type with any of them is laid out by layout.nBitLayout, which
+#  packs all of its values, and its dirty mask, into one run of bits:
+#
+#      class Ship(sync.nSyncObject):
+#          x = packed.nSyncAttributeQuantizedFloat(initial=0.0, minimum=-512.0, maximum=512.0, precision=0.02)
+#          y = packed.nSyncAttributeQuantizedFloat(initial=0.0, minimum=-512.0, maximum=512.0, precision=0.02)
+#          hp = packed.nSyncAttributeRangedInt(initial=100, minimum=0, maximum=100)
+#          boosting = packed.nSyncAttributeBool(initial=False)
+#
+#  Here a change to the position is sent in 5 bytes after the object ID, rather than the 24
+#  bytes of a mask and two doubles.  The attributes of the builtin classes can be mixed in, and
+#  are packed as they'd otherwise be encoded.
+
+## Bool attributes.  Sent as one bit.
+class nSyncAttributeBool(base.nSyncAttributeBase):
+    _packed = True
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always bool, regardless of what was passed in.
+    def __init__(self, **attrDesc):
+        attrDesc['type'] = bool
+        super().__init__(**attrDesc)
+    
+    def GetFormatString(self, value):
+        return "?"
+    
+    def WriteBits(self, writer, value):
+        writer.WriteBool(value)
+    
+    def ReadBits(self, reader):
+        return reader.ReadBool()
+
+## Integer attributes with a range.  Sent in just enough bits for every value in the range.
+class nSyncAttributeRangedInt(base.nSyncAttributeBase):
+    _packed = True
+    _ranged = True
+    
+    ## The smallest and largest values allowed.
+    _minimum = None
+    _maximum = None
+    
+    ## The number of bits each value is sent in.
+    _bits = None
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always int, regardless of what was passed in.  attrDesc also needs:
+    #
+    #      'minimum' : the smallest value allowed.
+    #      'maximum' : the largest value allowed.
+    def __init__(self, **attrDesc):
+        if 'minimum' not in attrDesc or 'maximum' not in attrDesc:
+            raise exceptions.dngSyncObjectAttributeError("Ranged int attributes must have a minimum and a maximum")
+        
+        self._minimum = int(attrDesc['minimum'])
+        self._maximum = int(attrDesc['maximum'])
+        
+        if self._maximum < self._minimum:
+            raise exceptions.dngSyncObjectAttributeError("The maximum of a ranged int attribute can't be less than its minimum")
+        
+        self._bits = (self._maximum - self._minimum).bit_length()
+        
+        attrDesc['type'] = int
+        super().__init__(**attrDesc)
+    
+    ## Returns the number of bits each value is sent in.
+    def Bits(self):
+        return self._bits
+    
+    def Check(self, value):
+        if type(value) is bool or not isinstance(value, int):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be int")
+        
+        if value < self._minimum or value > self._maximum:
+            raise exceptions.dngSyncAttributeRangeError("Sync attribute " + str(self._name) + " must be from " + str(self._minimum) + " to " + str(self._maximum) )
+        
+        return int(value)
+    
+    def GetFormatString(self, value):
+        return "q"
+    
+    def WriteBits(self, writer, value):
+        writer.WriteBits(value - self._minimum, self._bits)
+    
+    def ReadBits(self, reader):
+        return reader.ReadBits(self._bits) + self._minimum
+
+## Integer attributes of any size.  Sent as a varint, zigzagged if they can be negative, so small
+#  values take a byte and larger ones a byte more for every 7 bits.
+class nSyncAttributeVarInt(base.nSyncAttributeBase):
+    _packed = True
+    
+    ## True if values can be negative.
+    _signed = None
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always int, regardless of what was passed in.  attrDesc can also have:
+    #
+    #      'signed' : False if the values are never negative, which saves the zigzag's bit.
+    #                 Defaults to True.
+    def __init__(self, **attrDesc):
+        self._signed = attrDesc.get('signed', True)
+        self._ranged = not self._signed
+        
+        attrDesc['type'] = int
+        super().__init__(**attrDesc)
+    
+    def Check(self, value):
+        if type(value) is bool or not isinstance(value, int):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be int")
+        
+        if not self._signed and value < 0:
+            raise exceptions.dngSyncAttributeRangeError("Sync attribute " + str(self._name) + " can't be negative")
+        
+        return int(value)
+    
+    def GetFormatString(self, value):
+        return "q"
+    
+    def WriteBits(self, writer, value):
+        if self._signed:
+            writer.WriteSigned(value)
+        else:
+            writer.WriteVarint(value)
+    
+    def ReadBits(self, reader):
+        if self._signed:
+            return reader.ReadSigned()
+        
+        return reader.ReadVarint()
+
+## Float attributes with a range and a precision.  Sent as the number of steps of the precision
+#  from the minimum, in just enough bits for the whole range, so the receiving end gets the value
+#  rounded to the precision.  The sending end keeps the value it was set to.
+class nSyncAttributeQuantizedFloat(base.nSyncAttributeBase):
+    _packed = True
+    _ranged = True
+    
+    ## The smallest and largest values allowed, and the precision they're sent with.
+    _minimum = None
+    _maximum = None
+    _precision = None
+    
+    ## The number of steps of the precision in the range, and the number of bits that takes.
+    _steps = None
+    _bits = None
+    
+    ## Declares the attribute.  Consult nSyncAttributeBase for the description of attrDesc.
+    #  The type is always float, regardless of what was passed in.  attrDesc also needs:
+    #
+    #      'minimum' : the smallest value allowed.
+    #      'maximum' : the largest value allowed.
+    #      'precision' : the largest difference between a value and the value received.
+    #                    Values are rounded to the nearest multiple of it from the minimum.
+    def __init__(self, **attrDesc):
+        if 'minimum' not in attrDesc or 'maximum' not in attrDesc or 'precision' not in attrDesc:
+            raise exceptions.dngSyncObjectAttributeError("Quantized float attributes must have a minimum, a maximum and a precision")
+        
+        self._minimum = float(attrDesc['minimum'])
+        self._maximum = float(attrDesc['maximum'])
+        self._precision = float(attrDesc['precision'])
+        
+        if self._maximum < self._minimum or self._precision <= 0.0:
+            raise exceptions.dngSyncObjectAttributeError("Quantized float attributes need a maximum no less than their minimum, and a positive precision")
+        
+        self._steps = math.ceil( (self._maximum - self._minimum) / self._precision)
+        self._bits = self._steps.bit_length()
+        
+        attrDesc['type'] = float
+        super().__init__(**attrDesc)
+    
+    ## Returns the number of bits each value is sent in.
+    def Bits(self):
+        return self._bits
+    
+    ## Ints are accepted and stored as floats.
+    def Check(self, value):
+        if type(value) is bool or not isinstance(value, (int, float) ):
+            raise exceptions.dngSyncAttributeTypeError("Sync attribute " + str(self._name) + " must be float")
+        
+        if not self._minimum <= value <= self._maximum:
+            raise exceptions.dngSyncAttributeRangeError("Sync attribute " + str(self._name) + " must be from " + str(self._minimum) + " to " + str(self._maximum) )
+        
+        return float(value)
+    
+    def GetFormatString(self, value):
+        return "d"
+    
+    def WriteBits(self, writer, value):
+        writer.WriteBits(min(round( (value - self._minimum) / self._precision), self._steps), self._bits)
+    
+    def ReadBits(self, reader):
+        return min(self._minimum + reader.ReadBits(self._bits) * self._precision, self._maximum)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+from davenetgame import exceptions
+
+## @file
+#  Bit-level writing and reading, for sync objects laid out by layout.nBitLayout.  Values are
+#  written most significant bit first, one after another with no padding between them, and the
+#  last byte is padded with zeros.  Besides plain fields of a given number of bits, there are
+#  varints, which take a byte for every 7 bits of the value, and zigzag varints for signed
+#  values, which keep small negative values as short as small positive ones.
+
+## Maps a signed integer to an unsigned one: 0, -1, 1, -2, 2 become 0, 1, 2, 3, 4.
+def ZigZag(value):
+    if value < 0:
+        return (-value << 1) - 1
+    
+    return value << 1
+
+## Undoes ZigZag.
+def UnZigZag(value):
+    if value & 1:
+        return -( (value + 1) >> 1)
+    
+    return value >> 1
+
+## Writes values a few bits at a time.  Whole bytes are moved out of the accumulator as soon as
+#  they're filled, so it never holds more than a byte's worth of bits between writes.
+class nBitWriter(object):
+    ## The whole bytes written so far.
+    __buf = None
+    
+    ## The bits written that don't make up a whole byte yet, and how many there are.
+    __acc = None
+    __count = None
+    
+    def __init__(self):
+        self.Clear()
+    
+    ## Forgets everything written, so the writer can be used again.
+    def Clear(self):
+        self.__buf = bytearray()
+        self.__acc = 0
+        self.__count = 0
+    
+    ## Writes the low count bits of value.
+    def WriteBits(self, value, count):
+        acc = (self.__acc << count) | (value & ( (1 << count) - 1) )
+        count += self.__count
+        
+        if count >= 8:
+            spare = count & 7
+            self.__buf += (acc >> spare).to_bytes(count >> 3, 'big')
+            acc &= (1 << spare) - 1
+            count = spare
+        
+        self.__acc = acc
+        self.__count = count
+    
+    ## Writes a bool as one bit.
+    def WriteBool(self, value):
+        self.WriteBits(1 if value else 0, 1)
+    
+    ## Writes a non-negative integer as a varint: 7 bits at a time, lowest first, each with a bit
+    #  in front saying whether more follow.
+    def WriteVarint(self, value):
+        while value > 0x7f:
+            self.WriteBits(0x80 | (value & 0x7f), 8)
+            value >>= 7
+        
+        self.WriteBits(value, 8)
+    
+    ## Writes a signed integer as a zigzag varint.
+    def WriteSigned(self, value):
+        self.WriteVarint(ZigZag(value) )
+    
+    ## Writes bytes, which needn't start on a byte boundary.
+    def WriteBytes(self, data):
+        if self.__count == 0:
+            self.__buf += data
+        elif len(data) > 0:
+            self.WriteBits(int.from_bytes(data, 'big'), len(data) * 8)
+    
+    ## Returns the number of bits written.
+    def BitCount(self):
+        return len(self.__buf) * 8 + self.__count
+    
+    ## Returns everything written, with the last byte padded.
+    def Bytes(self):
+        if self.__count == 0:
+            return bytes(self.__buf)
+        
+        return bytes(self.__buf) + bytes( (self.__acc << (8 - self.__count), ) )
+
+## Reads values written by an nBitWriter.
+class nBitReader(object):
+    ## The data being read.
+    __data = None
+    
+    ## The position of the next bit to read, counted from the start of data.
+    __position = None
+    
+    ## @param data the data to read.
+    #  @param offset the byte offset to start reading at.
+    def __init__(self, data, offset=0):
+        self.__data = data
+        self.__position = offset * 8
+    
+    ## Reads count bits as an unsigned integer.
+    def ReadBits(self, count):
+        position = self.__position
+        start = position >> 3
+        end = (position + count + 7) >> 3
+        
+        if end > len(self.__data):
+            raise exceptions.dngException("Tried to read past the end of the bits")
+        
+        chunk = int.from_bytes(self.__data[start:end], 'big')
+        
+        self.__position = position + count
+        
+        return (chunk >> ( (end << 3) - position - count) ) & ( (1 << count) - 1)
+    
+    ## Reads a bool written as one bit.
+    def ReadBool(self):
+        return self.ReadBits(1) == 1
+    
+    ## Reads a varint.
+    def ReadVarint(self):
+        value = 0
+        shift = 0
+        
+        while True:
+            byte = self.ReadBits(8)
+            value |= (byte & 0x7f) << shift
+            
+            if byte < 0x80:
+                return value
+            
+            shift += 7
+    
+    ## Reads a zigzag varint.
+    def ReadSigned(self):
+        return UnZigZag(self.ReadVarint() )
+    
+    ## Reads count bytes.
+    def ReadBytes(self, count):
+        if self.__position & 7 == 0:
+            start = self.__position >> 3
+            
+            if start + count > len(self.__data):
+                raise exceptions.dngException("Tried to read past the end of the bits")
+            
+            self.__position += count * 8
+            
+            return bytes(self.__data[start:start + count])
+        
+        return self.ReadBits(count * 8).to_bytes(count, 'big')
+    
+    ## Returns the byte offset just past the last bit read, as if the rest of its byte were
+    #  padding.
+    def Offset(self):
+        return (self.__position + 7) >> 3
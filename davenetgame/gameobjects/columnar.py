@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from davenetgame.gameobjects import layout
+
+## @file
+#  Columnar storage for sync objects.  An object type registered with the 'columnar' option keeps
+#  its numeric attributes in typed arrays, one column per attribute, instead of in the objects
+#  themselves.  Each object gets a row in the columns, and a value is 8 bytes in its column, plus
+#  8 for its copy from the previous sync, rather than a Python float or int.  The objects are
+#  still Python objects, so this saves less memory than it might seem.  What it's for is working
+#  on the columns all at once.  With numpy installed, they're numpy arrays, and a game can move
+#  every object of a type in one operation:
+#
+#      store = Bullet._columns
+#      count = store.Count()
+#      store.Column('x')[:count] += store.Column('vx')[:count] * dt
+#
+#  Changes made that way don't go through the attributes, so they can't mark anything dirty.
+#  Instead, each sync compares the columns with their values from the previous sync, which is
+#  also done a column at a time.  Without numpy, the columns are array.array objects, and the
+#  comparison and the encoding are done an object at a time.
+
+## The struct formats the columns can hold, with the array typecode and numpy type for each.
+_TYPES = { 'q' : ('q', 'i8'),
+           'd' : ('d', 'f8'),
+         }
+
+## The number of rows a numpy store starts with.  It doubles whenever it's full.
+INITIAL_ROWS = 64
+
+## Holds the numeric attributes of every object of one type.
+class nColumnStore(object):
+    ## The type whose attributes are stored.
+    __objtype = None
+    
+    ## The columns, indexed by attribute ID.  Attributes that aren't in a column have None.
+    __columns = None
+    
+    ## The values of the columns at the previous sync, indexed like __columns.  With numpy
+    #  they're arrays, otherwise bytes.
+    __previous = None
+    
+    ## The attributes that are in columns.
+    __attributes = None
+    
+    ## The mask of the attributes that are in columns.
+    __mask = None
+    
+    ## The object in each row, or None if the row is free.
+    __objects = None
+    
+    ## The IDs of the objects in each row, for bulk encoding.  Only kept with numpy.
+    __ids = None
+    
+    ## Rows freed by deleted objects, to be reused.
+    __free = None
+    
+    ## The number of rows in use, including free rows below the highest used one.
+    __count = None
+    
+    ## The set of objects that changed since the last sync.
+    __dirty = None
+    
+    ## The numpy record types for bulk encoding, keyed by mask.
+    __dtypes = None
+    
+    ## True if the columns are numpy arrays.
+    __numpy = None
+    
+    ## False if the type has bit-packed attributes, so its records can't be built by numpy.
+    __bulk = None
+    
+    ## @param objType the type whose attributes are stored.
+    #  @param dirtySet the set of objects that changed since the last sync.
+    #  @param useNumpy whether to use numpy arrays.  Defaults to using them if numpy is installed.
+    def __init__(self, objType, dirtySet, useNumpy=None):
+        if useNumpy is None:
+            useNumpy = numpy is not None
+        
+        self.__objtype = objType
+        self.__dirty = dirtySet
+        self.__numpy = useNumpy and numpy is not None
+        self.__objects = []
+        self.__free = []
+        self.__count = 0
+        self.__dtypes = {}
+        self.__mask = 0
+        
+        attributes = objType._syncattributes
+        
+        self.__bulk = not any(attr.Packed() for attr in attributes)
+        
+        self.__columns = [None] * len(attributes)
+        self.__previous = [None] * len(attributes)
+        self.__attributes = []
+        
+        for attr in attributes:
+            if attr.Format() in _TYPES:
+                self.__attributes.append(attr)
+                self.__mask |= attr.Bit()
+        
+        if self.__numpy:
+            for attr in self.__attributes:
+                dtype = numpy.dtype(_TYPES[attr.Format()][1])
+                
+                self.__columns[attr.id()] = numpy.zeros(INITIAL_ROWS, dtype)
+                self.__previous[attr.id()] = numpy.zeros(INITIAL_ROWS, dtype)
+            
+            self.__ids = numpy.zeros(INITIAL_ROWS, numpy.uint32)
+        else:
+            for attr in self.__attributes:
+                self.__columns[attr.id()] = array.array(_TYPES[attr.Format()][0])
+                self.__previous[attr.id()] = b''
+    
+    ## Returns True if the columns are numpy arrays.
+    def UsesNumpy(self):
+        return self.__numpy
+    
+    ## Returns True if attr is stored in a column.
+    def Holds(self, attr):
+        return self.__mask & attr.Bit() != 0
+    
+    ## Returns the mask of the attributes stored in columns.
+    def Mask(self):
+        return self.__mask
+    
+    ## Returns the column of the attribute with the given name.  Rows past Count() are unused.
+    #  The column is replaced when the store grows, so don't keep it from one tick to the next.
+    def Column(self, name):
+        for attr in self.__attributes:
+            if attr.Name() == name:
+                return self.__columns[attr.id()]
+        
+        raise KeyError(name)
+    
+    ## Returns the number of rows in use.  Free rows below that hold their object's initial
+    #  values.
+    def Count(self):
+        return self.__count
+    
+    ## Returns the object in row, or None if the row is free.
+    def Object(self, row):
+        return self.__objects[row]
+    
+    ## Gives obj a row, holding the initial values of its attributes.  obj must have its ID.
+    def Allocate(self, obj):
+        if len(self.__free) > 0:
+            row = self.__free.pop()
+            self.__objects[row] = obj
+        else:
+            row = self.__count
+            self.__count += 1
+            self.__objects.append(obj)
+            
+            if self.__numpy:
+                if row == len(self.__ids):
+                    self.__grow()
+            else:
+                for attr in self.__attributes:
+                    self.__columns[attr.id()].append(attr.Initial() )
+        
+        obj._row = row
+        
+        self.__reset(row)
+        
+        if self.__numpy:
+            self.__ids[row] = obj._id
+    
+    ## Frees the row of obj.
+    def Release(self, obj):
+        row = obj._row
+        
+        if row is None or self.__objects[row] is not obj:
+            return
+        
+        self.__objects[row] = None
+        self.__free.append(row)
+        self.__reset(row)
+        
+        obj._row = None
+    
+    ## Sets the values in row to the initial values.  With numpy, the previous values are set too,
+    #  so a new object isn't seen as changed by its first sync.  Without numpy, a reused row can
+    #  be, which costs an update the client didn't need but is otherwise harmless.
+    def __reset(self, row):
+        for attr in self.__attributes:
+            self.__columns[attr.id()][row] = attr.Initial()
+            
+            if self.__numpy:
+                self.__previous[attr.id()][row] = attr.Initial()
+    
+    ## Doubles the number of rows of the numpy arrays.
+    def __grow(self):
+        size = len(self.__ids) * 2
+        
+        for attr in self.__attributes:
+            for columns in (self.__columns, self.__previous):
+                column = numpy.zeros(size, columns[attr.id()].dtype)
+                column[:len(columns[attr.id()])] = columns[attr.id()]
+                columns[attr.id()] = column
+        
+        ids = numpy.zeros(size, numpy.uint32)
+        ids[:len(self.__ids)] = self.__ids
+        self.__ids = ids
+    
+    ## Returns a function that reads the value of attr from an object, as a Python int or float.
+    def Reader(self, attr):
+        columns = self.__columns
+        attrId = attr.id()
+        
+        if self.__numpy:
+            return lambda obj: columns[attrId].item(obj._row)
+        
+        return lambda obj: columns[attrId][obj._row]
+    
+    ## Returns a function that writes the value of attr to an object, without any bookkeeping.
+    def Writer(self, attr):
+        columns = self.__columns
+        attrId = attr.id()
+        
+        def write(obj, value):
+            columns[attrId][obj._row] = value
+        
+        return write
+    
+    ## Builds the descriptor for attr, which works like the ones built by
+    #  nSyncAttributeBase.Compile, but keeps the value in the attribute's column.
+    def Compile(self, attr):
+        read = self.Reader(attr)
+        columns = self.__columns
+        attrId = attr.id()
+        check = attr.Check
+        exact = attr.Type()
+        bit = attr.Bit()
+        mark = self.__dirty.add
+        
+        def setter(obj, value):
+            if type(value) is not exact:
+                value = check(value)
+            
+            columns[attrId][obj._row] = value
+            
+            mask = obj._dirty
+            if not mask:
+                mark(obj)
+            obj._dirty = mask | bit
+        
+        return property(read, setter, None, "Synced attribute " + attr.Name() )
+    
+    ## Marks dirty every object whose values changed since the previous call, whether through its
+    #  attributes or by writing the columns directly.  Called by the sync list before each sync.
+    def DetectChanges(self):
+        count = self.__count
+        objects = self.__objects
+        dirty = self.__dirty
+        
+        for attr in self.__attributes:
+            column = self.__columns[attr.id()]
+            bit = attr.Bit()
+            
+            if self.__numpy:
+                current = column[:count]
+                previous = self.__previous[attr.id()][:count]
+                
+                # Compare the bits rather than the values, so NaN counts as unchanged.
+                rows = numpy.flatnonzero(current.view(numpy.int64) != previous.view(numpy.int64) ).tolist()
+                
+                previous[:] = current
+            else:
+                current = column.tobytes()
+                previous = self.__previous[attr.id()]
+                self.__previous[attr.id()] = current
+                
+                if current == previous:
+                    continue
+                
+                current = memoryview(current).cast('q')
+                previous = memoryview(previous).cast('q')
+                
+                rows = [ row for row in range(len(previous) ) if current[row] != previous[row] ]
+            
+            for row in rows:
+                obj = objects[row]
+                
+                if obj is not None:
+                    mask = obj._dirty
+                    if not mask:
+                        dirty.add(obj)
+                    obj._dirty = mask | bit
+    
+    ## Returns True if updates for mask can be encoded with EncodeUpdatesInto.  That takes numpy,
+    #  and every attribute in mask has to be in a column, and none of the type's attributes can be
+    #  bit-packed.
+    def CanBulkEncode(self, mask):
+        return self.__numpy and self.__bulk and mask & ~self.__mask == 0
+    
+    ## Encodes objectupdate records for the objects in rows, all with the same mask, into buf.
+    #  The records are exactly what nSyncObject.EncodeUpdateInto would write, but they're built
+    #  by numpy a column at a time.
+    #
+    #  @returns the offset just past the records.
+    def EncodeUpdatesInto(self, rows, mask, buf, offset):
+        dtype = self.__dtypes.get(mask)
+        
+        if dtype is None:
+            fields = [ ('id', '>u4'), ('length', '>u2'), ('mask', '>u8') ]
+            
+            for attr in self.__attributes:
+                if mask & attr.Bit():
+                    fields.append( (attr.Name(), '>' + _TYPES[attr.Format()][1]) )
+            
+            dtype = numpy.dtype(fields)
+            
+            if len(self.__dtypes) < layout.MAX_LAYOUTS:
+                self.__dtypes[mask] = dtype
+        
+        rows = numpy.asarray(rows, numpy.intp)
+        
+        records = numpy.empty(len(rows), dtype)
+        records['id'] = self.__ids[rows]
+        records['length'] = dtype.itemsize - dtype.fields['mask'][1]
+        records['mask'] = mask
+        
+        for attr in self.__attributes:
+            if mask & attr.Bit():
+                records[attr.Name()] = self.__columns[attr.id()][rows]
+        
+        data = records.tobytes()
+        end = offset + len(data)
+        buf[offset:end] = data
+        
+        return end
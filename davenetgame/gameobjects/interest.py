@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import math
+
+from davenetgame import exceptions
+from davenetgame.gameobjects import sync
+
+## @file
+#  Interest management, so that each connection is only sent the objects near it.  Object types
+#  name their position attributes when they're registered:
+#
+#      sync.RegisterGameObjectType(Ship, {'position' : ('x', 'y') } )
+#
+#  and their objects are kept in a uniform grid of cells, keyed by cell coordinates.  The grid is
+#  updated from each tick's snapshot, so only the objects whose position bits are dirty move
+#  between cells.  Objects of types without a position are relevant to everyone.
+#
+#  A connection given an interest radius is only sent the objects in it.  Finding them only looks
+#  at the cells the circle overlaps, so what a connection costs follows how crowded its part of
+#  the world is, not how big the world is.  An object coming into the circle is sent to the
+#  connection as a create, and one leaving it as a destroy.
+
+## The size of a grid cell by default, in the units of the position attributes.
+DEFAULT_CELL_SIZE = 64.0
+
+## A uniform grid of the objects with positions.
+class nInterestGrid(object):
+    ## The size of a cell.
+    __cellsize = None
+    
+    ## The sets of object IDs in each cell, keyed by cell coordinates.
+    __cells = None
+    
+    ## The position and cell of each object in the grid, keyed by object ID.
+    __positions = None
+    
+    ## The IDs of the objects without a position.
+    __global = None
+    
+    ## The names of the position attributes of each type and their bits in the dirty mask, keyed
+    #  by type ID, or None for types without a position.
+    __types = None
+    
+    ## @param cellSize the size of a cell.  Radii of a few cells work best.
+    def __init__(self, cellSize=DEFAULT_CELL_SIZE):
+        self.__cellsize = float(cellSize)
+        self.__cells = {}
+        self.__positions = {}
+        self.__global = set()
+        self.__types = {}
+    
+    ## Returns the size of a cell.
+    def CellSize(self):
+        return self.__cellsize
+    
+    ## Returns the cell coordinates of a position.
+    def Cell(self, x, y):
+        return (math.floor(x / self.__cellsize), math.floor(y / self.__cellsize) )
+    
+    ## Returns the position attributes of an object type and their mask, or None if the type has
+    #  no position.
+    def __position(self, objType):
+        typeId = objType._typeid
+        
+        if typeId in self.__types:
+            return self.__types[typeId]
+        
+        options = sync.GetGameObjectList().GetObjectOptions(typeId) or {}
+        names = options.get('position')
+        info = None
+        
+        if names is not None:
+            attributes = { attr.Name() : attr for attr in objType._syncattributes }
+            
+            if len(names) != 2 or any(name not in attributes for name in names):
+                raise exceptions.dngSyncObjectAttributeError("The position of " + objType.__name__ + " must name two of its sync attributes")
+            
+            info = (tuple(names), attributes[names[0]].Bit() | attributes[names[1]].Bit() )
+        
+        self.__types[typeId] = info
+        
+        return info
+    
+    ## Puts an object in the grid, or moves it to its current position.
+    def Insert(self, obj):
+        info = self.__position(type(obj) )
+        objId = obj.id()
+        
+        if info is None:
+            self.__global.add(objId)
+            return
+        
+        xName, yName = info[0]
+        self.Move(objId, getattr(obj, xName), getattr(obj, yName) )
+    
+    ## Moves an object to a position.  Objects not in the grid are added.
+    def Move(self, objId, x, y):
+        cell = self.Cell(x, y)
+        old = self.__positions.get(objId)
+        
+        if old is not None and old[2] != cell:
+            self.__discard(objId, old[2])
+        
+        if old is None or old[2] != cell:
+            self.__cells.setdefault(cell, set() ).add(objId)
+        
+        self.__positions[objId] = (x, y, cell)
+    
+    ## Returns the position of an object in the grid as a tuple, or None.
+    def Position(self, objId):
+        position = self.__positions.get(objId)
+        
+        if position is None:
+            return None
+        
+        return (position[0], position[1])
+    
+    ## Takes an object out of the grid.
+    def Remove(self, objId):
+        self.__global.discard(objId)
+        
+        old = self.__positions.pop(objId, None)
+        
+        if old is not None:
+            self.__discard(objId, old[2])
+    
+    def __discard(self, objId, cell):
+        objIds = self.__cells[cell]
+        objIds.discard(objId)
+        
+        if len(objIds) == 0:
+            del self.__cells[cell]
+    
+    ## Brings the grid up to date with a tick's snapshot.  Objects created are added, objects
+    #  whose position changed are moved, and objects destroyed are removed.
+    #
+    #  @param snapshot the tick's snapshot.nSnapshot.
+    def Update(self, snapshot):
+        syncList = sync.GetSyncList()
+        
+        for objId in snapshot.created:
+            obj = syncList.GetObject(objId)
+            
+            if obj is not None:
+                self.Insert(obj)
+        
+        for objId, mask in snapshot.changes.items():
+            if objId not in self.__positions:
+                continue
+            
+            obj = syncList.GetObject(objId)
+            
+            if obj is None:
+                continue
+            
+            info = self.__types[obj._typeid]
+            
+            if mask & info[1]:
+                xName, yName = info[0]
+                self.Move(objId, getattr(obj, xName), getattr(obj, yName) )
+        
+        for objId in snapshot.destroyed:
+            self.Remove(objId)
+    
+    ## Returns the IDs of the objects within radius of a position, along with the objects without
+    #  a position.
+    def Query(self, x, y, radius):
+        cellSize = self.__cellsize
+        cells = self.__cells
+        positions = self.__positions
+        
+        found = set(self.__global)
+        
+        radius2 = radius * radius
+        
+        for cx in range(math.floor( (x - radius) / cellSize), math.floor( (x + radius) / cellSize) + 1):
+            for cy in range(math.floor( (y - radius) / cellSize), math.floor( (y + radius) / cellSize) + 1):
+                objIds = cells.get( (cx, cy) )
+                
+                if objIds is None:
+                    continue
+                
+                for objId in objIds:
+                    ox, oy, cell = positions[objId]
+                    
+                    if (ox - x) * (ox - x) + (oy - y) * (oy - y) <= radius2:
+                        found.add(objId)
+        
+        return found
+    
+    ## Returns a dictionary of statistics.
+    def Stats(self):
+        return { 'interest_cells' : len(self.__cells),
+                 'interest_positioned' : len(self.__positions),
+                 'interest_global' : len(self.__global),
+               }
+
+## The interest of one connection: the circle it's interested in, and what objects it was sent.
+#  Used by nReplicator, which works out what's sent from it.
+class nInterest(object):
+    ## The center and radius of the circle.
+    x = None
+    y = None
+    radius = None
+    
+    ## The IDs of the objects the client has as of its baseline.
+    known = None
+    
+    ## The IDs of the objects that were relevant in each tick an update was sent in, for the
+    #  updates not yet acked, keyed by tick.
+    sent = None
+    
+    ## The IDs of the objects relevant in the last update built.
+    current = None
+    
+    ## The IDs of the objects that came into the circle and left it when the last update was
+    #  built.
+    entered = None
+    left = None
+    
+    def __init__(self, x, y, radius):
+        self.SetRegion(x, y, radius)
+        self.known = frozenset()
+        self.sent = {}
+        self.current = frozenset()
+        self.entered = frozenset()
+        self.left = frozenset()
+    
+    ## Moves the circle.
+    def SetRegion(self, x, y, radius):
+        self.x = x
+        self.y = y
+        self.radius = radius
+    
+    ## Finds the objects relevant now, and which came into the circle or left it since the last
+    #  time.
+    #
+    #  @param grid the nInterestGrid.
+    #  @returns the IDs of the relevant objects.
+    def Relevant(self, grid):
+        relevant = frozenset(grid.Query(self.x, self.y, self.radius) )
+        
+        self.entered = relevant - self.current
+        self.left = self.current - relevant
+        self.current = relevant
+        
+        return relevant
+    
+    ## Returns the IDs of the objects the client might have: the ones it had as of its baseline,
+    #  and the ones in any update sent after it, in case it got that.
+    def Possible(self, baseline):
+        possible = set(self.known)
+        
+        for tick, objIds in self.sent.items():
+            if tick > baseline:
+                possible |= objIds
+        
+        return possible
+    
+    ## Returns the IDs of the objects the client had as of its baseline that might have been
+    #  destroyed since, by an update sent after it that they weren't relevant in.  The client
+    #  applies updates that aren't acked yet, so it can't be counted on to still have them.
+    def Left(self, baseline):
+        left = set()
+        
+        for tick, objIds in self.sent.items():
+            if tick > baseline:
+                left |= self.known - objIds
+        
+        return left
+    
+    ## Records the objects relevant in an update sent for a tick.
+    def Sent(self, tick):
+        self.sent[tick] = self.current
+    
+    ## The client acked the update for a tick, which is now its baseline.
+    def Acked(self, tick):
+        if tick in self.sent:
+            self.known = self.sent[tick]
+        
+        for oldTick in [ oldTick for oldTick in self.sent if oldTick <= tick ]:
+            del self.sent[oldTick]
+    
+    ## Forgets the updates sent for ticks older than the oldest baseline.
+    def Prune(self, oldest):
+        for oldTick in [ oldTick for oldTick in self.sent if oldTick < oldest ]:
+            del self.sent[oldTick]
+    
+    ## The client has nothing, and is sent the full state next.
+    def Reset(self):
+        self.known = frozenset()
+        self.sent = {}
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import operator, struct
+
+from davenetgame.gameobjects import bits
+
+## @file
+#  Binary layouts for encoding the attributes of sync objects.  Each registered object type gets
+#  an nSyncLayout, which turns the attributes named by a mask into one struct.Struct, compiled
+#  the first time that mask is used and kept from then on.  Objects tend to change the same
+#  attributes tick after tick, so only a handful of masks are ever compiled for each type.
+#
+#  An encoded state is the fixed-size values packed by the Struct, in order of their attribute
+#  IDs, followed by the variable-size values such as strings, also in order of their IDs.
+#  Both ends compile the same layout from the same mask, so no format goes over the wire.
+#
+#  Values are read from and written to the objects' slots, or for types registered with the
+#  'columnar' option, to the columns of their columnar.nColumnStore.
+#
+#  Types with bit-packed attributes, see attributes/packed.py, get an nBitLayout instead, which
+#  writes each value in as few bits as its attribute allows.  Either way, in an update the values
+#  follow the mask, which the layout writes too: as 8 bytes in front of a struct, or as a bit for
+#  each attribute in front of the bits.
+
+## The most masks a layout keeps compiled.  Past this, masks are compiled every time they're
+#  used, which is slower but keeps a type whose objects change at random from growing without
+#  bound.
+MAX_LAYOUTS = 256
+
+## The mask in front of the values in an update, for types laid out by nSyncLayout.
+MASK = struct.Struct("!Q")
+
+## Makes buf at least size bytes long.
+def Reserve(buf, size):
+    if len(buf) < size:
+        buf.extend(bytes(size - len(buf) ) )
+
+## Returns a function that reads the given slots from an object as a tuple.
+def _Getter(slots):
+    getter = operator.attrgetter(*slots)
+    
+    # With only one name, attrgetter returns the value itself rather than a tuple.
+    if len(slots) == 1:
+        return lambda obj: (getter(obj), )
+    
+    return getter
+
+## Returns the layout for a type's attributes: an nBitLayout if any of them are bit-packed, or
+#  else an nSyncLayout.
+#
+#  @param attributes the sync attributes of the type, in the order of their IDs.
+#  @param columns the type's columnar.nColumnStore, if it has one.
+def NewLayout(attributes, columns=None):
+    if any(attr.Packed() for attr in attributes):
+        return nBitLayout(attributes, columns)
+    
+    return nSyncLayout(attributes, columns)
+    
+## The layout of one sync object type.
+class nSyncLayout(object):
+    ## The type's sync attributes, in the order of their IDs.
+    __attributes = None
+    
+    ## The compiled masks.  Each is a tuple of the Struct for the fixed-size values, the function
+    #  reading those values from an object, the functions writing them back, and the attributes
+    #  with variable-size values.
+    __compiled = None
+    
+    ## The column store of the type, or None if the values are all in slots.
+    __columns = None
+    
+    ## @param attributes the sync attributes of the type, in the order of their IDs.
+    #  @param columns the type's columnar.nColumnStore, if it has one.
+    def __init__(self, attributes, columns=None):
+        self.__attributes = tuple(attributes)
+        self.__compiled = {}
+        self.__columns = columns
+        
+        self.Get(self.FullMask() )
+    
+    ## Returns the mask with a bit for every attribute.
+    def FullMask(self):
+        return (1 << len(self.__attributes) ) - 1
+    
+    ## Returns the number of masks compiled so far.
+    def CompiledCount(self):
+        return len(self.__compiled)
+    
+    ## Returns the compiled layout for mask, compiling it if needed.
+    def Get(self, mask):
+        compiled = self.__compiled.get(mask)
+        
+        if compiled is None:
+            compiled = self.__compile(mask)
+            
+            if len(self.__compiled) < MAX_LAYOUTS:
+                self.__compiled[mask] = compiled
+        
+        return compiled
+    
+    def __compile(self, mask):
+        fixed = []
+        variable = []
+        
+        for attr in self.__attributes:
+            if mask & attr.Bit():
+                if attr.Format() is None:
+                    variable.append(attr)
+                else:
+                    fixed.append(attr)
+        
+        layout = struct.Struct("!" + "".join(attr.Format() for attr in fixed) )
+        columns = self.__columns
+        
+        if len(fixed) == 0:
+            getter = lambda obj: ()
+            setters = ()
+        elif columns is None or not any(columns.Holds(attr) for attr in fixed):
+            getter = _Getter([ attr.Slot() for attr in fixed ])
+            setters = tuple(attr._member.__set__ for attr in fixed)
+        else:
+            readers = tuple(columns.Reader(attr) if columns.Holds(attr) else attr._member.__get__ for attr in fixed)
+            getter = lambda obj: [ read(obj) for read in readers ]
+            setters = tuple(columns.Writer(attr) if columns.Holds(attr) else attr._member.__set__ for attr in fixed)
+        
+        return (layout, getter, setters, tuple(variable) )
+    
+    ## Returns the size of the fixed-size values in mask.  The variable-size values come after.
+    def FixedSize(self, mask):
+        return self.Get(mask)[0].size
+    
+    ## Encodes the attributes of obj in mask into buf, starting at offset.  buf is a bytearray,
+    #  and it's grown as needed but never shrunk, so the same one can be used over and over.
+    #
+    #  @returns the offset just past the encoded values.
+    def EncodeInto(self, obj, mask, buf, offset):
+        layout, getter, setters, variable = self.Get(mask)
+        
+        end = offset + layout.size
+        Reserve(buf, end)
+        layout.pack_into(buf, offset, *getter(obj) )
+        
+        for attr in variable:
+            data = attr.EncodeValue(attr._member.__get__(obj) )
+            
+            offset = end
+            end = offset + len(data)
+            buf[offset:end] = data
+        
+        return end
+    
+    ## Encodes the attributes of obj in mask.
+    def Encode(self, obj, mask):
+        buf = bytearray()
+        self.EncodeInto(obj, mask, buf, 0)
+        
+        return bytes(buf)
+    
+    ## Like EncodeInto, but puts the mask in front of the values.
+    #
+    #  @returns the offset just past the encoded values.
+    def EncodeUpdateInto(self, obj, mask, buf, offset):
+        end = offset + MASK.size
+        Reserve(buf, end)
+        MASK.pack_into(buf, offset, mask)
+        
+        return self.EncodeInto(obj, mask, buf, end)
+    
+    ## Sets the attributes of obj from a mask and values encoded by EncodeUpdateInto.
+    #
+    #  @returns a tuple of the mask and the offset just past the values.
+    def DecodeUpdate(self, obj, data, offset=0):
+        mask, = MASK.unpack_from(data, offset)
+        
+        return (mask, self.Decode(obj, mask, data, offset + MASK.size) )
+    
+    ## Sets the attributes of obj in mask from values encoded by EncodeInto.  The values are
+    #  written to the slots directly, so they aren't type checked or marked dirty.
+    #
+    #  @returns the offset just past the values.
+    def Decode(self, obj, mask, data, offset=0):
+        layout, getter, setters, variable = self.Get(mask)
+        
+        for setter, value in zip(setters, layout.unpack_from(data, offset) ):
+            setter(obj, value)
+        
+        offset += layout.size
+        
+        for attr in variable:
+            value, offset = attr.DecodeValue(data, offset)
+            attr._member.__set__(obj, value)
+        
+        return offset
+    
+    ## Decodes values encoded by EncodeInto without an object to put them in.
+    #
+    #  @returns a dictionary of the values, keyed by attribute name.
+    def DecodeValues(self, mask, data, offset=0):
+        layout, getter, setters, variable = self.Get(mask)
+        
+        fixed = [ attr.Name() for attr in self.__attributes if mask & attr.Bit() and attr.Format() is not None ]
+        values = dict(zip(fixed, layout.unpack_from(data, offset) ) )
+        
+        offset += layout.size
+        
+        for attr in variable:
+            values[attr.Name()], offset = attr.DecodeValue(data, offset)
+        
+        return values
+
+## The layout of a sync object type with bit-packed attributes.  The values are written one after
+#  another by each attribute's WriteBits, in order of their IDs, and the last byte is padded.
+#  The mask of an update takes a bit for each attribute.
+class nBitLayout(object):
+    ## The type's sync attributes, in the order of their IDs.
+    __attributes = None
+    
+    ## The compiled masks.  Each is a tuple with a tuple for each attribute in the mask, of the
+    #  attribute's WriteBits and ReadBits, and the functions reading its value from an object
+    #  and writing it back.
+    __compiled = None
+    
+    ## The column store of the type, or None if the values are all in slots.
+    __columns = None
+    
+    ## The writer the values are written with, used over and over.
+    __writer = None
+    
+    ## @param attributes the sync attributes of the type, in the order of their IDs.
+    #  @param columns the type's columnar.nColumnStore, if it has one.
+    def __init__(self, attributes, columns=None):
+        self.__attributes = tuple(attributes)
+        self.__compiled = {}
+        self.__columns = columns
+        self.__writer = bits.nBitWriter()
+        
+        self.Get(self.FullMask() )
+    
+    ## Returns the mask with a bit for every attribute.
+    def FullMask(self):
+        return (1 << len(self.__attributes) ) - 1
+    
+    ## Returns the number of masks compiled so far.
+    def CompiledCount(self):
+        return len(self.__compiled)
+    
+    ## Returns the compiled layout for mask, compiling it if needed.
+    def Get(self, mask):
+        compiled = self.__compiled.get(mask)
+        
+        if compiled is None:
+            compiled = self.__compile(mask)
+            
+            if len(self.__compiled) < MAX_LAYOUTS:
+                self.__compiled[mask] = compiled
+        
+        return compiled
+    
+    def __compile(self, mask):
+        columns = self.__columns
+        compiled = []
+        
+        for attr in self.__attributes:
+            if mask & attr.Bit():
+                if columns is not None and columns.Holds(attr):
+                    read = columns.Reader(attr)
+                    write = columns.Writer(attr)
+                else:
+                    read = attr._member.__get__
+                    write = attr._member.__set__
+                
+                compiled.append( (attr.WriteBits, attr.ReadBits, read, write) )
+        
+        return tuple(compiled)
+    
+    ## Writes the values of the attributes of obj in mask to writer.
+    def __write(self, obj, mask, writer):
+        for writeBits, readBits, read, write in self.Get(mask):
+            writeBits(writer, read(obj) )
+    
+    ## Copies what writer holds into buf at offset, and clears it.
+    #
+    #  @returns the offset just past what was copied.
+    def __flush(self, writer, buf, offset):
+        data = writer.Bytes()
+        writer.Clear()
+        
+        end = offset + len(data)
+        buf[offset:end] = data
+        
+        return end
+    
+    ## Encodes the attributes of obj in mask into buf, starting at offset.  buf is a bytearray,
+    #  and it's grown as needed but never shrunk, so the same one can be used over and over.
+    #
+    #  @returns the offset just past the encoded values.
+    def EncodeInto(self, obj, mask, buf, offset):
+        writer = self.__writer
+        self.__write(obj, mask, writer)
+        
+        return self.__flush(writer, buf, offset)
+    
+    ## Encodes the attributes of obj in mask.
+    def Encode(self, obj, mask):
+        buf = bytearray()
+        self.EncodeInto(obj, mask, buf, 0)
+        
+        return bytes(buf)
+    
+    ## Like EncodeInto, but puts the mask in front of the values, in the same bits.
+    #
+    #  @returns the offset just past the encoded values.
+    def EncodeUpdateInto(self, obj, mask, buf, offset):
+        writer = self.__writer
+        writer.WriteBits(mask, len(self.__attributes) )
+        self.__write(obj, mask, writer)
+        
+        return self.__flush(writer, buf, offset)
+    
+    ## Reads the values of the attributes in mask from reader into obj.
+    def __read(self, obj, mask, reader):
+        for writeBits, readBits, read, write in self.Get(mask):
+            write(obj, readBits(reader) )
+    
+    ## Sets the attributes of obj in mask from values encoded by EncodeInto.  The values are
+    #  written to the slots directly, so they aren't type checked or marked dirty.
+    #
+    #  @returns the offset just past the values.
+    def Decode(self, obj, mask, data, offset=0):
+        reader = bits.nBitReader(data, offset)
+        self.__read(obj, mask, reader)
+        
+        return reader.Offset()
+    
+    ## Sets the attributes of obj from a mask and values encoded by EncodeUpdateInto.
+    #
+    #  @returns a tuple of the mask and the offset just past the values.
+    def DecodeUpdate(self, obj, data, offset=0):
+        reader = bits.nBitReader(data, offset)
+        mask = reader.ReadBits(len(self.__attributes) )
+        self.__read(obj, mask, reader)
+        
+        return (mask, reader.Offset() )
+    
+    ## Decodes values encoded by EncodeInto without an object to put them in.
+    #
+    #  @returns a dictionary of the values, keyed by attribute name.
+    def DecodeValues(self, mask, data, offset=0):
+        reader = bits.nBitReader(data, offset)
+        
+        return { attr.Name() : attr.ReadBits(reader) for attr in self.__attributes if mask & attr.Bit() }
@@ -20,6 +20,7 @@
 
 from davenetgame import exceptions
 from davenetgame.gameobjects import sync
+from davenetgame.gameobjects.attributes import builtin
 
 ## @class nPlayer
 #
@@ -27,15 +28,16 @@ from davenetgame.gameobjects import sync
 #  provide more details about the player.
 class nPlayer(sync.nSyncObject):
     __connection = None
+    
+    ## The player's name
+    playername = builtin.nSyncAttributeString(initial="")
 
     def __init__(self, **args):
         super().__init__()
         
         self.__connection = args['connection']
         print(self.__connection.player() )
-        self.AddAttribute(name="playername",
-                          type=str,
-                          initial=self.__connection.player() )
+        self.playername = self.__connection.player()
         
         self.Finalize()
         
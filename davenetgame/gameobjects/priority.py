@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+from davenetgame.gameobjects import sync
+
+## @file
+#  Priorities for object updates, so a connection with a byte budget gets the updates that
+#  matter most when there are more than fit.  Each connection keeps a priority for each object
+#  with changes it hasn't been sent.  Every tick, the priority grows by the object's weight: its
+#  type's priority, set when the type is registered:
+#
+#      sync.RegisterGameObjectType(Ship, {'priority' : 4.0} )
+#
+#  scaled down with the object's distance from the connection's interest circle's center, if it
+#  has one.  The updates are packed highest priority first until the budget runs out.  An object
+#  that's sent goes back to 0, and one that isn't keeps its priority and is owed its changes, so
+#  even far away objects of low priority types are sent eventually.
+#
+#  Creates are ranked the same way, ahead of the updates, and the ones that don't fit are owed
+#  too, so a lot of objects coming into view at once are sent over several ticks.  Destroys are
+#  always sent, since they're small and the client can't do without them.
+
+## The priority of object types registered without one.
+DEFAULT_PRIORITY = 1.0
+
+## Returns the priority of an object type.
+def TypePriority(typeId):
+    options = sync.GetGameObjectList().GetObjectOptions(typeId) or {}
+    
+    return options.get('priority', DEFAULT_PRIORITY)
+
+## The priorities of one connection's objects, and the changes it's owed.  Used by nReplicator.
+class nPriorityAccumulator(object):
+    ## The number of bytes of updates the connection is sent each tick.
+    __budget = None
+    
+    ## The priority of each object, keyed by object ID.
+    __priorities = None
+    
+    ## The priority of each object waiting to be created, keyed by object ID.
+    __createPriorities = None
+    
+    ## The dirty masks of the changes the connection was owed as of its baseline, keyed by
+    #  object ID.
+    owed = None
+    
+    ## The IDs of the objects the connection was owed creates for as of its baseline.
+    owedCreates = None
+    
+    ## The changes and creates held back in each update not yet acked, as tuples keyed by tick.
+    __deferred = None
+    
+    ## The changes and creates held back in the last update built.
+    __current = None
+    __currentCreates = None
+    
+    ## The number of records sent and held back.
+    __sent = None
+    __held = None
+    
+    def __init__(self, budget):
+        self.__budget = budget
+        self.__priorities = {}
+        self.__createPriorities = {}
+        self.owed = {}
+        self.owedCreates = frozenset()
+        self.__deferred = {}
+        self.__current = {}
+        self.__currentCreates = frozenset()
+        self.__sent = 0
+        self.__held = 0
+    
+    ## Returns the number of bytes of updates the connection is sent each tick.
+    def Budget(self):
+        return self.__budget
+    
+    ## Sets the number of bytes of updates the connection is sent each tick.
+    def SetBudget(self, budget):
+        self.__budget = budget
+    
+    ## Picks the updates to send this tick.
+    #
+    #  @param records a list of tuples of object ID and encoded update, one for each object with
+    #                 changes the connection hasn't been sent.
+    #  @param masks the dirty masks the records were encoded from, keyed by object ID.
+    #  @param weight a function returning the weight of an object, given its ID.
+    #  @param used the number of bytes of the budget already used this tick.
+    #  @returns the records to send.
+    def Pack(self, records, masks, weight, used=0):
+        picked, self.__priorities, deferred = self.__pick(records, self.__priorities, weight, used)
+        
+        self.__current = { objId : masks[objId] for objId in deferred }
+        self.__sent += len(picked)
+        self.__held += len(deferred)
+        
+        return picked
+    
+    ## Picks the creates to send this tick.  Call it before Pack, since creates go first.
+    #
+    #  @param records a list of tuples of object ID and encoded create, one for each object the
+    #                 connection should have and hasn't been sent.
+    #  @param weight a function returning the weight of an object, given its ID.
+    #  @param used the number of bytes of the budget already used this tick.
+    #  @returns the records to send.
+    def PackCreates(self, records, weight, used=0):
+        picked, self.__createPriorities, deferred = self.__pick(records, self.__createPriorities, weight, used)
+        
+        self.__currentCreates = frozenset(deferred)
+        self.__sent += len(picked)
+        self.__held += len(deferred)
+        
+        return picked
+    
+    ## Ranks records by priority and picks the ones that fit in what's left of the budget.
+    #
+    #  @param old the priorities of the objects as of the last tick.
+    #  @returns a tuple of the records picked, the priorities of the objects held back and the
+    #           IDs of the objects held back.
+    def __pick(self, records, old, weight, used):
+        remaining = self.__budget - used
+        
+        # Nothing needs ranking when everything fits, which is most ticks for most connections.
+        if sum(len(record) for objId, record in records) <= remaining:
+            return ([ record for objId, record in records ], {}, [])
+        
+        priorities = {}
+        
+        for objId, record in records:
+            priorities[objId] = old.get(objId, 0.0) + weight(objId)
+        
+        records = sorted(records, key=lambda item: priorities[item[0] ], reverse=True)
+        
+        picked = []
+        deferred = []
+        
+        # Smaller records further down still go in once a bigger one doesn't fit.
+        for objId, record in records:
+            if len(record) <= remaining:
+                picked.append(record)
+                remaining -= len(record)
+                del priorities[objId]
+            else:
+                deferred.append(objId)
+        
+        return (picked, priorities, deferred)
+    
+    ## Records the changes and creates held back in an update sent for a tick.
+    def Sent(self, tick):
+        self.__deferred[tick] = (self.__current, self.__currentCreates)
+    
+    ## The client acked the update for a tick, so it's owed what was held back from it.
+    def Acked(self, tick):
+        if tick in self.__deferred:
+            self.owed, self.owedCreates = self.__deferred[tick]
+        
+        for oldTick in [ oldTick for oldTick in self.__deferred if oldTick <= tick ]:
+            del self.__deferred[oldTick]
+    
+    ## Forgets the updates sent for ticks older than the oldest baseline.
+    def Prune(self, oldest):
+        for oldTick in [ oldTick for oldTick in self.__deferred if oldTick < oldest ]:
+            del self.__deferred[oldTick]
+    
+    ## The client is sent the full state, so it's owed nothing.  What was held back from the
+    #  updates still waiting for acks is kept, since a full state sent before this one might be
+    #  acked yet.
+    def Reset(self):
+        self.__priorities = {}
+        self.__createPriorities = {}
+        self.owed = {}
+        self.owedCreates = frozenset()
+        self.__current = {}
+        self.__currentCreates = frozenset()
+    
+    ## Returns a dictionary of statistics.
+    def Stats(self):
+        return { 'priority_sent' : self.__sent,
+                 'priority_held' : self.__held,
+                 'priority_owed' : len(self.owed),
+                 'priority_owed_creates' : len(self.owedCreates),
+               }
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import math, time
+
+from davenetgame.gameobjects import interest, priority, sync
+
+## @file
+#  Snapshot and delta replication of sync objects.  The server advances a tick each time it syncs
+#  objects, and the sync list's snapshots say what happened in each recent tick: the attributes
+#  that changed, the objects created and the objects destroyed, and the state of each object after
+#  the tick.  Each connection has a baseline, the newest tick
+#  the client has acknowledged.  What the client is sent is everything that happened after its
+#  baseline, with the current values of the attributes that changed.
+#
+#  The updates are sent unreliably.  A lost update doesn't need to be sent again, since the next
+#  one is still against the old baseline and so covers it, and when the client acks an update,
+#  the baseline moves up to that update's tick.  A client without a baseline, or whose baseline
+#  has fallen out of the snapshots, is sent the full state.  A full state is sent again if it
+#  isn't acked in time, usually about a round trip, rather than every tick.
+#
+#  Clients that acked the same tick are sent the same records, so within a tick, each object's
+#  record is encoded once for each baseline and shared through an nDeltaCache.  The cost of
+#  encoding then follows the number of different baselines, not the number of clients.
+#
+#  A connection given an interest circle only gets the objects in it, see interest.py.  Its
+#  updates are the delta filtered down to the objects it already has, with creates for the
+#  objects that came into the circle and destroys for the ones that left it.
+#
+#  A connection given a byte budget is only sent as many creates and updates as fit in it each
+#  tick, picked by priority, see priority.py.  The creates and changes held back are owed to it,
+#  and are added to the next updates until they're sent.  Connections without a budget are held
+#  to MAX_UPDATE_SIZE the same way, so a world too big for one message, full state included, is
+#  sent over several ticks.
+
+## The most bytes of records sent to a connection in one update, whatever its budget.  Updates
+#  are fragmented, and a message bigger than the fragmenter reassembles, fragment.MAX_MESSAGE
+#  by default, would never arrive.
+MAX_UPDATE_SIZE = 256 * 1024
+
+## The encoded records of the current tick, keyed by object ID and baseline tick.  Create
+#  records don't depend on the baseline, so they're kept under baseline 0, which is never a real
+#  baseline.  The deltas for each baseline are kept too, since working one out means going
+#  through the snapshots.
+#
+#  Everything is evicted when the next tick starts.  A record for the new tick can't be the same
+#  as one for the last, and a baseline that falls out of the snapshot ring is never asked for
+#  again, so the cache never holds more than one tick of records for the baselines in the ring.
+class nDeltaCache(object):
+    ## The tick the records are for.
+    __tick = None
+    
+    ## The records, keyed by (object ID, baseline).
+    __records = None
+    
+    ## The deltas, keyed by baseline.
+    __deltas = None
+    
+    ## Counters for Stats.
+    __hits = None
+    __misses = None
+    __evicted = None
+    
+    def __init__(self):
+        self.__tick = 0
+        self.__records = {}
+        self.__deltas = {}
+        self.__hits = 0
+        self.__misses = 0
+        self.__evicted = 0
+    
+    ## Evicts everything, and starts keeping records for a new tick.
+    def Reset(self, tick):
+        self.__evicted += len(self.__records)
+        self.__records = {}
+        self.__deltas = {}
+        self.__tick = tick
+    
+    ## Returns the record of an object for a baseline, or None.
+    def Get(self, objId, baseline):
+        record = self.__records.get( (objId, baseline) )
+        
+        if record is None:
+            self.__misses += 1
+        else:
+            self.__hits += 1
+        
+        return record
+    
+    ## Keeps the record of an object for a baseline.
+    def Put(self, objId, baseline, record):
+        self.__records[ (objId, baseline) ] = record
+    
+    ## Returns the delta for a baseline, or None.
+    def GetDelta(self, baseline):
+        return self.__deltas.get(baseline)
+    
+    ## Keeps the delta for a baseline.
+    def PutDelta(self, baseline, delta):
+        self.__deltas[baseline] = delta
+    
+    ## Returns a dictionary of statistics.
+    def Stats(self):
+        lookups = self.__hits + self.__misses
+        
+        return { 'delta_cache_hits' : self.__hits,
+                 'delta_cache_misses' : self.__misses,
+                 'delta_cache_hit_rate' : self.__hits / lookups if lookups > 0 else 0.0,
+                 'delta_cache_evicted' : self.__evicted,
+                 'delta_cache_entries' : len(self.__records),
+               }
+
+## Replicates the sync list to any number of connections.  Connections are known by a key,
+#  which is str(connection) in the realtime protocol.
+class nReplicator(object):
+    ## The current tick.  The first tick is 1, so 0 can mean "no baseline".
+    __tick = None
+    
+    ## The baseline tick of each connection, keyed by connection key.
+    __baselines = None
+    
+    ## The updates sent to each connection and not yet acked, keyed by connection key.  Each is
+    #  a dict of ticks, keyed by message ID.
+    __pending = None
+    
+    ## The buffer the updates are encoded in.
+    __buffer = None
+    
+    ## The nDeltaCache shared by the connections.
+    __cache = None
+    
+    ## The interest.nInterestGrid of the objects, and the interest.nInterest of each connection
+    #  that has one, keyed by connection key.
+    __grid = None
+    __interests = None
+    
+    ## The number of bytes of updates sent to each connection per tick by default, or None for
+    #  no limit but MAX_UPDATE_SIZE, and the priority.nPriorityAccumulator of each connection,
+    #  keyed by connection key.
+    __budget = None
+    __accumulators = None
+    
+    ## When each connection waiting for a full state to be acked was last sent one, and the tick
+    #  of the first one it was sent, as tuples keyed by connection key.
+    __fullsent = None
+    
+    ## The number of full states and deltas sent, and the number of times there was nothing to
+    #  send.
+    __full = None
+    __deltas = None
+    __unchanged = None
+    
+    ## @param history the number of ticks of snapshots to keep.  A client that hasn't acked an
+    #                 update for that many ticks is sent the full state.  Leave it None to keep
+    #                 the sync list's depth.
+    #  @param cellSize the size of the cells of the interest grid.
+    #  @param budget the number of bytes of updates sent to each connection per tick, or None for
+    #                no limit but MAX_UPDATE_SIZE.
+    def __init__(self, history=None, cellSize=interest.DEFAULT_CELL_SIZE, budget=None):
+        if history is not None:
+            sync.GetSyncList().SetSnapshotDepth(history)
+        
+        self.__tick = sync.GetSyncList().SnapshotTick()
+        self.__baselines = {}
+        self.__pending = {}
+        self.__buffer = bytearray()
+        self.__cache = nDeltaCache()
+        self.__grid = interest.nInterestGrid(cellSize)
+        self.__interests = {}
+        self.__budget = budget
+        self.__accumulators = {}
+        self.__fullsent = {}
+        self.__full = 0
+        self.__deltas = 0
+        self.__unchanged = 0
+    
+    ## Returns the current tick.
+    def Tick(self):
+        return self.__tick
+    
+    ## Returns the oldest tick a baseline can be for a delta to be sent against it.
+    def OldestBaseline(self):
+        return sync.GetSyncList().OldestSnapshotTick() - 1
+    
+    ## Starts a new tick, taking a snapshot of the changes made to the sync list since the last
+    #  one.
+    #
+    #  @returns the new tick.
+    def Advance(self):
+        snapshot = sync.GetSyncList().TakeSnapshot()
+        
+        self.__tick = snapshot.tick
+        self.__cache.Reset(self.__tick)
+        self.__grid.Update(snapshot)
+        
+        return self.__tick
+    
+    ## Returns the baseline of a connection, or 0 if it has none.
+    def Baseline(self, key):
+        return self.__baselines.get(key, 0)
+    
+    ## Returns the interest.nInterestGrid.
+    def Grid(self):
+        return self.__grid
+    
+    ## Limits a connection to the objects within radius of a position.  Call it again whenever
+    #  the position moves.  The first call drops the connection's baseline, since there's no
+    #  telling which objects it was sent before, so it's sent the full state of its circle.
+    def SetInterest(self, key, x, y, radius):
+        connectionInterest = self.__interests.get(key)
+        
+        if connectionInterest is None:
+            self.__dropBaseline(key)
+            self.__interests[key] = interest.nInterest(x, y, radius)
+        else:
+            connectionInterest.SetRegion(x, y, radius)
+    
+    ## Sends a connection every object again.  Its baseline is dropped, since it's missing the
+    #  objects that were outside its circle.
+    def ClearInterest(self, key):
+        if self.__interests.pop(key, None) is not None:
+            self.__dropBaseline(key)
+    
+    ## Sets the number of bytes of updates sent to a connection per tick, or None for no limit
+    #  but MAX_UPDATE_SIZE.
+    def SetBudget(self, key, budget):
+        self.__accumulator(key).SetBudget(self.__limit(budget) )
+    
+    ## Returns a budget held to MAX_UPDATE_SIZE.
+    def __limit(self, budget):
+        if budget is None:
+            return MAX_UPDATE_SIZE
+        
+        return min(budget, MAX_UPDATE_SIZE)
+    
+    ## Returns the priority.nPriorityAccumulator of a connection.
+    def __accumulator(self, key):
+        accumulator = self.__accumulators.get(key)
+        
+        if accumulator is None:
+            accumulator = priority.nPriorityAccumulator(self.__limit(self.__budget) )
+            self.__accumulators[key] = accumulator
+        
+        return accumulator
+    
+    ## Makes a connection be sent the full state next.
+    def __dropBaseline(self, key):
+        self.__baselines.pop(key, None)
+        self.__pending.pop(key, None)
+        self.__fullsent.pop(key, None)
+    
+    ## Returns the IDs of the objects that came into a connection's circle and the ones that left
+    #  it when its last update was built, or None if it has no interest circle.
+    def Relevance(self, key):
+        connectionInterest = self.__interests.get(key)
+        
+        if connectionInterest is None:
+            return None
+        
+        return (connectionInterest.entered, connectionInterest.left)
+    
+    ## Fills in an objectupdate message for a connection, with everything that happened since
+    #  the connection's baseline.
+    #
+    #  @param key the connection's key.
+    #  @param theMsg the objectupdate message.
+    #  @param timeout how long to wait for a full state to be acked before sending it again,
+    #                 usually about a round trip.
+    #  @returns True if the message should be sent, False if there's nothing to send.
+    def BuildUpdate(self, key, theMsg, timeout=0.0):
+        baseline = self.__baselines.get(key, 0)
+        
+        connectionInterest = self.__interests.get(key)
+        relevant = None
+        
+        if connectionInterest is not None:
+            relevant = connectionInterest.Relevant(self.__grid)
+        
+        accumulator = self.__accumulator(key)
+        
+        theMsg.tick = self.__tick
+        
+        if baseline == 0 or baseline < self.OldestBaseline():
+            now = time.time()
+            
+            lastSent, firstTick = self.__fullsent.get(key, (0.0, self.__tick) )
+            
+            if now - lastSent < timeout:
+                return False
+            
+            if connectionInterest is not None:
+                connectionInterest.Reset()
+            
+            accumulator.Reset()
+            
+            self.__buildFull(theMsg, relevant, accumulator, connectionInterest)
+            self.__fullsent[key] = (now, firstTick)
+            self.__full += 1
+            
+            return True
+        
+        delta = self.__cache.GetDelta(baseline)
+        
+        if delta is None:
+            delta = self.__delta(baseline)
+            self.__cache.PutDelta(baseline, delta)
+        
+        created, masks, destroyed = delta
+        
+        deltaMasks = masks
+        
+        if connectionInterest is not None:
+            created, masks, destroyed = self.__filter(connectionInterest, baseline, relevant, masks)
+        
+        if len(accumulator.owed) > 0:
+            masks = self.__owed(accumulator, masks, connectionInterest)
+        
+        if len(accumulator.owedCreates) > 0:
+            created, masks = self.__owedCreates(accumulator, created, masks, connectionInterest)
+        
+        # Nothing happened since the baseline, so the client already has this tick's state.
+        if len(created) == 0 and len(masks) == 0 and len(destroyed) == 0:
+            self.__baselines[key] = self.__tick
+            self.__unchanged += 1
+            
+            return False
+        
+        theMsg.destroys = sync.EncodeDestroys(destroyed)
+        theMsg.baseline = baseline
+        
+        creates = self.__creates(created)
+        records = self.__updates(masks, baseline, deltaMasks)
+        
+        weight = self.__weigher(connectionInterest)
+        
+        theMsg.creates = b''.join(accumulator.PackCreates(creates, weight, len(theMsg.destroys) ) )
+        
+        used = len(theMsg.creates) + len(theMsg.destroys)
+        theMsg.updates = b''.join(accumulator.Pack(records, masks, weight, used) )
+        
+        self.__deltas += 1
+        
+        return True
+    
+    ## Puts the full state in theMsg: every object, or every relevant one, as a create.  Only as
+    #  many as fit in the connection's budget are sent, and the rest are owed to it, so once this
+    #  is acked they're sent in the next updates.
+    def __buildFull(self, theMsg, relevant, accumulator, connectionInterest):
+        if relevant is None:
+            objIds = [ obj.id() for obj in sync.GetSyncList().GetObjects() ]
+        else:
+            objIds = sorted(relevant)
+        
+        creates = self.__creates(objIds)
+        
+        theMsg.creates = b''.join(accumulator.PackCreates(creates, self.__weigher(connectionInterest) ) )
+        theMsg.baseline = 0
+    
+    ## Works out what a connection with an interest circle is sent.  Objects it didn't have as of
+    #  its baseline are created, and objects it might have that aren't relevant anymore are
+    #  destroyed, whether they left the circle or were destroyed.  Objects that left the circle
+    #  in an update sent after the baseline may have been destroyed by it, so they're created
+    #  again too, which the client takes as setting the state of the ones it still has.  Only
+    #  the objects it has that are still relevant are updated, so the work follows the number of
+    #  relevant objects, not the number of objects that changed.
+    #
+    #  @returns a tuple like the one returned by __delta.
+    def __filter(self, connectionInterest, baseline, relevant, masks):
+        known = connectionInterest.known - connectionInterest.Left(baseline)
+        
+        created = sorted(relevant - known)
+        kept = { objId : masks[objId] for objId in relevant & known if objId in masks }
+        destroyed = sorted(connectionInterest.Possible(baseline) - relevant)
+        
+        return (created, kept, destroyed)
+    
+    ## Returns the create records of the objects with the given IDs, as a list of tuples of
+    #  object ID and record, from the cache where possible.  Their states come from the current
+    #  tick's snapshot, so nothing is encoded.
+    def __creates(self, objIds):
+        syncList = sync.GetSyncList()
+        cache = self.__cache
+        tick = self.__tick
+        
+        records = []
+        
+        for objId in objIds:
+            record = cache.Get(objId, 0)
+            
+            if record is None:
+                state = syncList.GetState(tick, objId)
+                
+                if state is None:
+                    continue
+                
+                record = sync.EncodeCreate(objId, syncList.GetStateType(objId), state)
+                cache.Put(objId, 0, record)
+            
+            records.append( (objId, record) )
+        
+        return records
+    
+    ## Returns the update records of the objects in masks for a baseline, as a list of tuples of
+    #  object ID and record, from the cache where possible.  The ones that aren't cached are
+    #  encoded together, so columnar types can be encoded in bulk.  Only the records of the
+    #  baseline's own delta are cached, since a mask with owed changes added is the connection's
+    #  own.
+    #
+    #  @param deltaMasks the masks of the baseline's delta.
+    def __updates(self, masks, baseline, deltaMasks):
+        syncList = sync.GetSyncList()
+        cache = self.__cache
+        
+        records = []
+        missed = []
+        
+        for objId, mask in masks.items():
+            record = None
+            
+            if deltaMasks.get(objId) == mask:
+                record = cache.Get(objId, baseline)
+            
+            if record is not None:
+                records.append( (objId, record) )
+            else:
+                obj = syncList.GetObject(objId)
+                
+                if obj is not None:
+                    missed.append( (obj, mask) )
+        
+        for (obj, mask), record in zip(missed, syncList.EncodeUpdateRecords(missed, self.__buffer) ):
+            if deltaMasks.get(obj.id() ) == mask:
+                cache.Put(obj.id(), baseline, record)
+            
+            records.append( (obj.id(), record) )
+        
+        return records
+    
+    ## Adds the changes a connection is owed to masks, for the objects it still has.
+    #
+    #  @returns the new masks.
+    def __owed(self, accumulator, masks, connectionInterest):
+        syncList = sync.GetSyncList()
+        masks = dict(masks)
+        
+        for objId, mask in accumulator.owed.items():
+            if connectionInterest is not None:
+                if objId not in connectionInterest.current or objId not in connectionInterest.known:
+                    continue
+            elif syncList.GetObject(objId) is None:
+                continue
+            
+            masks[objId] = masks.get(objId, 0) | mask
+        
+        return masks
+    
+    ## Adds the creates a connection is owed to created, for the objects that still exist and
+    #  are still relevant to it.  They're sent whole, so they're taken out of masks.
+    #
+    #  @returns a tuple of the new created and masks.
+    def __owedCreates(self, accumulator, created, masks, connectionInterest):
+        syncList = sync.GetSyncList()
+        created = list(created)
+        owed = set()
+        
+        for objId in accumulator.owedCreates:
+            if connectionInterest is not None:
+                if objId not in connectionInterest.current:
+                    continue
+            elif syncList.GetObject(objId) is None:
+                continue
+            
+            owed.add(objId)
+        
+        created.extend(sorted(owed.difference(created) ) )
+        masks = { objId : mask for objId, mask in masks.items() if objId not in owed }
+        
+        return (created, masks)
+    
+    ## Returns the function giving the weight of each object's update for a connection: its
+    #  type's priority, halved at the edge of the connection's interest circle.
+    def __weigher(self, connectionInterest):
+        syncList = sync.GetSyncList()
+        grid = self.__grid
+        
+        def weight(objId):
+            objWeight = priority.TypePriority(syncList.GetObject(objId)._typeid)
+            
+            if connectionInterest is not None and connectionInterest.radius > 0:
+                position = grid.Position(objId)
+                
+                if position is not None:
+                    distance = math.hypot(position[0] - connectionInterest.x, position[1] - connectionInterest.y)
+                    objWeight *= connectionInterest.radius / (connectionInterest.radius + distance)
+            
+            return objWeight
+        
+        return weight
+    
+    ## Returns what happened after baseline, as a tuple of the IDs of the objects created, the
+    #  masks of the objects that changed, keyed by ID, and the IDs of the objects destroyed.
+    #  Objects created after the baseline are sent whole, so they're left out of the masks.
+    #  Objects both created and destroyed after it are only destroyed, since the client may have
+    #  got an update that created them without the server hearing about it.
+    def __delta(self, baseline):
+        created = {}
+        masks = {}
+        destroyed = {}
+        
+        syncList = sync.GetSyncList()
+        
+        for tick in range(baseline + 1, self.__tick + 1):
+            record = syncList.GetSnapshot(tick)
+            
+            for objId in record.created:
+                created[objId] = None
+            
+            for objId, mask in record.changes.items():
+                if objId not in created:
+                    masks[objId] = masks.get(objId, 0) | mask
+            
+            for objId in record.destroyed:
+                masks.pop(objId, None)
+                created.pop(objId, None)
+                destroyed[objId] = None
+        
+        return (created, masks, destroyed)
+    
+    ## Records that an update was sent to a connection, so its tick becomes the connection's
+    #  baseline when it's acked.
+    def Sent(self, key, msgId, tick):
+        pending = self.__pending.setdefault(key, {})
+        pending[msgId] = tick
+        
+        # Updates too old to be a baseline aren't worth waiting for.
+        oldest = self.OldestBaseline()
+        
+        for oldId in [ oldId for oldId, oldTick in pending.items() if oldTick < oldest ]:
+            del pending[oldId]
+        
+        connectionInterest = self.__interests.get(key)
+        
+        if connectionInterest is not None:
+            connectionInterest.Sent(tick)
+            connectionInterest.Prune(oldest)
+        
+        accumulator = self.__accumulators.get(key)
+        
+        if accumulator is not None:
+            accumulator.Sent(tick)
+            accumulator.Prune(oldest)
+    
+    ## Called when a connection acks a message.  If it was an update, the connection's baseline
+    #  moves up to its tick.
+    #
+    #  @returns True if the message was an update.
+    def Acked(self, key, msgId):
+        pending = self.__pending.get(key)
+        
+        if pending is None or msgId not in pending:
+            return False
+        
+        tick = pending.pop(msgId)
+        
+        # An update sent before a full state isn't a baseline anymore, since the client throws
+        # away the objects a full state doesn't have, and may have got the full state since.
+        if key in self.__fullsent and tick < self.__fullsent[key][1]:
+            return True
+        
+        if tick > self.__baselines.get(key, 0):
+            self.__baselines[key] = tick
+            self.__fullsent.pop(key, None)
+            
+            if key in self.__interests:
+                self.__interests[key].Acked(tick)
+            
+            if key in self.__accumulators:
+                self.__accumulators[key].Acked(tick)
+        
+        return True
+    
+    ## Forgets a connection.
+    def RemoveConnection(self, key):
+        self.__baselines.pop(key, None)
+        self.__pending.pop(key, None)
+        self.__interests.pop(key, None)
+        self.__accumulators.pop(key, None)
+        self.__fullsent.pop(key, None)
+    
+    ## Returns a dictionary of statistics.
+    def Stats(self):
+        stats = { 'tick' : self.__tick,
+                  'replication_full' : self.__full,
+                  'replication_deltas' : self.__deltas,
+                  'replication_unchanged' : self.__unchanged,
+                  'replication_pending' : sum(len(pending) for pending in self.__pending.values() ),
+                }
+        
+        stats.update(self.__cache.Stats() )
+        stats.update(self.__grid.Stats() )
+        stats['interest_connections'] = len(self.__interests)
+        
+        for accumulator in self.__accumulators.values():
+            for name, value in accumulator.Stats().items():
+                stats[name] = stats.get(name, 0) + value
+        
+        return stats
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+import bisect
+
+## @file
+#  A ring of world snapshots, one for each of the last ticks.  Snapshots don't copy objects, they
+#  hold the encoded state of the objects that changed in their tick, as laid out by the objects'
+#  layouts.  An object that didn't change shares the state from the tick it last changed in, so a
+#  world where little moves costs little to keep, however many objects there are.
+#
+#  The snapshot of a tick is found in O(1), at tick % depth in the ring.  Each object also keeps
+#  the ticks it changed in, so its state at any tick in the ring is found with a binary search
+#  through at most depth of them.  Memory is bounded by the depth: once a tick falls out of the
+#  ring, only the newest state from before it is kept for each object, since that's still the
+#  object's state at the oldest tick in the ring.
+
+## The number of ticks kept by default.
+DEFAULT_DEPTH = 64
+
+## What happened in one tick.
+class nSnapshot(object):
+    ## The tick.
+    tick = None
+    
+    ## The dirty masks of the objects that changed, keyed by object ID.
+    changes = None
+    
+    ## The IDs of the objects created.
+    created = None
+    
+    ## The IDs of the objects destroyed.
+    destroyed = None
+    
+    ## The encoded full state of each object that was created or changed, keyed by object ID.
+    states = None
+    
+    def __init__(self, tick, changes, created, destroyed, states):
+        self.tick = tick
+        self.changes = changes
+        self.created = created
+        self.destroyed = destroyed
+        self.states = states
+
+## The ring of snapshots.  Used by nSyncList, which does the encoding.
+class nSnapshotRing(object):
+    ## The number of ticks kept.
+    __depth = None
+    
+    ## The snapshots, at tick % depth.
+    __ring = None
+    
+    ## The newest tick.
+    __tick = None
+    
+    ## The history of each object, keyed by object ID: a list of the ticks it changed in, and a
+    #  list of its encoded state after each.  A state of None means the object was destroyed.
+    __ticks = None
+    __states = None
+    
+    ## The type ID of each object with a history.
+    __types = None
+    
+    ## @param depth the number of ticks to keep.
+    def __init__(self, depth=DEFAULT_DEPTH):
+        self.__depth = max(1, depth)
+        self.__ring = [None] * self.__depth
+        self.__tick = 0
+        self.__ticks = {}
+        self.__states = {}
+        self.__types = {}
+    
+    ## Returns the number of ticks kept.
+    def Depth(self):
+        return self.__depth
+    
+    ## Changes the number of ticks kept.  Snapshots that no longer fit are dropped.
+    def SetDepth(self, depth):
+        snapshots = [ snapshot for snapshot in self.__ring if snapshot is not None ]
+        
+        self.__depth = max(1, depth)
+        self.__ring = [None] * self.__depth
+        
+        oldest = self.OldestTick()
+        
+        for snapshot in snapshots:
+            if snapshot.tick >= oldest:
+                self.__ring[snapshot.tick % self.__depth] = snapshot
+        
+        for objId in list(self.__ticks):
+            self.__prune(objId, oldest)
+    
+    ## Returns the newest tick.
+    def Tick(self):
+        return self.__tick
+    
+    ## Returns the oldest tick still in the ring.
+    def OldestTick(self):
+        return max(1, self.__tick - self.__depth + 1)
+    
+    ## Adds the snapshot of a new tick, pushing the oldest one out of the ring.
+    #
+    #  @param changes the dirty masks of the objects that changed, keyed by object ID.
+    #  @param created the IDs of the objects created.
+    #  @param destroyed the IDs of the objects destroyed.
+    #  @param states the encoded full state of each object created or changed, keyed by ID.
+    #  @param types the type ID of each object created, keyed by ID.
+    #  @returns the new nSnapshot.
+    def Add(self, changes, created, destroyed, states, types):
+        self.__tick += 1
+        tick = self.__tick
+        
+        slot = tick % self.__depth
+        evicted = self.__ring[slot]
+        
+        snapshot = nSnapshot(tick, changes, created, destroyed, states)
+        self.__ring[slot] = snapshot
+        
+        self.__types.update(types)
+        
+        for objId, state in states.items():
+            self.__append(objId, tick, state)
+        
+        for objId in destroyed:
+            self.__append(objId, tick, None)
+        
+        # The objects that changed in the tick that fell out may have history that's no longer
+        # needed.  Nothing else's can have changed.
+        if evicted is not None:
+            oldest = self.OldestTick()
+            
+            for objId in list(evicted.states) + evicted.destroyed:
+                self.__prune(objId, oldest)
+        
+        return snapshot
+    
+    def __append(self, objId, tick, state):
+        ticks = self.__ticks.get(objId)
+        
+        if ticks is None:
+            self.__ticks[objId] = [tick]
+            self.__states[objId] = [state]
+        elif ticks[-1] == tick:
+            self.__states[objId][-1] = state
+        else:
+            ticks.append(tick)
+            self.__states[objId].append(state)
+            
+            self.__prune(objId, self.OldestTick() )
+    
+    ## Drops the states of an object that are older than the newest one from before oldest.
+    #  If all that's left is that the object was destroyed, it's forgotten.
+    def __prune(self, objId, oldest):
+        ticks = self.__ticks.get(objId)
+        
+        if ticks is None:
+            return
+        
+        states = self.__states[objId]
+        
+        drop = bisect.bisect_right(ticks, oldest) - 1
+        
+        if drop > 0:
+            del ticks[:drop]
+            del states[:drop]
+        
+        if len(ticks) == 1 and states[0] is None and ticks[0] < oldest:
+            del self.__ticks[objId]
+            del self.__states[objId]
+            self.__types.pop(objId, None)
+    
+    ## Returns the snapshot of a tick, or None if it's not in the ring.
+    def Get(self, tick):
+        snapshot = self.__ring[tick % self.__depth]
+        
+        if snapshot is None or snapshot.tick != tick:
+            return None
+        
+        return snapshot
+    
+    ## Returns the encoded state of an object at a tick, or None if the object didn't exist
+    #  then or the tick isn't in the ring.
+    def GetState(self, tick, objId):
+        if tick < self.OldestTick() or tick > self.__tick:
+            return None
+        
+        ticks = self.__ticks.get(objId)
+        
+        if ticks is None:
+            return None
+        
+        # Objects mostly want their newest state.
+        if ticks[-1] <= tick:
+            return self.__states[objId][-1]
+        
+        index = bisect.bisect_right(ticks, tick) - 1
+        
+        if index < 0:
+            return None
+        
+        return self.__states[objId][index]
+    
+    ## Returns the type ID of an object with a state in the ring, or None.
+    def GetType(self, objId):
+        return self.__types.get(objId)
+    
+    ## Returns the number of states kept, for every object.
+    def StateCount(self):
+        return sum(len(ticks) for ticks in self.__ticks.values() )
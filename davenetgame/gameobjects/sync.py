@@ -21,146 +21,299 @@
 import struct
 
 from davenetgame import exceptions
-
-
-## nSyncObject is the class from which game objects that need to be synced must inherit.  After initializing
-#  the class, you must declare which attributes will be synced over the network.  Afterwards, you can modify
-#  those attributes at will and the network layer will automatically send out sync messages.  Note that you
-#  cannot sync objects from the client to the server, so modifying attributes on the client is only useful
-#  when you are predicting the action for players, but the client objects still need to inherit this class
-#  so they can receive sync messages.
+from davenetgame.gameobjects import columnar
+from davenetgame.gameobjects import layout
+from davenetgame.gameobjects import snapshot
+from davenetgame.gameobjects.attributes import base
+from davenetgame.gameobjects.attributes import builtin
+
+## The most sync attributes an object type can have, since each has a bit in a 64-bit mask.
+MAX_ATTRIBUTES = 64
+
+## The header of each object in an objectupdate message: the object ID and the number of bytes
+#  that follow it.  The mask of the attributes and their values follow, as the object type's
+#  layout writes them.  The length lets a client skip objects it doesn't have.
+_UPDATE = struct.Struct("!IH")
+
+## The most bytes the mask and values of one object's update can take.
+MAX_UPDATE = 0xFFFF
+
+## The header of each object in the creates of an objectupdate message: the object ID and its
+#  type ID.  The values of all its attributes follow.
+_CREATE = struct.Struct("!II")
+
+## Each object in the destroys of an objectupdate message.
+_DESTROY = struct.Struct("!I")
+
+## The metaclass of nSyncObject.  When a subclass is created, the sync attributes declared in its
+#  body are numbered, after those of its base classes, and given a slot each to hold their
+#  values.  A subclass that doesn't declare __slots__ itself still gets a __dict__, so games can
+#  keep whatever else they like on their objects.  A subclass that does declare __slots__ is
+#  nothing but slots, which is what you want for objects there are thousands of.
+class nSyncObjectType(type):
+    def __new__(meta, name, bases, namespace):
+        declared = [ (key, value) for key, value in namespace.items() if isinstance(value, base.nSyncAttributeBase) ]
+        
+        if '__slots__' in namespace:
+            slots = namespace['__slots__']
+            
+            if isinstance(slots, str):
+                slots = (slots, )
+            
+            slots = tuple(slots)
+        elif any(b.__dictoffset__ for b in bases):
+            slots = ()
+        else:
+            slots = ('__dict__', )
+        
+        namespace['__slots__'] = slots + tuple(base.SlotName(key) for key, value in declared)
+        
+        # Each class gets its own type ID and layout when it's registered, so don't inherit them.
+        namespace['_typeid'] = None
+        namespace['_layout'] = None
+        namespace['_columns'] = None
+        
+        cls = super().__new__(meta, name, bases, namespace)
+        
+        attributes = []
+        
+        for b in bases:
+            for attr in getattr(b, '_syncattributes', () ):
+                if attr not in attributes:
+                    attributes.append(attr)
+        
+        names = set(attr.Name() for attr in attributes)
+        
+        if len(attributes) + len(declared) > MAX_ATTRIBUTES:
+            raise exceptions.dngSyncObjectAttributeError(name + " has more than " + str(MAX_ATTRIBUTES) + " sync attributes")
+        
+        for key, value in declared:
+            if key in names:
+                raise exceptions.dngSyncObjectAttributeError("Sync attribute " + key + " is already declared in a base class")
+            
+            value._bind(len(attributes), getattr(cls, base.SlotName(key) ) )
+            attributes.append(value)
+        
+        cls._syncattributes = tuple(attributes)
+        
+        return cls
+
+## nSyncObject is the class from which game objects that need to be synced must inherit.  Synced
+#  attributes are declared in the class body, using the classes in attributes.builtin, and the
+#  class is registered with RegisterGameObjectType.  Afterwards, you can modify those attributes
+#  at will and the network layer will automatically send out sync messages.  Note that you
+#  cannot sync objects from the client to the server, so modifying attributes on the client is
+#  only useful when you are predicting the action for players, but the client objects still
+#  need to inherit this class so they can receive sync messages.
 #
-#  Syncing is currently naive and whether or not an object has been synced is a simple boolean state.
-#  Maybe some day there will be a more detailed sync object that tracks which connections have been
-#  synced, but for now, this naive object is all there is.
-class nSyncObject(object):
-    ## The list of attributes that are to be synced
-    _attributes = None
-    
-    ## The current ID for the next new attribute
-    __attrId = None
-    
-    ## If any attributes have been changed, then the object is marked dirty.
-    _isdirty = None
+#      class Ship(sync.nSyncObject):
+#          x = builtin.nSyncAttributeFloat(initial=0.0)
+#          y = builtin.nSyncAttributeFloat(initial=0.0)
+#
+#          def __init__(self):
+#              super().__init__()
+#              self.Finalize()
+#
+#      sync.RegisterGameObjectType(Ship)
+#
+#  Each object keeps a mask of the attributes changed since the last sync, with bit n for the
+#  attribute with ID n, and the sync list keeps the set of objects whose mask isn't empty.  A
+#  sync pass only ever looks at that set, so its cost follows how much changed, not how many
+#  objects there are.
+#
+#  Types there are very many objects of can be registered with the 'columnar' option, which keeps
+#  their numeric attributes in arrays instead of in the objects.  See columnar.py.
+#
+#  Attributes with ranges, quantized floats, varints and bools are sent in as few bits as they
+#  need, and the types declaring them are bit-packed.  See attributes/packed.py.
+class nSyncObject(object, metaclass=nSyncObjectType):
+    ## _id is the ID of this object.  All network objects have unique IDs.  _dirty is the mask of
+    #  the attributes changed since the last sync.  _row is the object's row in the column store,
+    #  for columnar types.
+    __slots__ = ('_id', '_dirty', '_row')
     
-    ## The ID of this object.  All network objects have unique IDs.
-    _id = None
+    ## The attributes that are to be synced, in the order of their IDs.  Set by the metaclass.
+    _syncattributes = ()
     
     ## The Type ID of this object.  All instances of each subclass will share the
     #  Type id that's assigned to their subclass.
     _typeid = None
-
+    
+    ## The binary layout of the type's attributes, a layout.nSyncLayout.  Compiled when the type
+    #  is registered.
+    _layout = None
+    
+    ## The columnar.nColumnStore holding the attributes of a type registered with the 'columnar'
+    #  option, or None.
+    _columns = None
+    
+    ## The ID of the game object that owns this one.
+    owner = builtin.nSyncAttributeInt(initial=0)
+    
     ## This init method should be called as soon as possible in subclasses so that an ID can be
-    #  established.
+    #  established and the attributes get their initial values.
     def __init__(self):
         super().__init__()
-        self._attributes = {}
         
-        self._isdirty = True
-
         theList = GetSyncList()
-
+        
         self._id = theList.GetNextId()
-        self.__attrId = 0
         
-        self.AddAttribute(name="owner",
-                          type=int,
-                          initial=0 )
+        self._SetInitialValues()
+        
+        # New objects are sent whole, so they start out clean.
+        self._dirty = 0
+    
+    ## Returns the ID of this object.
+    def id(self):
+        return self._id
+    
+    ## Creates an object to mirror one on the server, with the server's ID for it.  The class's
+    #  __init__ isn't called, and the object isn't added to the sync list.
+    @classmethod
+    def NewReplica(cls, objId):
+        obj = cls.__new__(cls)
+        
+        obj._id = objId
+        obj._SetInitialValues()
+        obj._dirty = 0
+        
+        return obj
+    
+    ## Gives every attribute its initial value, and a columnar object its row.
+    def _SetInitialValues(self):
+        store = type(self)._columns
+        self._row = None
+        
+        if store is not None:
+            store.Allocate(self)
+        
+        for attr in type(self)._syncattributes:
+            if store is None or not store.Holds(attr):
+                attr._member.__set__(self, attr.Initial() )
+    
+    ## Returns the binary layout of the type's attributes.  Types that haven't been registered
+    #  get theirs compiled here.
+    @classmethod
+    def Layout(cls):
+        if cls._layout is None:
+            cls._layout = layout.NewLayout(cls._syncattributes)
+        
+        return cls._layout
+    
+    ## Encodes the attributes in mask as one object's part of an objectupdate message: the
+    #  object's ID and length, then the mask and the values.
+    def EncodeUpdate(self, mask):
+        buf = bytearray()
+        self.EncodeUpdateInto(mask, buf, 0)
+        
+        return bytes(buf)
+    
+    ## Like EncodeUpdate, but encodes into the bytearray buf, starting at offset.
+    #
+    #  @returns the offset just past the update.
+    def EncodeUpdateInto(self, mask, buf, offset):
+        start = offset + _UPDATE.size
+        layout.Reserve(buf, start)
+        end = (type(self)._layout or type(self).Layout() ).EncodeUpdateInto(self, mask, buf, start)
+        
+        if end - start > MAX_UPDATE:
+            raise exceptions.dngSyncAttributeRangeError("Update of game object " + str(self._id) + " is " + str(end - start) + " bytes, more than " + str(MAX_UPDATE) )
+        
+        _UPDATE.pack_into(buf, offset, self._id, end - start)
+        
+        return end
+    
+    ## Encodes this object as one object's part of the creates of an objectupdate message: the
+    #  object's ID and type ID, then the values of all its attributes.
+    #
+    #  @returns the offset just past the object.
+    def EncodeCreateInto(self, buf, offset):
+        end = offset + _CREATE.size
+        layout.Reserve(buf, end)
+        _CREATE.pack_into(buf, offset, self._id, self._typeid)
+        
+        return (type(self)._layout or type(self).Layout() ).EncodeInto(self, self.FullMask(), buf, end)
+    
+    ## Returns a mask with a bit set for every attribute of this object.
+    def FullMask(self):
+        return (1 << len(type(self)._syncattributes) ) - 1
+    
+    ## Encodes the values of the attributes in mask, as laid out by the type's layout.
+    def EncodeState(self, mask):
+        return (type(self)._layout or type(self).Layout() ).Encode(self, mask)
+    
+    ## Sets the attributes in mask from values encoded by EncodeState.  They aren't marked dirty,
+    #  since this is how objects are synced.
+    #
+    #  @returns the offset just past the values.
+    def ApplyState(self, mask, data, offset=0):
+        return (type(self)._layout or type(self).Layout() ).Decode(self, mask, data, offset)
+    
+    ## Sets the attributes from this object's part of an objectupdate message, starting just past
+    #  the object ID, at the mask.
+    #
+    #  @returns the offset just past the values.
+    def ApplyUpdate(self, data, offset=0):
+        return (type(self)._layout or type(self).Layout() ).DecodeUpdate(self, data, offset)[1]
+    
+    ## Marks attributes dirty.  The compiled descriptors do this themselves.
+    def _MarkDirty(self, mask):
+        if not self._dirty:
+            GetSyncList().DirtySet().add(self)
         
-        # This probably isn't needed, but is kept "just in case".  It adds new instances to
-        # the list of game object types, but those types should already be added before we
-        # get here.
-        #GetGameObjectList().AddObjectType(type(self) )
+        self._dirty |= mask
     
     ## Serialize this object to a string.  This method is named to be consistent with protobuffers,
-    #  but does not use protobuffers to do anything.  Instead, it returns a tuple, where the first
-    #  item is the string that represents this object, and the second item is the format string
-    #  needed to unpack the object.  Both must be sent over the wire to the receiving end,
-    #  after being embedded into a message that is handled by protobuffers.
+    #  but does not use protobuffers to do anything.  Instead, it returns the object's dirty
+    #  attributes encoded as by EncodeUpdate, which the receiving end can decode with
+    #  ApplyUpdates.  The mask says which attributes are there, and the type's layout says how
+    #  they're packed, so nothing else needs to go over the wire.
     #
-    #  This method only encodes attributes marked as dirty, but by default does not mark them
-    #  as not dirty.  Pass True to indicate that you want the attributes marked clean, but keep
-    #  in mind that when you do that, subsequent calls will not obtain the attributes again until
-    #  their values actually change again.
+    #  This method only encodes the object if it's dirty, but by default does not mark it as not
+    #  dirty.  Pass True to indicate that you want it marked clean, but keep in mind that when
+    #  you do that, subsequent calls will not obtain the attributes again until their values
+    #  actually change again.
     def SerializeToString(self, clean=False):
-        formatString = "!"
-        encAttrs = ""
+        if not self._dirty:
+            return b''
+        
+        data = self.EncodeUpdate(self._dirty)
         
-        for key, value in self._attributes:
-            if value.IsDirty():
-                formatString += value.GetFormatString()
-                encAttrs += value.Encode()
-                
-                if clean:
-                    value.SetDirty(False)
+        if clean:
+            self._dirty = 0
+            GetSyncList().DirtySet().discard(self)
         
-        return (encAttrs, formatString)
+        return data
     
-    ## Subclasses must call this after declaring all attributes and stuff in order to finish setting
+    ## Subclasses must call this after setting up their attributes in order to finish setting
     #  up the object.  Without this call, the object will not sync.
     def Finalize(self):
         theList = GetSyncList()
         theList.AddSyncObject(self)
-        
+    
     ## Returns True if any syncable attributes are marked dirty.
     def IsDirty(self):
-        return self._isdirty
-
-    ## Add an attribute for this object.
-    #
-    #  @param name
-    #                           'name' : The name of the attribute.
-    #                           'type' : The type of the attribute.  Must be a type object.
-    #                           'static' : Indicates that the value cannot be changed.  Default is False.
-    #                                       Currently not implemented.
-    #                           "initial" : The initial value.  This is required, and it must be an instance
-    #                                       of the type given by the type parameter.
-    def AddAttribute(self, **desc):
-        if desc['name'] in self._attributes:
-            raise exceptions.dngSyncObjectAttributeError
-        
-        if isinstance(desc['initial'], desc['type']):
-            self._attributes[desc['name'] ] = nSyncAttribute(
-                                                name = desc['name'],
-                                                type = desc['type'],
-                                                value = desc['initial'],
-                                                id = self.__attrId
-                                                )
-            self.__attrId = self.__attrId + 1
-        else:
-            raise exceptions.dngSyncAttributeTypeError
-        
-    ## Overrides the default __getattribute__ behavior to allow for registered syncable attributes
-    #  to be treated as object.syncableattributes by calling code.  Basically, this is where the magic
-    #  starts that lets objects get synced, transparent to the calling code.
-    def __getattribute__(self, name):
-        if name in super().__getattribute__("_attributes"):
-            return super().__getattribute__("_attributes")[name]
-        else:
-            return super().__getattribute__(name)
-        
-    ## Overrides the default __setattr__ behavior to allow for registered syncable attributes to be
-    #  treated as object.syncableattributes by calling code.  If it's a syncable attribute, then
-    #  the real work of tracking changes in the values so they can be synced is done in the
-    #  nSyncAttribute object.  If not, it's passed on to let python just do its normal thing.
-    def __setattr__(self, name, value):
-        # First make sure we're not trying to directly access the _attributes method
-        if name == "_attributes":
-            super().__setattr__(name, value)
-        elif name in super().__getattribute__("_attributes"):
-            # Note that type checking happens in the nSyncAttribute class, not here.
-            super().__getattribute__("_attributes")[name].value = value
-            self._isdirty = True
-        else:
-            super().__setattr__(name, value)
-        
+        return self._dirty != 0
+    
+    ## Returns the mask of the attributes changed since the last sync.
+    def DirtyMask(self):
+        return self._dirty
 
 ## nSyncList holds the list of game objects that are to be synced over the network.  Periodically,
 #  when an nSyncObject is changed, the network layer will automatically generate and send sync packets.
 class nSyncList(object):
-    ## holds the list of objects that have been created.
+    ## holds the objects that have been created, keyed by ID.  On a client, these are the
+    #  replicas of the server's objects.
     __syncobjects = None
     
+    ## The objects with attributes changed since the last sync.  The compiled attribute
+    #  descriptors add to it directly, so it's never replaced, only emptied.
+    __dirty = None
+    
+    ## The column stores of the columnar types.
+    __stores = None
+    
     ## Holds the list of objects that have been created, but haven't had their first sync.
     __newobjects = None
     
@@ -170,13 +323,24 @@ class nSyncList(object):
     
     ## Current ID, unassigned.  Id=0 is currently reserved for no reason whatsoever.
     __currentid = None
+    
+    ## The snapshot.nSnapshotRing of the last ticks.
+    __snapshots = None
+    
+    ## The buffer snapshots are encoded in.
+    __buffer = None
 
     def __init__(self):
-        self.__syncobjects = []
+        self.__syncobjects = {}
+        self.__dirty = set()
+        self.__stores = []
         self.__newobjects = []
         self.__deleted_objects = []
         
         self.__currentid = 1
+        
+        self.__snapshots = snapshot.nSnapshotRing()
+        self.__buffer = bytearray()
 
     ## Gets the list of objects that have been created.  They will be moved from the
     #  __newobjects list to the __syncobjects list when you call this.
@@ -187,10 +351,209 @@ class nSyncList(object):
             aList.append(a)
         
         while len(self.__newobjects) > 0:
-            self.__syncobject.append(self.__newobjects.pop(0) )
-            
+            obj = self.__newobjects.pop(0)
+            self.__syncobjects[obj.id()] = obj
+        
         return aList
+    
+    ## Returns every object that has had its first sync.
+    def GetObjects(self):
+        return self.__syncobjects.values()
+    
+    ## Returns the object with the given ID, or None.
+    def GetObject(self, objId):
+        return self.__syncobjects.get(objId)
+    
+    ## Adds a replica of a server object, on a client.
+    def AddReplica(self, obj):
+        self.__syncobjects[obj.id()] = obj
+    
+    ## Removes a replica the server has destroyed, on a client.
+    def RemoveReplica(self, obj):
+        self.__syncobjects.pop(obj.id(), None)
+        self.__dirty.discard(obj)
+        
+        if type(obj)._columns is not None:
+            type(obj)._columns.Release(obj)
+    
+    ## Returns the set of dirty objects.  Used by the compiled attribute descriptors.
+    def DirtySet(self):
+        return self.__dirty
+    
+    ## Adds the column store of a columnar type, so its columns are checked for changes
+    #  before each sync.
+    def AddColumnStore(self, store):
+        self.__stores.append(store)
+    
+    ## Returns the objects that have changed since the last call, each in a tuple with its dirty
+    #  mask, and marks them clean.  Objects that haven't had their first sync yet are left out,
+    #  since their first sync sends them whole.
+    #
+    #  The set is emptied one object at a time, so objects the game marks dirty meanwhile are
+    #  either taken now or left for the next call, never lost.
+    def TakeDirtyObjects(self):
+        synced = self.__syncobjects
+        dirty = self.__dirty
+        changed = []
+        
+        for store in self.__stores:
+            store.DetectChanges()
+        
+        while dirty:
+            obj = dirty.pop()
+            mask = obj._dirty
+            obj._dirty = 0
+            
+            if synced.get(obj._id) is obj:
+                changed.append( (obj, mask) )
+        
+        return changed
+    
+    ## Encodes objectupdate records for the objects returned by TakeDirtyObjects into the
+    #  bytearray buf, starting at offset.  Objects of columnar types are encoded together, a
+    #  column at a time, when their store can do that.
+    #
+    #  @returns the offset just past the records.
+    def EncodeUpdates(self, changed, buf, offset=0):
+        bulk = {}
+        
+        for obj, mask in changed:
+            store = type(obj)._columns
+            
+            if store is not None and store.CanBulkEncode(mask):
+                bulk.setdefault( (store, mask), []).append(obj._row)
+            else:
+                offset = obj.EncodeUpdateInto(mask, buf, offset)
+        
+        for (store, mask), rows in bulk.items():
+            offset = store.EncodeUpdatesInto(rows, mask, buf, offset)
+        
+        return offset
+    
+    ## Like EncodeUpdates, but returns each object's record on its own, in the order of changed.
+    #  buf is only used as scratch space.
+    def EncodeUpdateRecords(self, changed, buf):
+        records = [None] * len(changed)
+        bulk = {}
+        
+        for index, (obj, mask) in enumerate(changed):
+            store = type(obj)._columns
+            
+            if store is not None and store.CanBulkEncode(mask):
+                rows, indexes = bulk.setdefault( (store, mask), ([], []) )
+                rows.append(obj._row)
+                indexes.append(index)
+            else:
+                end = obj.EncodeUpdateInto(mask, buf, 0)
+                records[index] = bytes(buf[:end])
+        
+        # Objects encoded together have the same mask and only fixed-size values, so their
+        # records are all the same size.
+        for (store, mask), (rows, indexes) in bulk.items():
+            end = store.EncodeUpdatesInto(rows, mask, buf, 0)
+            data = bytes(buf[:end])
+            size = end // len(rows)
+            
+            for position, index in enumerate(indexes):
+                records[index] = data[position * size:(position + 1) * size]
+        
+        return records
 
+    ## Returns the objects deleted since the last call, and forgets them.
+    def TakeDeletedObjects(self):
+        deleted = self.__deleted_objects
+        self.__deleted_objects = []
+        
+        return deleted
+    
+    ## @name Snapshots
+    #
+    #  The server keeps snapshots of the last ticks, for delta baselines, lag compensation and
+    #  the like.  See snapshot.py.
+    #@{
+    
+    ## Starts a new tick.  The objects created, changed and deleted since the last tick are
+    #  taken from the sync list, and the full state of those created or changed is encoded into
+    #  the tick's snapshot.  Objects that didn't change aren't touched.
+    #
+    #  @returns the new snapshot.nSnapshot.
+    def TakeSnapshot(self):
+        created = self.GetNewObjects()
+        changed = self.TakeDirtyObjects()
+        deleted = self.TakeDeletedObjects()
+        
+        objects = { obj._id : obj for obj in created }
+        
+        for obj, mask in changed:
+            objects[obj._id] = obj
+        
+        states = {}
+        bulk = []
+        
+        for obj in objects.values():
+            store = type(obj)._columns
+            
+            if store is not None and store.CanBulkEncode(obj.FullMask() ):
+                bulk.append( (obj, obj.FullMask() ) )
+            else:
+                states[obj._id] = obj.EncodeState(obj.FullMask() )
+        
+        # Objects that can be encoded in bulk are encoded as update records, which have the
+        # update header and the mask in front of the state.
+        header = _UPDATE.size + layout.MASK.size
+        
+        for (obj, mask), record in zip(bulk, self.EncodeUpdateRecords(bulk, self.__buffer) ):
+            states[obj._id] = record[header:]
+        
+        return self.__snapshots.Add({ obj._id : mask for obj, mask in changed },
+                                    [ obj._id for obj in created ],
+                                    [ obj._id for obj in deleted ],
+                                    states,
+                                    { obj._id : obj._typeid for obj in created } )
+    
+    ## Sets the number of ticks of snapshots kept.  Defaults to snapshot.DEFAULT_DEPTH.
+    def SetSnapshotDepth(self, depth):
+        self.__snapshots.SetDepth(depth)
+    
+    ## Returns the number of ticks of snapshots kept.
+    def SnapshotDepth(self):
+        return self.__snapshots.Depth()
+    
+    ## Returns the current tick.
+    def SnapshotTick(self):
+        return self.__snapshots.Tick()
+    
+    ## Returns the oldest tick with a snapshot.
+    def OldestSnapshotTick(self):
+        return self.__snapshots.OldestTick()
+    
+    ## Returns the snapshot.nSnapshot of a tick, or None if it's too old.
+    def GetSnapshot(self, tick):
+        return self.__snapshots.Get(tick)
+    
+    ## Returns the encoded full state of an object at a tick, as laid out by its type's layout,
+    #  or None.
+    def GetState(self, tick, objId):
+        return self.__snapshots.GetState(tick, objId)
+    
+    ## Returns the type ID of an object with a snapshot state, or None.
+    def GetStateType(self, objId):
+        return self.__snapshots.GetType(objId)
+    
+    ## Returns the attributes of an object at a tick, as a dictionary keyed by attribute name,
+    #  or None if there's no state for it.
+    def GetAttributes(self, tick, objId):
+        state = self.GetState(tick, objId)
+        
+        if state is None:
+            return None
+        
+        objLayout = GetGameObjectList().NewObject(self.GetStateType(objId) ).Layout()
+        
+        return objLayout.DecodeValues(objLayout.FullMask(), state)
+    
+    #@}
+    
     def GetNextId(self):
         _id = self.__currentid
         
@@ -202,7 +565,128 @@ class nSyncList(object):
         self.__newobjects.append(obj)
 
     def DeleteSyncObject(self, obj):
-        pass
+        self.__syncobjects.pop(obj.id(), None)
+        self.__dirty.discard(obj)
+        
+        if type(obj)._columns is not None:
+            type(obj)._columns.Release(obj)
+        
+        if obj in self.__newobjects:
+            self.__newobjects.remove(obj)
+        
+        self.__deleted_objects.append(obj)
+
+## Applies the updates in an objectupdate message to the objects in the sync list.
+#
+#  @param data the message's updates field.
+#  @returns the objects that were updated.
+def ApplyUpdates(data):
+    syncList = GetSyncList()
+    
+    updated = []
+    offset = 0
+    
+    while offset + _UPDATE.size <= len(data):
+        objId, length = _UPDATE.unpack_from(data, offset)
+        offset += _UPDATE.size
+        end = offset + length
+        
+        if end > len(data):
+            print("Warning: truncated update for game object " + str(objId) )
+            break
+        
+        obj = syncList.GetObject(objId)
+        
+        # The length says where the next object starts, so an object the client doesn't have
+        # is skipped.
+        if obj is None:
+            print("Warning: update for unknown game object " + str(objId) )
+        else:
+            obj.ApplyUpdate(data, offset)
+            updated.append(obj)
+        
+        offset = end
+    
+    return updated
+
+## Creates replicas of the objects in the creates of an objectupdate message, and adds them to
+#  the sync list.  Objects that already have a replica are set to the state in the message.
+#
+#  @param data the message's creates field.
+#  @returns a tuple of the objects created and the objects that already existed.
+def ApplyCreates(data):
+    syncList = GetSyncList()
+    objList = GetGameObjectList()
+    
+    created = []
+    existing = []
+    offset = 0
+    
+    while offset + _CREATE.size <= len(data):
+        objId, typeId = _CREATE.unpack_from(data, offset)
+        offset += _CREATE.size
+        
+        obj = syncList.GetObject(objId)
+        
+        if obj is None:
+            obj = objList.NewObject(typeId).NewReplica(objId)
+            offset = obj.ApplyState(obj.FullMask(), data, offset)
+            
+            syncList.AddReplica(obj)
+            created.append(obj)
+        else:
+            offset = obj.ApplyState(obj.FullMask(), data, offset)
+            existing.append(obj)
+    
+    return (created, existing)
+
+## Removes the replicas of the objects in the destroys of an objectupdate message.
+#
+#  @param data the message's destroys field.
+#  @returns the objects removed.
+def ApplyDestroys(data):
+    syncList = GetSyncList()
+    
+    destroyed = []
+    
+    for offset in range(0, len(data) - _DESTROY.size + 1, _DESTROY.size):
+        obj = syncList.GetObject(_DESTROY.unpack_from(data, offset)[0])
+        
+        if obj is not None:
+            syncList.RemoveReplica(obj)
+            destroyed.append(obj)
+    
+    return destroyed
+
+## Applies a whole objectupdate message: its creates, then its updates, then its destroys.  A
+#  full state has every object, so any replica not in it is removed too.
+#
+#  @param msg the objectupdate message.
+#  @returns a tuple of the objects created, the objects updated and the objects removed.
+def ApplyObjectUpdate(msg):
+    created, existing = ApplyCreates(msg.creates)
+    updated = ApplyUpdates(msg.updates)
+    destroyed = ApplyDestroys(msg.destroys)
+    
+    if msg.baseline == 0:
+        syncList = GetSyncList()
+        kept = set(obj.id() for obj in created + existing)
+        
+        for obj in list(syncList.GetObjects() ):
+            if obj.id() not in kept:
+                syncList.RemoveReplica(obj)
+                destroyed.append(obj)
+    
+    return (created, updated, destroyed)
+
+## Encodes an object for the creates of an objectupdate message, from its type ID and its full
+#  state, as kept in the snapshots.
+def EncodeCreate(objId, typeId, state):
+    return _CREATE.pack(objId, typeId) + state
+
+## Encodes the IDs of destroyed objects for the destroys of an objectupdate message.
+def EncodeDestroys(objIds):
+    return b''.join(_DESTROY.pack(objId) for objId in objIds)
 
 ## Call this function when you declare the class.  The library doesn't need to be
 #  initialized or anything for this function to work.  But before you can connect
@@ -212,15 +696,27 @@ class nSyncList(object):
 #  @todo update this function's documentation.
 #
 #  @param objType A type object representing the class.
-#  @param options a dictionary containing options for the type.  Currently the only implemented
-#                 option is "player", indicating that the object type is the player object.  Only
-#                 one player object can exist.
+#  @param options a dictionary containing options for the type.  Currently the implemented
+#                 options are:
+#                     "player" : the object type is the player object.  Only one player object
+#                                can exist.
+#                     "columnar" : if True, the numeric attributes of objects of this type are
+#                                  kept in arrays, see columnar.py.  For types there are
+#                                  thousands of objects of.  What goes over the wire is the
+#                                  same either way.
+#                     "position" : the names of the two sync attributes holding the position
+#                                  of objects of this type, like ('x', 'y').  Connections given
+#                                  an interest circle are only sent the objects in it, see
+#                                  interest.py.
+#                     "priority" : how much updates of objects of this type matter next to
+#                                  others, for connections with a bandwidth cap.  Defaults to
+#                                  1.0, see priority.py.
 #  @param typeId You can pass in a type ID and have it declared manually, allowing for backwards
 #                compatibility, if need be.  Currently unimplemented.
 def RegisterGameObjectType(objType, options={}, typeId=None):
     objList = GetGameObjectList()
     
-    objList.AddObjectType(objType, options, typeId)
+    return objList.AddObjectType(objType, options, typeId)
     
 
 ## Tracks and assigns numbers for each nSyncObject subclass.  It does absolutely
@@ -242,7 +738,8 @@ class nGameObjects(object):
         self.__typeIds = {}
         self.__options = {}
         
-    ## Adds a new type object to the list of available types and assigns an id to it.
+    ## Adds a new type object to the list of available types and assigns an id to it.  Its
+    #  sync attributes are compiled into the descriptors used from then on.
     #
     #  @param newType the new type object to add.
     #  @param options a dictionary of options for the game object type.
@@ -256,9 +753,28 @@ class nGameObjects(object):
         if newTypeName not in self.__typeIds:
             self.__typeIds[newTypeName] = self.__currentid
             self.__types[self.__currentid] = newType    
-            self.__currentid = self.__currentid + 1
             self.__options[self.__currentid] = options
             
+            newType._typeid = self.__currentid
+            
+            dirtySet = GetSyncList().DirtySet()
+            store = None
+            
+            if options.get('columnar'):
+                store = columnar.nColumnStore(newType, dirtySet)
+                newType._columns = store
+                GetSyncList().AddColumnStore(store)
+            
+            newType._layout = layout.NewLayout(newType._syncattributes, store)
+            
+            for attr in newType._syncattributes:
+                if store is not None and store.Holds(attr):
+                    setattr(newType, attr.Name(), store.Compile(attr) )
+                else:
+                    setattr(newType, attr.Name(), attr.Compile(newType, dirtySet) )
+            
+            self.__currentid = self.__currentid + 1
+            
         return self.__types[self.__typeIds[newTypeName] ]
     
     ## Returns the object options, after given a typeId
@@ -273,7 +789,7 @@ class nGameObjects(object):
     #
     #  @param typeId The ID for the type you want to create.
     def NewObject(self, typeId):
-        return self.__type[typeId]
+        return self.__types[typeId]
 
 __gameobjlist = None
 
@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   name='objectcreate.proto',
   package='',
   syntax='proto2',
-  serialized_pb=_b('\n\x12objectcreate.proto\"\x88\x01\n\x0cObjectCreate\x12\n\n\x02id\x18\x01 \x02(\x07\x12\r\n\x05mtype\x18\x02 \x02(\x07\x12\x11\n\ttimestamp\x18\x03 \x02(\x01\x12\r\n\x05otype\x18\x04 \x02(\x07\x12\r\n\x05owner\x18\x05 \x01(\x07\x12\x16\n\x0einitial_values\x18\x06 \x01(\t\x12\x14\n\x0cvalue_string\x18\x07 \x01(\t')
+  serialized_pb=_b('\n\x12objectcreate.proto\"\x85\x01\n\x0cObjectCreate\x12\n\n\x02id\x18\x01 \x02(\x07\x12\r\n\x05mtype\x18\x02 \x02(\x07\x12\x11\n\ttimestamp\x18\x03 \x02(\x01\x12\r\n\x05otype\x18\x04 \x02(\x07\x12\r\n\x05owner\x18\x05 \x01(\x11\x12\x16\n\x0einitial_values\x18\x06 \x01(\x0c\x12\x0b\n\x03oid\x18\x08 \x01(\x07J\x04\x08\x07\x10\x08')
 )
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -63,22 +63,22 @@ _OBJECTCREATE = _descriptor.Descriptor(
       options=None),
     _descriptor.FieldDescriptor(
       name='owner', full_name='ObjectCreate.owner', index=4,
-      number=5, type=7, cpp_type=3, label=1,
+      number=5, type=17, cpp_type=1, label=1,
       has_default_value=False, default_value=0,
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
     _descriptor.FieldDescriptor(
       name='initial_values', full_name='ObjectCreate.initial_values', index=5,
-      number=6, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
+      number=6, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
     _descriptor.FieldDescriptor(
-      name='value_string', full_name='ObjectCreate.value_string', index=6,
-      number=7, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
+      name='oid', full_name='ObjectCreate.oid', index=6,
+      number=8, type=7, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
@@ -95,7 +95,7 @@ _OBJECTCREATE = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=23,
-  serialized_end=159,
+  serialized_end=156,
 )
 
 DESCRIPTOR.message_types_by_name['ObjectCreate'] = _OBJECTCREATE
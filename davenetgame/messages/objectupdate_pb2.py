@@ -0,0 +1,118 @@
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: objectupdate.proto
+
+import sys
+_b=sys.version_info[0]<3 and (lambda x:x) or (lambda x:x.encode('latin1'))
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf import descriptor_pb2
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor.FileDescriptor(
+  name='objectupdate.proto',
+  package='',
+  syntax='proto2',
+  serialized_pb=_b('\n\x12objectupdate.proto\"\x90\x01\n\x0cObjectUpdate\x12\n\n\x02id\x18\x01 \x02(\x07\x12\r\n\x05mtype\x18\x02 \x02(\x07\x12\x11\n\ttimestamp\x18\x03 \x02(\x01\x12\x0f\n\x07updates\x18\x04 \x01(\x0c\x12\x0c\n\x04tick\x18\x05 \x01(\x07\x12\x10\n\x08\x62\x61seline\x18\x06 \x01(\x07\x12\x0f\n\x07\x63reates\x18\x07 \x01(\x0c\x12\x10\n\x08\x64\x65stroys\x18\x08 \x01(\x0c')
+)
+_sym_db.RegisterFileDescriptor(DESCRIPTOR)
+
+
+
+
+_OBJECTUPDATE = _descriptor.Descriptor(
+  name='ObjectUpdate',
+  full_name='ObjectUpdate',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='id', full_name='ObjectUpdate.id', index=0,
+      number=1, type=7, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='mtype', full_name='ObjectUpdate.mtype', index=1,
+      number=2, type=7, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='timestamp', full_name='ObjectUpdate.timestamp', index=2,
+      number=3, type=1, cpp_type=5, label=2,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='updates', full_name='ObjectUpdate.updates', index=3,
+      number=4, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='tick', full_name='ObjectUpdate.tick', index=4,
+      number=5, type=7, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='baseline', full_name='ObjectUpdate.baseline', index=5,
+      number=6, type=7, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='creates', full_name='ObjectUpdate.creates', index=6,
+      number=7, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='destroys', full_name='ObjectUpdate.destroys', index=7,
+      number=8, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto2',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=23,
+  serialized_end=167,
+)
+
+DESCRIPTOR.message_types_by_name['ObjectUpdate'] = _OBJECTUPDATE
+
+ObjectUpdate = _reflection.GeneratedProtocolMessageType('ObjectUpdate', (_message.Message,), dict(
+  DESCRIPTOR = _OBJECTUPDATE,
+  __module__ = 'objectupdate_pb2'
+  # @@protoc_insertion_point(class_scope:ObjectUpdate)
+  ))
+_sym_db.RegisterMessage(ObjectUpdate)
+
+
+# @@protoc_insertion_point(module_scope)
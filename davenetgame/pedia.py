@@ -24,6 +24,7 @@ import importlib, time
 #import inspect
 
 from davenetgame import exceptions
+from davenetgame.protocol import channels
 
 ## This class is the master list of all messages.  If you want to create a message, you have to
 #  get the type from here.  If you want to decode a message, you give this class the message 
@@ -41,7 +42,7 @@ messageList = None
 #  to the classes to encode/decode messages.
 class Messages(object):
     ## Stores the actual message list, indexed by message ID, which is an integer.  Items are
-    #  of the form (message name, module name, class name)
+    #  of the form (message name, module name, class name, options)
     __messageList = None
     
     ## A lookup table, indexed by message name that gives the message ID, which is an integer.
@@ -75,11 +76,14 @@ class Messages(object):
         # Add all of the internal message types here, to ensure that they get the right
         # IDs
         self.AddInternalMessageType("ping", "Ping", {'nologin':None} )
-        self.AddInternalMessageType("ack", "Ack")
+        self.AddInternalMessageType("ack", "Ack", {'noack':None} )
         self.AddInternalMessageType("login", "Login", {'nologin':None} )
-        self.AddInternalMessageType("logout", "Logout")
-        self.AddInternalMessageType("chat", "Chat")
-        self.AddInternalMessageType("objectcreate", "ObjectCreate")
+        self.AddInternalMessageType("logout", "Logout", {'channel':channels.RELIABLE_UNORDERED} )
+        self.AddInternalMessageType("chat", "Chat", {'channel':channels.RELIABLE_ORDERED} )
+        self.AddInternalMessageType("objectcreate", "ObjectCreate", {'channel':channels.RELIABLE_ORDERED} )
+        self.AddInternalMessageType("blob", "Blob", {'noack':None} )
+        self.AddInternalMessageType("bloback", "BlobAck", {'noack':None} )
+        self.AddInternalMessageType("objectupdate", "ObjectUpdate", {'noack':None} )
 
     ## Adds a message type.  Provide it with a name and the location of the module from which
     #  the *_pb2.py file will be imported.  The order in which messages are added *matters*,
@@ -92,8 +96,11 @@ class Messages(object):
     #               to create the name of the file that contains the message, i.e. ping_pb2.py
     #   @param classname the name of the class that we'll find inside the _pb2.py file, as defined
     #                    in the .proto file.
-    #  @param options the options for the message.  Currently, only "nologin" is supported,
-    #                 and means that the message doesn't require login to be processed.  Note
+    #  @param options the options for the message.  "nologin" means that the message
+    #                 doesn't require login to be processed, and "noack" means that the
+    #                 sender doesn't wait for the message to be acked.  "channel" picks the
+    #                 delivery channel, one of the constants in protocol.channels, and is
+    #                 UNRELIABLE if not given.  Note
     #                 that this is a dictionary, and 'nologin' is a key.  The value associated
     #                 with the key is not evaluated in any way, so assigning it a value of None
     #                 is so useless that it is comical to do so.  Who doesn't like a meaningful
@@ -109,8 +116,11 @@ class Messages(object):
     #               to create the name of the file that contains the message, i.e. ping_pb2.py
     #   @param classname the name of the class that we'll find inside the _pb2.py file, as defined
     #                    in the .proto file.
-    #  @param options the options for the message.  Currently, only "nologin" is supported,
-    #                 and means that the message doesn't require login to be processed.  Note
+    #  @param options the options for the message.  "nologin" means that the message
+    #                 doesn't require login to be processed, and "noack" means that the
+    #                 sender doesn't wait for the message to be acked.  "channel" picks the
+    #                 delivery channel, one of the constants in protocol.channels, and is
+    #                 UNRELIABLE if not given.  Note
     #                 that this is a dictionary, and 'nologin' is a key.  The value associated
     #                 with the key is not evaluated in any way, so assigning it a value of None
     #                 is so useless that it is comical to do so.  Who doesn't like a meaningful
@@ -124,8 +134,11 @@ class Messages(object):
     #  @param name the name of the message type.
     #   @param classname the name of the class that we'll find inside the _pb2.py file, as defined
     #                    in the .proto file.
-    #  @param options the options for the message.  Currently, only "nologin" is supported,
-    #                 and means that the message doesn't require login to be processed.  Note
+    #  @param options the options for the message.  "nologin" means that the message
+    #                 doesn't require login to be processed, and "noack" means that the
+    #                 sender doesn't wait for the message to be acked.  "channel" picks the
+    #                 delivery channel, one of the constants in protocol.channels, and is
+    #                 UNRELIABLE if not given.  Note
     #                 that this is a dictionary, and 'nologin' is a key.  The value associated
     #                 with the key is not evaluated in any way, so assigning it a value of None
     #                 is so useless that it is comical to do so.  Who doesn't like a meaningful
@@ -138,7 +151,7 @@ class Messages(object):
             if name not in self.__messageNames:
                 if self.__lastmessageId < 256:
                     self.__messageNames[name] = self.__lastmessageId
-                    self.__messageList[self.__lastmessageId] = [name, module, classname]
+                    self.__messageList[self.__lastmessageId] = [name, module, classname, options]
                     self.__lastmessageId = self.__lastmessageId + 1
                 else:
                     pass
@@ -149,7 +162,7 @@ class Messages(object):
         else:
             if name not in self.__messageNames:
                 self.__messageNames[name] = self.__lastCustomMessageId
-                self.__messageList[self.__lastCustomMessageId] = [name, module, classname]
+                self.__messageList[self.__lastCustomMessageId] = [name, module, classname, options]
                 self.__lastCustomMessageId = self.__lastCustomMessageId + 1
             else:
                 pass
@@ -210,9 +223,13 @@ class Messages(object):
         
         return retType
         
-    ## Gets a type ID for the message being sent
+    ## Gets a type ID for the message being sent, given either the message or the name of its
+    #  type.
     def GetTypeId(self, msg):
-        for key, value in self.__messageList.items():
+        if type(msg) == str:
+            return self.__messageNames.get(msg)
+        
+        for key, value in self.__messageTypes.items():
             if type(msg) == value:
                 return key
     
@@ -224,8 +241,11 @@ class Messages(object):
     
     ## Gets the message options without creating a type object for them.
     def GetMessageOptions(self, Id):
+        if type(Id) == str:
+            Id = self.__messageNames.get(Id)
+        
         if Id in self.__messageList:
-            return self.__messageList[Id]['options']
+            return self.__messageList[Id][3]
         
         return {}
     
@@ -18,13 +18,15 @@
 
 '''
 
-import time, threading
+import time, threading, asyncio
 
 from davenetgame import paths
 from davenetgame import pedia
 from davenetgame import exceptions
 from davenetgame import log
 from davenetgame.protocol import connection
+from davenetgame.protocol import bulk
+from davenetgame.protocol import channels
 from davenetgame.gameobjects import sync
 
 ## These are constants associated with connections.  They generally give the status of the connection.
@@ -100,6 +102,13 @@ class ProtocolBase(object):
     #  class, ready to serialize and send, and a connection to send it to.
     __outgoing_messages = None
     
+    ## Outgoing messages that are already serialized, like reliable messages being resent.  It's
+    #  a list in the format returned by GetOutgoingMessages.
+    __outgoing_raw = None
+    
+    ## The channels.ChannelState of each connection, keyed by str(connection).
+    __channels = None
+    
     ## This is used on the server to maintain a list of connections.  The client uses it, too,
     #  but only keeps one connection on it.  Use ConnectionList() or Connection() to access either
     #  the entire list, or the first connection in the list.
@@ -118,6 +127,17 @@ class ProtocolBase(object):
     #  keyed by connection, of the form given by str(connection)
     __lock = None
     
+    ## When the transport is driven by asyncio, this event is set whenever there are outgoing
+    #  messages waiting, so the send flush task wakes up right away.
+    __flush_event = None
+    
+    ## The asyncio tasks running maintenance and the send flush, when the transport is driven
+    #  by asyncio.
+    __tasks = None
+    
+    ## The bulk.BulkTransfers object running this protocol's blob transfers.  Core protocols only.
+    __bulk = None
+    
     def __init__(self, **args):
         self.__host = 'localhost'
         self.__port = 8888
@@ -141,6 +161,9 @@ class ProtocolBase(object):
         self.__pedia = pedia.getPedia()
         
         self.__outgoing_messages = []
+        self.__outgoing_raw = []
+        
+        self.__channels = {}
         
         self.__callback_messages = []
         
@@ -152,6 +175,15 @@ class ProtocolBase(object):
             self.RegisterMessageCallback('ping', self.PingMessage)
             self.RegisterMessageCallback('ack', self.AckMessage)
             
+            bandwidth = bulk.DEFAULT_BANDWIDTH
+            if 'bulkbandwidth' in args:
+                bandwidth = args['bulkbandwidth']
+            
+            self.__bulk = bulk.BulkTransfers(self, bandwidth)
+            
+            self.RegisterMessageCallback('blob', self.__bulk.BlobMessage)
+            self.RegisterMessageCallback('bloback', self.__bulk.BlobAckMessage)
+            
             self.__rec_ack_list = {}
             self.__sent_ack_list = {}
     
@@ -162,7 +194,9 @@ class ProtocolBase(object):
     def Ack(self, msgId, connection):
         theCon = connection
         
-        self.__rec_ack_list[str(theCon)].append([msgId, theCon])
+        # The connection may have been removed since the message arrived.
+        if str(theCon) in self.__rec_ack_list:
+            self.__rec_ack_list[str(theCon)].append([msgId, theCon])
         
     def Ping(self, connection):
         theMsg = self.Pedia().GetMessageObject('ping')
@@ -176,9 +210,23 @@ class ProtocolBase(object):
         self.__connection_list.append(connection)
         self.__sent_ack_list[str(connection)] = []
         self.__rec_ack_list[str(connection)] = []
+        self.__channels[str(connection)] = channels.ChannelState()
         
         print(self.__sent_ack_list)
     
+    ## Call to remove a connection that has logged out or timed out.  Its acks and its channel
+    #  state, along with any reliable messages still waiting to be resent, are forgotten, and so
+    #  is what the transport keeps for it.  Messages still queued for it are dropped.
+    def RemoveConnection(self, connection):
+        self.__connection_list.Remove(connection)
+        
+        self.__sent_ack_list.pop(str(connection), None)
+        self.__rec_ack_list.pop(str(connection), None)
+        self.__channels.pop(str(connection), None)
+        
+        if self.__transport is not None:
+            self.__transport.ForgetConnection(connection.info() )
+    
     def ConnectionList(self):
         return self.__connection_list
     
@@ -210,9 +258,17 @@ class ProtocolBase(object):
     
     ## Maintain connections.  This is called from within the socket polling thread.
     def MaintainConnections(self):
-        # If there are no connections, nothing should happen here.
-        for con in self.__connection_list:
+        # If there are no connections, nothing should happen here.  Maintaining a connection
+        # may remove it, so go through a copy of the list.
+        for con in list(self.__connection_list):
             self.MaintainConnection(con)
+        
+        # Now sync game objects, once for every connection.
+        self.SyncObjects()
+        
+        self.AcquireLock()
+        self.__bulk.Update(time.time() )
+        self.ReleaseLock()
     
     ## Maintain one single connection
     def MaintainConnection(self, con):
@@ -239,6 +295,22 @@ class ProtocolBase(object):
             if sendAck:
                 self.AddOutgoingMessage(theMsg, theCon)
             
+        # Send again any reliable messages that haven't been acked in time.
+        state = self.__channels.get(str(con) )
+        
+        if state is not None:
+            resends = state.Resends(timestep, channels.ResendTimeout(con.ping() ) )
+            
+            for typeId, data in resends:
+                self.__outgoing_raw.append( { 'message' : data,
+                                              'type' : typeId,
+                                              'connection' : con.info() } )
+            
+            # The flush task only wakes up for queued messages, so it has to be told about
+            # resends too, or an idle connection never retransmits.
+            if len(resends) > 0 and self.__flush_event is not None:
+                self.__flush_event.set()
+        
         # Clean out the ping list of expired pings.
         #cleaned_list = [ x for x in self.__pinglist if (timestep - x[1]) < 2.0 ]
         #self.__pinglist = cleaned_list
@@ -282,9 +354,6 @@ class ProtocolBase(object):
         
         con.CalculatePing()
         
-        # Now sync game objects.
-        self.SyncObjects()
-        
     ## Sync game objects.  Base implementation does nothing, because this is highly dependent on
     #  the protocol itself.  In a typical client->server protocol, the client will implement this
     #  as a receiving sync objects while the server will implement this to send sync objects.
@@ -303,7 +372,32 @@ class ProtocolBase(object):
                 print("Warning: having to retrieve a timestamp in ReceiveMessage")
             
             con.set_lastrecv(timestamp)
+    
+    ## Called by the transport for each message received on a channel other than UNRELIABLE,
+    #  before it's parsed.  Reliable messages are acked, and the channel decides what can be
+    #  delivered.
+    #
+    #  @param channel the message type's channel.
+    #  @param typeId the message type ID.
+    #  @param data the message as received, sequence number and all.
+    #  @param connectInfo the (host, port) tuple the message came from.
+    #  @returns a list of (typeId, serialized message) tuples to be processed, in order.
+    def ReceiveChannel(self, channel, typeId, data, connectInfo):
+        con = self.Connection(connectInfo)
+        
+        # Without a connection there's nothing to keep track of the channel with.
+        if con is None or str(con) not in self.__channels:
+            return [ (typeId, data[channels.HEADER_SIZE:]) ]
+        
+        if channels.IsReliable(channel):
+            msgId = channels.PeekMessageId(data, channels.HEADER_SIZE)
+            
+            # Duplicates are acked too, since our earlier ack may be what got lost.
+            if msgId is not None:
+                self.Ack(msgId, con)
         
+        return self.__channels[str(con)].Receive(channel, typeId, data)
+    
     ## Adds an outgoing message to the queue.
     #
     #  @param msg the message object to send
@@ -313,6 +407,9 @@ class ProtocolBase(object):
                                           'connection' : connection
                                         }
                                     )
+        
+        if self.__flush_event is not None:
+            self.__flush_event.set()
     
     ## Returns a list of outgoing messages.  These have to be retrieved from each Protocol object
     #  associated with the transport and combined into one list where each item is 
@@ -327,21 +424,44 @@ class ProtocolBase(object):
         # First, go to all other protocol objects and get their messages.
         # TODO: Implement this
         
+        # Messages being resent go first, since they're late already.
+        if len(self.__outgoing_raw) > 0:
+            retList.extend(self.__outgoing_raw)
+            self.__outgoing_raw = []
+        
         # Now, get all the messages from this protocol object
         while len(self.__outgoing_messages) > 0:
             msg = self.__outgoing_messages.pop(0)
+            
+            # The connection was removed while this was queued.
+            if str(msg['connection']) not in self.__sent_ack_list:
+                continue
+            
+            options = self.Pedia().GetMessageOptions(msg['message'].mtype)
 
             # Add to the ack list of acks we're expecting to receive.  Don't add it to the 
-            # list if the outgoing message is itself an ack.  Don't ack an ack!
+            # list if the outgoing message is itself an ack, or is otherwise never acked,
+            # like the chunks of a bulk transfer.  Don't ack an ack!
             # We do it here because this is the last chance we can before the message gets sent.
-            if msg['message'].mtype != self.Pedia().GetTypeId('ack'):
+            if 'noack' not in options:
                 self.__sent_ack_list[str(msg['connection'])].append( 
                     { 'id' : msg['message'].id, 
                       'connection' : msg['connection'],
                       'timestamp' : time.time()
                       } )
         
-            theMsg = { 'message' : msg['message'].SerializeToString(),
+            payload = msg['message'].SerializeToString()
+            
+            channel = channels.GetChannel(options)
+            
+            if channel != channels.UNRELIABLE:
+                payload = self.__channelState(msg['connection']).Send(channel,
+                                                                       msg['message'].mtype,
+                                                                       msg['message'].id,
+                                                                       payload,
+                                                                       time.time() )
+            
+            theMsg = { 'message' : payload,
                        'type' : msg['message'].mtype,
                        'connection' : msg['connection'].info() }
             
@@ -349,6 +469,15 @@ class ProtocolBase(object):
         
         return retList
     
+    ## Returns the channel state of a connection, creating it if needed.
+    def __channelState(self, connection):
+        key = str(connection)
+        
+        if key not in self.__channels:
+            self.__channels[key] = channels.ChannelState()
+        
+        return self.__channels[key]
+    
     ## @name Callback Methods
     #
     #  These are the callback methods for particular messages.
@@ -360,7 +489,14 @@ class ProtocolBase(object):
         
         con = str(theCon)
         
+        state = self.__channels.get(con)
+        
         for acked in args['message'].replied:
+            if state is not None:
+                state.Acked(acked)
+            
+            self.MessageAcked(acked, theCon)
+            
             counter = 0
             foundAck = False
             for a in self.__sent_ack_list[con]:
@@ -379,6 +515,13 @@ class ProtocolBase(object):
     def PingMessage(self, **args):
         pass
     
+    ## Called for every message the other side acks.  The base implementation does nothing.
+    #
+    #  @param msgId the ID of the message acked.
+    #  @param connection the connection that acked it.
+    def MessageAcked(self, msgId, connection):
+        pass
+    
     #@}
     
     ## Call to determine if this is the core protocol object.  Used by the EventDispatcher
@@ -435,6 +578,70 @@ class ProtocolBase(object):
         
         return bw
     
+    ## Returns a dictionary of statistics for this protocol and its transport.  Every value is
+    #  a number.  Most are counts, which can be added together across servers, but some, like
+    #  network_rtt, are averages or maximums.  dispatch.shard lists those and combines them
+    #  properly.
+    def Stats(self):
+        self.__transport.AcquireLock()
+        stats = self.__transport.Stats()
+        self.__transport.ReleaseLock()
+        
+        stats['connections'] = len(self.__connection_list)
+        
+        # The average ping.  Acks are timed from when they arrived, so with kernel timestamps
+        # this is the round trip on the network, and the transport's processing_delay is the
+        # time spent on our side.
+        stats['network_rtt'] = 0.0
+        
+        if len(self.__connection_list) > 0:
+            stats['network_rtt'] = sum(con.ping() for con in self.__connection_list) / len(self.__connection_list)
+        
+        self.AcquireLock()
+        
+        if self.__bulk is not None:
+            stats.update(self.__bulk.Stats() )
+        
+        for state in self.__channels.values():
+            for key, value in state.Stats().items():
+                stats[key] = stats.get(key, 0) + value
+        
+        self.ReleaseLock()
+        
+        return stats
+    
+    ## @name Bulk Transfers
+    #
+    #  Blobs too big to send as one message, like maps and replays, are sent with these.  See
+    #  bulk.py for the events emitted while they're sent and received.
+    #@{
+    
+    ## Starts sending a blob to a connection.  Give it either data or a filename.
+    #
+    #  @param connection the Connection object to send the blob to.
+    #  @param data a bytes-like object to send.
+    #  @param filename the name of a file to send.  It's memory-mapped and read as it's sent.
+    #  @param name a name for the blob, handed to the other side.  Defaults to the filename.
+    #  @returns the ID of the transfer.
+    def SendBlob(self, connection, data=None, filename=None, name=None):
+        self.AcquireLock()
+        transfer = self.__bulk.Send(connection, data, filename, name)
+        self.ReleaseLock()
+        
+        return transfer
+    
+    ## Stops sending a blob.
+    def CancelBlob(self, transfer):
+        self.AcquireLock()
+        self.__bulk.Cancel(transfer)
+        self.ReleaseLock()
+    
+    ## Sets the bandwidth cap, in bytes per second, shared by all bulk transfers.
+    def SetBulkBandwidth(self, bandwidth):
+        self.__bulk.SetBandwidth(bandwidth)
+    
+    #@}
+    
     ## Call this to register your one and only event callback
     def RegisterEventCallback(self, cb):
         self.__event_callback = cb
@@ -468,6 +675,9 @@ class ProtocolBase(object):
         if self.__transport is not None:
             self.__setupCallbacks()
             
+            # The transport knows whether there's a second thread to guard against.
+            self.__lock = self.__transport.NewLock()
+            
             # TODO: whatever else needs to be done
         else:
             raise exceptions.dngExceptionNotImplemented('Cannot bind protocol to transport: there is no transport.')
@@ -493,6 +703,61 @@ class ProtocolBase(object):
     def _stop(self):
         self.__transport._stopI()
         self.Stop()
+        
+        if self.__tasks is not None:
+            for task in self.__tasks:
+                task.cancel()
+            self.__tasks = None
+            self.__flush_event = None
+
+    ## The asyncio counterpart of _start, used internally.  The transport is started on the
+    #  running event loop, then maintenance and the send flush are started as tasks.
+    async def _start_async(self):
+        await self.__transport._start_async()
+        self.Start()
+        self.StartTasks()
+
+    ## @name asyncio Support
+    #
+    #  When the transport is driven by asyncio (see transport.base.M_ASYNC), there's no thread
+    #  looping over the transport.  Instead, connection maintenance and the send flush run as
+    #  tasks on the event loop.
+    #@{
+    
+    ## Starts the maintenance and send flush tasks on the running event loop.
+    #
+    #  @param interval how often, in seconds, connections are maintained.
+    def StartTasks(self, interval=0.01):
+        self.__flush_event = asyncio.Event()
+        
+        # Anything queued before the tasks existed, like a login, goes out right away.
+        self.__flush_event.set()
+        
+        self.__tasks = [ asyncio.ensure_future(self.MaintainTask(interval) ),
+                         asyncio.ensure_future(self.FlushTask() ) ]
+        
+    ## Maintains connections every interval seconds until the transport stops.
+    #
+    #  @param interval how often, in seconds, connections are maintained.
+    async def MaintainTask(self, interval):
+        while self.__transport.Continue():
+            self.MaintainConnections()
+            
+            await asyncio.sleep(interval)
+    
+    ## Sends outgoing messages as soon as they are queued.  Before sending, it waits for the
+    #  transport to be able to take more data, so a slow socket holds messages back here
+    #  rather than piling them up in the socket buffer.
+    async def FlushTask(self):
+        while self.__transport.Continue():
+            await self.__flush_event.wait()
+            self.__flush_event.clear()
+            
+            await self.__transport.Drain()
+            
+            self.__transport.Flush()
+    
+    #@}
 
     ## Register a message callback.  Games *can* use this, but the mechanism isn't terribly useful.  
     #  For the most part,
@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file bulk
+#
+#  This file contains bulk transfers, used to send maps, replays and other blobs too big to send
+#  as a single message.  Every core protocol has one BulkTransfers object; use
+#  ProtocolBase.SendBlob to send a blob, and register for these dispatcher events to hear about
+#  them:
+#
+#      blob_progress : a transfer made progress.  The event has 'direction' ('send' or
+#                      'receive'), 'transfer', 'connection', 'name', 'done' and 'total'.
+#      blob_complete : a blob was received.  The event has 'transfer', 'connection', 'name' and
+#                      'data', which is a bytes object.
+#      blob_sent : every chunk of a blob was acked by the other side.
+#      blob_failed : a transfer was given up on.  The event has 'reason'.
+#
+#  A blob is cut into chunks, each sent as a blob message and acked by a bloback message that
+#  says which chunks have arrived.  Only so many chunks may be waiting for an ack at once.  That
+#  window is sized from the measured round trip time, so that about twice the bandwidth cap's
+#  worth of data is in flight, and it shrinks when the round trip time grows, a sign that queues
+#  are filling up, or when many chunks are lost at once.  A chunk is sent again if it isn't
+#  acked within a timeout worked out from the round trip time, or once later chunks have
+#  overtaken it.  All transfers together are held to the bandwidth cap, so they don't starve the
+#  real-time traffic sharing the connection.  Occasional losses don't shrink the window, since
+#  game networks lose packets for many reasons other than congestion.
+#
+#  A receiving blob is buffered whole, so only so many may come in from each connection at
+#  once, and only so many bytes from all of them together.  A transfer over either limit is
+#  refused with a bloback that says so, and the sender gives up on it with a blob_failed event.
+
+import collections, mmap, time
+
+## The default size of each chunk, small enough that a chunk and its headers fit in one datagram
+#  of the default Buffersize().
+DEFAULT_CHUNK = 896
+
+## The default bandwidth cap for all bulk transfers together, in bytes per second.
+DEFAULT_BANDWIDTH = 512 * 1024
+
+## The biggest blob that will be accepted from the other side.
+MAX_BLOB = 256 * 1024 * 1024
+
+## The most blobs that may be received from one connection at once.
+MAX_INCOMING = 4
+
+## The most bytes that may be buffered for all the blobs being received together.
+MAX_BUFFERED = 256 * 1024 * 1024
+
+## The window, in chunks, a transfer starts with.
+INITIAL_WINDOW = 4
+
+## The biggest the window can grow, in chunks.
+MAX_WINDOW = 512
+
+## A transfer that makes no progress for this many seconds is given up on.
+TRANSFER_TIMEOUT = 30.0
+
+## How often, in seconds, progress events are emitted for each transfer.
+PROGRESS_INTERVAL = 0.25
+
+## The most chunks above the contiguous ones a bloback lists.
+MAX_SACK = 64
+
+## One blob being sent.  Used internally.
+class _Outgoing(object):
+    def __init__(self, transfer, connection, data, name, chunksize, source=None):
+        self.transfer = transfer
+        self.connection = connection
+        self.data = data
+        self.name = name
+        self.chunksize = chunksize
+        self.source = source
+        
+        self.total = len(data)
+        self.count = max(1, (self.total + chunksize - 1) // chunksize)
+        
+        # Every chunk below acked has been acked.  sacked holds those above it.
+        self.acked = 0
+        self.sacked = set()
+        
+        # The next chunk that has never been sent.
+        self.next = 0
+        
+        # Chunks waiting for an ack, and when they were last sent.
+        self.inflight = {}
+        
+        self.window = float(INITIAL_WINDOW)
+        
+        # The most the window may grow to, worked out from the round trip time.
+        self.limit = float(MAX_WINDOW)
+        
+        self.srtt = None
+        self.rttvar = None
+        self.minrtt = None
+        self.rto = 1.0
+        
+        # When the window was last cut, so it's only cut once per round trip.
+        self.lastcut = 0.0
+        
+        # The highest chunk the other side says it has.  Chunks below it still waiting for an
+        # ack after a round trip were most likely lost.
+        self.highest = -1
+        
+        self.progress = time.time()
+        self.lastreport = 0.0
+    
+    ## The number of bytes acked so far.
+    def Done(self):
+        done = (self.acked + len(self.sacked) ) * self.chunksize
+        
+        return min(done, self.total)
+    
+    ## Frees the blob's memory and closes its file, if any.
+    def Close(self):
+        if self.source is not None:
+            self.data.close()
+            self.source.close()
+            self.source = None
+        
+        self.data = None
+
+## One blob being received.  Used internally.
+class _Incoming(object):
+    def __init__(self, transfer, connection, total, chunksize):
+        self.transfer = transfer
+        self.connection = connection
+        self.total = total
+        self.chunksize = chunksize
+        self.count = max(1, (total + chunksize - 1) // chunksize)
+        self.name = None
+        
+        self.data = bytearray(total)
+        self.have = bytearray(self.count)
+        
+        # Every chunk below received has arrived.
+        self.received = 0
+        self.chunks = 0
+        
+        # Whether the other side is owed an ack, and the timestamp to echo in it.
+        self.ackdue = False
+        self.echo = None
+        
+        self.lastreport = 0.0
+        
+        # When the last chunk arrived.
+        self.lastrecv = time.time()
+
+## This class runs every bulk transfer of a protocol.
+class BulkTransfers(object):
+    ## The protocol this object sends and receives through
+    __protocol = None
+    
+    ## Outgoing transfers, keyed by transfer ID
+    __outgoing = None
+    
+    ## Incoming transfers, keyed by ((host, port), transfer ID)
+    __incoming = None
+    
+    ## Incoming transfers recently finished, and when, so their acks can be sent again if the
+    #  last one was lost.
+    __finished = None
+    
+    ## Incoming transfers recently refused, and when, so chunks still on the way are refused too.
+    __refused = None
+    
+    ## The number of bytes buffered for every incoming transfer together.
+    __buffered = None
+    
+    ## The last transfer ID handed out
+    __lastTransfer = None
+    
+    ## The bandwidth cap, in bytes per second
+    __bandwidth = None
+    
+    ## How many bytes may be sent right now, refilled at the bandwidth cap
+    __tokens = None
+    
+    ## When the tokens were last refilled
+    __lastfill = None
+    
+    ## The chunk size for new transfers
+    __chunksize = None
+    
+    ## Which of the outgoing transfers sends first on the next Update
+    __turn = None
+    
+    ## Counters for the stats
+    __counters = None
+    
+    ## @param protocol the protocol to send and receive through.
+    #  @param bandwidth the bandwidth cap, in bytes per second.
+    #  @param chunksize the size of each chunk of new transfers.
+    def __init__(self, protocol, bandwidth=DEFAULT_BANDWIDTH, chunksize=DEFAULT_CHUNK):
+        self.__protocol = protocol
+        self.__bandwidth = bandwidth
+        self.__chunksize = chunksize
+        
+        self.__outgoing = {}
+        self.__incoming = {}
+        self.__finished = {}
+        self.__refused = {}
+        self.__buffered = 0
+        
+        self.__lastTransfer = 0
+        self.__turn = 0
+        self.__tokens = 0.0
+        self.__lastfill = time.time()
+        
+        self.__counters = { 'bulk_bytes_sent' : 0,
+                            'bulk_bytes_received' : 0,
+                            'bulk_retransmits' : 0,
+                            'bulk_refused' : 0 }
+    
+    ## Changes the bandwidth cap.
+    #
+    #  @param bandwidth the cap, in bytes per second, for all transfers together.
+    def SetBandwidth(self, bandwidth):
+        self.__bandwidth = bandwidth
+    
+    def Bandwidth(self):
+        return self.__bandwidth
+    
+    ## Starts sending a blob.  Give it either data or a filename.  A file is memory-mapped and
+    #  read a chunk at a time as it's sent, so it's never copied into memory whole.
+    #
+    #  @param connection the Connection object to send the blob to.
+    #  @param data a bytes-like object to send.
+    #  @param filename the name of a file to send.
+    #  @param name a name for the blob, handed to the other side.  Defaults to the filename.
+    #  @returns the ID of the transfer.
+    def Send(self, connection, data=None, filename=None, name=None):
+        source = None
+        
+        if filename is not None:
+            source = open(filename, 'rb')
+            
+            try:
+                data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                source.close()
+                source = None
+                data = b''
+            
+            if name is None:
+                name = filename
+        
+        if data is None:
+            raise ValueError("SendBlob needs either data or a filename")
+        
+        self.__lastTransfer = (self.__lastTransfer + 1) & 0xFFFFFFFF
+        
+        self.__outgoing[self.__lastTransfer] = _Outgoing(self.__lastTransfer,
+                                                         connection,
+                                                         data,
+                                                         name,
+                                                         self.__chunksize,
+                                                         source)
+        
+        return self.__lastTransfer
+    
+    ## Stops sending a blob.  The other side isn't told; its half of the transfer times out.
+    def Cancel(self, transfer):
+        if transfer in self.__outgoing:
+            self.__outgoing.pop(transfer).Close()
+    
+    ## Returns (bytes acked, total bytes) for an outgoing transfer, or None if it's not running.
+    def Progress(self, transfer):
+        if transfer in self.__outgoing:
+            out = self.__outgoing[transfer]
+            
+            return (out.Done(), out.total)
+        
+        return None
+    
+    def Stats(self):
+        stats = dict(self.__counters)
+        
+        stats['bulk_sending'] = len(self.__outgoing)
+        stats['bulk_receiving'] = len(self.__incoming)
+        stats['bulk_buffered'] = self.__buffered
+        
+        return stats
+    
+    ## Sends whatever acks, retransmissions and new chunks are due, and emits progress events.
+    #  Called by the protocol each time connections are maintained.
+    def Update(self, timestep):
+        self.__refill(timestep)
+        
+        self.__sendAcks(timestep)
+        
+        if len(self.__outgoing) > 0:
+            self.__sendChunks(timestep)
+        
+        for key in [k for k, t in self.__finished.items() if timestep - t > TRANSFER_TIMEOUT]:
+            del self.__finished[key]
+        
+        for key in [k for k, t in self.__refused.items() if timestep - t > TRANSFER_TIMEOUT]:
+            del self.__refused[key]
+        
+        for key in [k for k, i in self.__incoming.items() if timestep - i.lastrecv > TRANSFER_TIMEOUT]:
+            self.__dropIncoming(key)
+    
+    ## @name Callback Methods
+    #
+    #  These are registered by the protocol for the blob and bloback messages.
+    #@{
+    
+    ## A chunk arrived.  Called from the transport's thread, so it takes the protocol's lock like
+    #  the methods that start and stop transfers do.
+    def BlobMessage(self, **args):
+        self.__protocol.AcquireLock()
+        self.__receiveChunk(args)
+        self.__protocol.ReleaseLock()
+    
+    ## An ack arrived for chunks we sent.  Takes the protocol's lock like BlobMessage.
+    def BlobAckMessage(self, **args):
+        self.__protocol.AcquireLock()
+        self.__receiveAck(args)
+        self.__protocol.ReleaseLock()
+    
+    #@}
+    
+    ## Stores a chunk that arrived, starting the incoming transfer if it's the first.
+    def __receiveChunk(self, args):
+        msg = args['message']
+        connectInfo = args['connection']
+        
+        con = self.__protocol.Connection(connectInfo)
+        
+        if con is None:
+            return
+        
+        key = (connectInfo, msg.transfer)
+        
+        if key in self.__finished:
+            # The sender missed our last ack.
+            self.__sendAck(con, msg.transfer, 0, [], msg.timestamp, True)
+            return
+        
+        if key in self.__refused:
+            self.__sendRefusal(con, msg.transfer)
+            return
+        
+        if key not in self.__incoming:
+            if msg.chunksize == 0:
+                return
+            
+            if not self.__accept(connectInfo, msg.total):
+                self.__refused[key] = args['timestamp']
+                self.__counters['bulk_refused'] += 1
+                self.__sendRefusal(con, msg.transfer)
+                return
+            
+            self.__incoming[key] = _Incoming(msg.transfer, con, msg.total, msg.chunksize)
+            self.__buffered += msg.total
+        
+        incoming = self.__incoming[key]
+        
+        incoming.lastrecv = args['timestamp']
+        
+        incoming.ackdue = True
+        incoming.echo = msg.timestamp
+        
+        index = msg.index
+        
+        if index >= incoming.count or incoming.have[index]:
+            return
+        
+        start = index * incoming.chunksize
+        end = min(start + incoming.chunksize, incoming.total)
+        
+        if len(msg.data) != end - start:
+            return
+        
+        incoming.data[start:end] = msg.data
+        incoming.have[index] = 1
+        incoming.chunks += 1
+        
+        self.__counters['bulk_bytes_received'] += len(msg.data)
+        
+        if msg.HasField('name'):
+            incoming.name = msg.name
+        
+        while incoming.received < incoming.count and incoming.have[incoming.received]:
+            incoming.received += 1
+    
+    ## Records the chunks an ack covers, and grows the transfer's window.
+    def __receiveAck(self, args):
+        msg = args['message']
+        
+        if msg.transfer not in self.__outgoing:
+            return
+        
+        out = self.__outgoing[msg.transfer]
+        
+        if out.connection.info() != args['connection']:
+            return
+        
+        now = args['timestamp']
+        
+        if msg.refused:
+            self.__finish(out, 'blob_failed', now, 'refused')
+            return
+        
+        if msg.HasField('echo'):
+            self.__sampleRtt(out, now - msg.echo)
+        
+        newly = 0
+        
+        received = min(msg.received, out.count)
+        
+        while out.acked < received:
+            if out.acked in out.sacked:
+                out.sacked.discard(out.acked)
+            else:
+                newly += 1
+            
+            out.inflight.pop(out.acked, None)
+            out.acked += 1
+        
+        for index in msg.chunks:
+            if index >= out.acked and index < out.count and index not in out.sacked:
+                out.sacked.add(index)
+                out.highest = max(out.highest, index)
+                out.inflight.pop(index, None)
+                newly += 1
+        
+        if newly > 0:
+            out.progress = now
+            
+            out.window = min(out.window + newly, out.limit)
+            
+    ## Returns True if a new blob of total bytes from a connection fits in the limits.
+    def __accept(self, connectInfo, total):
+        if total > MAX_BLOB or self.__buffered + total > MAX_BUFFERED:
+            return False
+        
+        count = 0
+        
+        for otherInfo, transfer in self.__incoming:
+            if otherInfo == connectInfo:
+                count += 1
+        
+        return count < MAX_INCOMING
+    
+    ## Forgets an incoming transfer and frees its buffer.
+    def __dropIncoming(self, key):
+        self.__buffered -= self.__incoming.pop(key).total
+    
+    ## Adds tokens for the time that has passed, up to a tenth of a second's worth.
+    def __refill(self, timestep):
+        elapsed = max(timestep - self.__lastfill, 0.0)
+        self.__lastfill = timestep
+        
+        burst = max(self.__bandwidth * 0.1, self.__chunksize * 2)
+        
+        self.__tokens = min(self.__tokens + elapsed * self.__bandwidth, burst)
+    
+    ## Updates the round trip time estimate and the retransmission timeout, the same way TCP
+    #  does.
+    def __sampleRtt(self, out, sample):
+        if sample < 0:
+            return
+        
+        if out.srtt is None:
+            out.srtt = sample
+            out.rttvar = sample / 2
+        else:
+            out.rttvar = 0.75 * out.rttvar + 0.25 * abs(out.srtt - sample)
+            out.srtt = 0.875 * out.srtt + 0.125 * sample
+        
+        out.rto = min(max(out.srtt + 4 * out.rttvar, 0.05), 5.0)
+        
+        if out.minrtt is None or sample < out.minrtt:
+            out.minrtt = sample
+    
+    ## Sends acks for every incoming transfer that received chunks since the last update, and
+    #  finishes the ones that are complete.
+    def __sendAcks(self, timestep):
+        for key in list(self.__incoming):
+            incoming = self.__incoming[key]
+            
+            if not incoming.ackdue:
+                continue
+            
+            incoming.ackdue = False
+            
+            complete = incoming.received == incoming.count
+            
+            sacked = []
+            if not complete:
+                for index in range(incoming.received + 1, incoming.count):
+                    if incoming.have[index]:
+                        sacked.append(index)
+                        
+                        if len(sacked) == MAX_SACK:
+                            break
+            
+            self.__sendAck(incoming.connection, incoming.transfer, incoming.received, sacked, incoming.echo)
+            
+            done = min(incoming.chunks * incoming.chunksize, incoming.total)
+            
+            if complete or timestep - incoming.lastreport >= PROGRESS_INTERVAL:
+                incoming.lastreport = timestep
+                
+                self.__protocol.EmitEvent( { 'type' : 'blob_progress',
+                                             'direction' : 'receive',
+                                             'transfer' : incoming.transfer,
+                                             'connection' : incoming.connection,
+                                             'name' : incoming.name,
+                                             'done' : done,
+                                             'total' : incoming.total } )
+            
+            if complete:
+                self.__dropIncoming(key)
+                self.__finished[key] = timestep
+                
+                self.__protocol.EmitEvent( { 'type' : 'blob_complete',
+                                             'transfer' : incoming.transfer,
+                                             'connection' : incoming.connection,
+                                             'name' : incoming.name,
+                                             'data' : bytes(incoming.data) } )
+    
+    ## Sends one bloback.  A finished transfer is acked whole.
+    def __sendAck(self, connection, transfer, received, sacked, echo, finished=False):
+        theMsg = self.__protocol.Pedia().GetMessageObject('bloback')
+        theMsg.transfer = transfer
+        theMsg.received = received
+        theMsg.chunks.extend(sacked)
+        
+        if finished:
+            theMsg.received = 0xFFFFFFFF
+        
+        if echo is not None:
+            theMsg.echo = echo
+        
+        self.__protocol.AddOutgoingMessage(theMsg, connection)
+    
+    ## Tells the sender of a transfer it was refused.
+    def __sendRefusal(self, connection, transfer):
+        theMsg = self.__protocol.Pedia().GetMessageObject('bloback')
+        theMsg.transfer = transfer
+        theMsg.received = 0
+        theMsg.refused = True
+        
+        self.__protocol.AddOutgoingMessage(theMsg, connection)
+    
+    ## Sends retransmissions and new chunks for every outgoing transfer while the windows and
+    #  the bandwidth cap allow.  Transfers take turns a chunk at a time, and a different one
+    #  goes first each time, so when the cap runs out it isn't always the same ones that wait.
+    def __sendChunks(self, timestep):
+        connections = self.__protocol.ConnectionList()
+        
+        # Each transfer gets an equal part of the bandwidth cap.
+        share = self.__bandwidth / len(self.__outgoing)
+        
+        # Each transfer still running, with the chunks it has to send again.
+        ready = []
+        
+        for transfer in list(self.__outgoing):
+            out = self.__outgoing[transfer]
+            
+            if out.acked >= out.count:
+                self.__finish(out, 'blob_sent', timestep)
+                continue
+            
+            if out.connection not in connections:
+                self.__finish(out, 'blob_failed', timestep, 'connection closed')
+                continue
+            
+            if timestep - out.progress > TRANSFER_TIMEOUT:
+                self.__finish(out, 'blob_failed', timestep, 'timed out')
+                continue
+            
+            # Chunks that weren't acked in time, or that later chunks overtook a round trip ago,
+            # are sent again.
+            overtaken = out.rto
+            if out.srtt is not None:
+                overtaken = out.srtt * 1.25
+            
+            lost = [index for index, sent in out.inflight.items()
+                    if timestep - sent > out.rto or (index < out.highest and timestep - sent > overtaken)]
+            
+            if out.srtt is not None:
+                self.__adjustWindow(out, len(lost), share, timestep)
+            
+            ready.append( (out, collections.deque(sorted(lost) ) ) )
+            
+            if timestep - out.lastreport >= PROGRESS_INTERVAL:
+                out.lastreport = timestep
+                
+                self.__protocol.EmitEvent( { 'type' : 'blob_progress',
+                                             'direction' : 'send',
+                                             'transfer' : out.transfer,
+                                             'connection' : out.connection,
+                                             'name' : out.name,
+                                             'done' : out.Done(),
+                                             'total' : out.total } )
+        
+        if len(ready) == 0:
+            return
+        
+        self.__turn = (self.__turn + 1) % len(ready)
+        ready = ready[self.__turn:] + ready[:self.__turn]
+        
+        while len(ready) > 0:
+            waiting = []
+            
+            for out, lost in ready:
+                if len(lost) > 0:
+                    if not self.__sendChunk(out, lost[0], timestep):
+                        return
+                    
+                    lost.popleft()
+                    self.__counters['bulk_retransmits'] += 1
+                elif len(out.inflight) < int(out.window) and out.next < out.count:
+                    if not self.__sendChunk(out, out.next, timestep):
+                        return
+                    
+                    out.next += 1
+                else:
+                    continue
+                
+                waiting.append( (out, lost) )
+            
+            ready = waiting
+    
+    ## Sizes a transfer's window to its share of the bandwidth cap and its round trip time, and
+    #  cuts it, at most once per round trip, when queues are filling or many chunks were lost.
+    def __adjustWindow(self, out, lost, share, timestep):
+        limit = share * out.srtt * 2 / out.chunksize
+        out.limit = min(max(limit, INITIAL_WINDOW), MAX_WINDOW)
+        
+        if timestep - out.lastcut > out.srtt:
+            if out.srtt > out.minrtt * 2 + 0.01 or lost > out.window / 4:
+                out.window = out.window * 0.75
+                out.lastcut = timestep
+        
+        out.window = min(max(out.window, 2.0), out.limit)
+    
+    ## Sends one chunk, if the bandwidth cap allows it.
+    #
+    #  @returns False if the bandwidth cap has been reached for now.
+    def __sendChunk(self, out, index, timestep):
+        start = index * out.chunksize
+        end = min(start + out.chunksize, out.total)
+        
+        if self.__tokens < end - start:
+            return False
+        
+        self.__tokens -= end - start
+        
+        theMsg = self.__protocol.Pedia().GetMessageObject('blob')
+        theMsg.transfer = out.transfer
+        theMsg.index = index
+        theMsg.total = out.total
+        theMsg.chunksize = out.chunksize
+        theMsg.data = bytes(out.data[start:end])
+        
+        if index == 0 and out.name is not None:
+            theMsg.name = out.name
+        
+        self.__protocol.AddOutgoingMessage(theMsg, out.connection)
+        
+        out.inflight[index] = timestep
+        
+        self.__counters['bulk_bytes_sent'] += end - start
+        
+        return True
+    
+    ## Ends an outgoing transfer and emits an event saying how it ended.
+    def __finish(self, out, eventType, timestep, reason=None):
+        del self.__outgoing[out.transfer]
+        out.Close()
+        
+        event = { 'type' : eventType,
+                  'transfer' : out.transfer,
+                  'connection' : out.connection,
+                  'name' : out.name,
+                  'total' : out.total }
+        
+        if reason is not None:
+            event['reason'] = reason
+        
+        self.__protocol.EmitEvent(event)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file channels
+#
+#  This file contains delivery channels.  Every message type is sent on one of four channels,
+#  chosen with the 'channel' option when the type is added to the pedia:
+#
+#      theMessages.AddMessageType("mygame.messages", "position", "Position",
+#                                 {'channel' : channels.SEQUENCED} )
+#
+#  Messages on every channel but UNRELIABLE carry a sequence number ahead of the serialized
+#  message.  Each channel of each connection has its own sequence numbers and its own reorder
+#  buffer, so a chat message waiting to be resent never holds up position updates, which are
+#  on a different channel.  On the SEQUENCED channel, each message type has its own sequence
+#  numbers too, so a newer message of one type never makes an older one of another type stale.
+#
+#  Reliable messages are acked with the ordinary ack message, using their message ID, and are
+#  sent again until they are, up to MAX_RESENDS times.
+
+import struct
+
+## Messages are sent once, and delivered in whatever order they arrive.  This is the default,
+#  and such messages carry no sequence number.
+UNRELIABLE = 0
+## Messages are sent once, and any message older than the newest one delivered so far is
+#  dropped.  Use it for state that is sent over and over, like positions.
+SEQUENCED = 1
+## Messages are resent until acked, and delivered once each, in whatever order they arrive.
+RELIABLE_UNORDERED = 2
+## Messages are resent until acked, and delivered once each, in the order they were sent.
+RELIABLE_ORDERED = 3
+
+## The sequence number ahead of every message not on the UNRELIABLE channel.
+_SEQUENCE = struct.Struct("!H")
+
+## The size of the sequence number.
+HEADER_SIZE = _SEQUENCE.size
+
+## The most messages a RELIABLE_ORDERED channel holds while waiting for a missing one.  Messages
+#  further ahead than this are dropped, and arrive again when they're resent.
+MAX_BUFFERED = 1024
+
+## The shortest time, in seconds, before a reliable message is resent.
+MIN_RESEND = 0.1
+
+## The longest time, in seconds, before a reliable message is resent.
+MAX_RESEND = 1.0
+
+## The most times a reliable message is resent before it's given up on.
+MAX_RESENDS = 30
+
+## The protobuf key of the id field, which is field 1 of every message and a fixed32.
+_ID_KEY = 0x0d
+
+_ID = struct.Struct("<I")
+
+## Returns True if a is a newer 16-bit sequence number than b, allowing for wrap-around.
+def Newer(a, b):
+    return a != b and ( (a - b) & 0xFFFF) < 0x8000
+
+## Returns True if messages on this channel are resent until acked.
+def IsReliable(channel):
+    return channel >= RELIABLE_UNORDERED
+
+## Returns the channel given by a message type's pedia options.
+def GetChannel(options):
+    return options.get('channel', UNRELIABLE)
+
+## Reads the message ID out of a serialized message without parsing it.  Every message starts
+#  with its id field, so this is only a couple of byte comparisons.
+#
+#  @param payload the serialized message.
+#  @param offset where the message starts in payload.
+#  @returns the message ID, or None if payload doesn't start with one.
+def PeekMessageId(payload, offset=0):
+    if len(payload) >= offset + 5 and payload[offset] == _ID_KEY:
+        return _ID.unpack_from(payload, offset + 1)[0]
+    
+    return None
+
+## Returns how long to wait before resending a reliable message, given a connection's ping.
+def ResendTimeout(ping):
+    return min(max(ping * 2, MIN_RESEND), MAX_RESEND)
+
+## Remembers which of the most recent sequence numbers have been seen, as a bitmap that slides
+#  along with the newest one.  Checking and marking a number is a couple of shifts.  Sequence
+#  numbers are 16 bits by default, and wrap around.
+class SequenceWindow(object):
+    ## The newest sequence number seen, or None before the first one.
+    __latest = None
+    
+    ## Bit n is set if sequence number latest - n has been seen.
+    __bits = None
+    
+    ## How many sequence numbers, counting back from the newest, are remembered.
+    __size = None
+    
+    ## A mask of size bits.
+    __mask = None
+    
+    ## A mask of as many bits as there are in a sequence number.
+    __modulo = None
+    
+    ## Whether a number too old to be remembered is let through.
+    __acceptold = None
+    
+    ## @param size how many sequence numbers, counting back from the newest, are remembered.
+    #  @param bits how many bits there are in a sequence number.
+    #  @param acceptold if True, a number more than size older than the newest can't be told
+    #                   from a new one, so it's let through and the window is left as it is.
+    #                   If False, such numbers count as seen.
+    def __init__(self, size=1024, bits=16, acceptold=False):
+        self.__size = size
+        self.__mask = (1 << size) - 1
+        self.__modulo = (1 << bits) - 1
+        self.__acceptold = acceptold
+        self.__bits = 0
+    
+    ## Marks a sequence number as seen.
+    #
+    #  @returns True if it hadn't been seen before.
+    def Check(self, seq):
+        if self.__latest is None:
+            self.__latest = seq
+            self.__bits = 1
+            return True
+        
+        shift = (seq - self.__latest) & self.__modulo
+        
+        if shift != 0 and shift <= (self.__modulo >> 1):
+            if shift >= self.__size:
+                self.__bits = 1
+            else:
+                self.__bits = ( (self.__bits << shift) | 1) & self.__mask
+            
+            self.__latest = seq
+            return True
+        
+        offset = (self.__latest - seq) & self.__modulo
+        
+        if offset >= self.__size:
+            return self.__acceptold
+        
+        bit = 1 << offset
+        
+        if self.__bits & bit:
+            return False
+        
+        self.__bits |= bit
+        return True
+
+## The channel state of one connection: the sequence numbers sent and received on each channel,
+#  the reorder buffer, and the reliable messages waiting to be acked.
+class ChannelState(object):
+    ## The next sequence number to send, for each channel.
+    __nextSeq = None
+    
+    ## The next sequence number to send on the SEQUENCED channel, keyed by message type ID.
+    __sequencedNext = None
+    
+    ## The newest sequence number delivered on the SEQUENCED channel, keyed by message type ID.
+    __sequenced = None
+    
+    ## The sequence numbers received on the RELIABLE_UNORDERED channel.
+    __unordered = None
+    
+    ## The next sequence number to deliver on the RELIABLE_ORDERED channel.
+    __expected = None
+    
+    ## Messages received on the RELIABLE_ORDERED channel ahead of the next one to deliver, keyed
+    #  by sequence number.
+    __ordered = None
+    
+    ## Reliable messages waiting to be acked, keyed by message ID.  Each is a list of
+    #  [typeId, the message as sent, when it was last sent, the number of times it was resent].
+    __unacked = None
+    
+    ## Counters, see Stats.
+    __counters = None
+    
+    def __init__(self):
+        self.__nextSeq = [0, 0, 0, 0]
+        self.__sequencedNext = {}
+        self.__sequenced = {}
+        self.__unordered = SequenceWindow()
+        self.__expected = 0
+        self.__ordered = {}
+        self.__unacked = {}
+        
+        self.__counters = { 'channel_resent' : 0,
+                            'channel_abandoned' : 0,
+                            'channel_duplicates' : 0,
+                            'channel_stale' : 0 }
+    
+    ## Puts the sequence number in front of a message about to be sent, and keeps reliable
+    #  messages to be resent.
+    #
+    #  @param channel the message type's channel.  Not UNRELIABLE.
+    #  @param typeId the message type ID.
+    #  @param msgId the message ID.
+    #  @param payload the serialized message.
+    #  @param timestamp the time it's being sent.
+    #  @returns the message as it should be sent.
+    def Send(self, channel, typeId, msgId, payload, timestamp):
+        if channel == SEQUENCED:
+            seq = self.__sequencedNext.get(typeId, 0)
+            self.__sequencedNext[typeId] = (seq + 1) & 0xFFFF
+        else:
+            seq = self.__nextSeq[channel]
+            self.__nextSeq[channel] = (seq + 1) & 0xFFFF
+        
+        data = _SEQUENCE.pack(seq) + payload
+        
+        if IsReliable(channel):
+            self.__unacked[msgId] = [typeId, data, timestamp, 0]
+        
+        return data
+    
+    ## Forgets a reliable message once it's been acked.
+    def Acked(self, msgId):
+        self.__unacked.pop(msgId, None)
+    
+    ## Returns the reliable messages that have waited longer than timeout for an ack, as a list
+    #  of (typeId, message) tuples ready to send again.  Messages already resent MAX_RESENDS
+    #  times are given up on instead.
+    def Resends(self, timestamp, timeout):
+        resends = []
+        abandoned = []
+        
+        for msgId, entry in self.__unacked.items():
+            if timestamp - entry[2] > timeout:
+                if entry[3] >= MAX_RESENDS:
+                    abandoned.append(msgId)
+                    continue
+                
+                entry[2] = timestamp
+                entry[3] += 1
+                resends.append( (entry[0], entry[1]) )
+        
+        for msgId in abandoned:
+            del self.__unacked[msgId]
+        
+        self.__counters['channel_resent'] += len(resends)
+        self.__counters['channel_abandoned'] += len(abandoned)
+        
+        return resends
+    
+    ## Works out which messages can be delivered now that one has arrived.
+    #
+    #  @param channel the message type's channel.  Not UNRELIABLE.
+    #  @param typeId the message type ID.
+    #  @param data the message as received, sequence number and all.
+    #  @returns a list of (typeId, serialized message) tuples to deliver, in order.  It's empty
+    #           if the message was a duplicate or stale, or if it's waiting on an earlier one.
+    def Receive(self, channel, typeId, data):
+        if len(data) < HEADER_SIZE:
+            return []
+        
+        seq, = _SEQUENCE.unpack_from(data)
+        payload = data[HEADER_SIZE:]
+        
+        if channel == SEQUENCED:
+            latest = self.__sequenced.get(typeId)
+            
+            if latest is not None and not Newer(seq, latest):
+                self.__counters['channel_stale'] += 1
+                return []
+            
+            self.__sequenced[typeId] = seq
+            return [ (typeId, payload) ]
+        
+        if channel == RELIABLE_UNORDERED:
+            if not self.__unordered.Check(seq):
+                self.__counters['channel_duplicates'] += 1
+                return []
+            
+            return [ (typeId, payload) ]
+        
+        # RELIABLE_ORDERED
+        if seq != self.__expected:
+            if not Newer(seq, self.__expected) or seq in self.__ordered:
+                self.__counters['channel_duplicates'] += 1
+            elif ( (seq - self.__expected) & 0xFFFF) < MAX_BUFFERED:
+                self.__ordered[seq] = (typeId, payload)
+            
+            return []
+        
+        deliver = [ (typeId, payload) ]
+        self.__expected = (self.__expected + 1) & 0xFFFF
+        
+        while self.__expected in self.__ordered:
+            deliver.append(self.__ordered.pop(self.__expected) )
+            self.__expected = (self.__expected + 1) & 0xFFFF
+        
+        return deliver
+    
+    ## Returns a dictionary of counters for this connection.
+    def Stats(self):
+        stats = dict(self.__counters)
+        
+        stats['channel_unacked'] = len(self.__unacked)
+        stats['channel_buffered'] = len(self.__ordered)
+        
+        return stats
@@ -18,17 +18,27 @@
 
 '''
 
-import socket
+import socket, time
 
 from davenetgame.protocol.base import ProtocolBase
+from davenetgame.protocol import channels
 from davenetgame.protocol import connection
 
 from davenetgame import paths
+from davenetgame.gameobjects import interest
+from davenetgame.gameobjects import replication
+from davenetgame.gameobjects import sync
+
+## The number of ticks per second a RealtimeServer sends game object changes at, by default.
+DEFAULT_TICKRATE = 30
 
 class RealtimeClient(ProtocolBase):
     ## The connection to the server.
     __connection = None
     
+    ## The tick of the newest objectupdate applied.  Older ones that arrive late are ignored.
+    __lasttick = 0
+    
     def __init__(self, **args):
         super().__init__(**args)
         
@@ -39,7 +49,9 @@ class RealtimeClient(ProtocolBase):
             
         self.RegisterMessageCallback('login', self.LoginMessage)
         self.RegisterMessageCallback('logout', self.LogoutMessage)
-
+        self.RegisterMessageCallback('objectcreate', self.ObjectCreateMessage)
+        self.RegisterMessageCallback('objectupdate', self.ObjectUpdateMessage)
+    
     ## @name Callback Methods
     #
     #  These are the callback methods for particular messages.
@@ -51,12 +63,68 @@ class RealtimeClient(ProtocolBase):
         self.Connection().SetId(args['message'].con_id)
         self.Connection().set_lastrecv(args['timestamp'] )
         
+        # A new session starts its ticks over.
+        self.__lasttick = 0
+        
         #TODO: emit an event indicating that the login is complete
         print('The server has logged you in.')
 
     def LogoutMessage(self, typeId, msg, connection):
         pass
     
+    ## The server has created a game object.  A replica of it is added to the sync list.
+    def ObjectCreateMessage(self, **args):
+        msg = args['message']
+        
+        syncList = sync.GetSyncList()
+        
+        if syncList.GetObject(msg.oid) is not None:
+            return
+        
+        objType = sync.GetGameObjectList().NewObject(msg.otype)
+        
+        obj = objType.NewReplica(msg.oid)
+        obj.ApplyState(obj.FullMask(), msg.initial_values)
+        
+        syncList.AddReplica(obj)
+        
+        self.EmitEvent( {'name' : 'ObjectCreate',
+                         'type' : 'objectcreate',
+                         'data' : obj } )
+    
+    ## Game objects have changed on the server.  Updates aren't sent reliably, so each one is
+    #  acked here, which tells the server it can send the next ones as deltas against it.
+    def ObjectUpdateMessage(self, **args):
+        msg = args['message']
+        
+        # The updates carry the current values, so an older one would undo a newer one.  It isn't
+        # acked either, since the server would take it as the baseline, and it may have carried
+        # creates and changes that the newer one was too full for.
+        if msg.tick <= self.__lasttick:
+            return
+        
+        self.__lasttick = msg.tick
+        
+        if self.Connection() is not None:
+            self.Ack(msg.id, self.Connection() )
+        
+        created, updated, destroyed = sync.ApplyObjectUpdate(msg)
+        
+        for obj in created:
+            self.EmitEvent( {'name' : 'ObjectCreate',
+                             'type' : 'objectcreate',
+                             'data' : obj } )
+        
+        if len(updated) > 0:
+            self.EmitEvent( {'name' : 'ObjectUpdate',
+                             'type' : 'objectupdate',
+                             'data' : updated } )
+        
+        for obj in destroyed:
+            self.EmitEvent( {'name' : 'ObjectDestroy',
+                             'type' : 'objectdestroy',
+                             'data' : obj } )
+    
     #@}
 
     ## @name Protocol Send Methods
@@ -75,6 +143,10 @@ class RealtimeClient(ProtocolBase):
         theMsg = self.Pedia().GetMessageObject('login')
         theMsg.player = self.Name()
         
+        # A new session starts over with message IDs, if the server restarted.
+        if self.Transport() is not None:
+            self.Transport().ForgetConnection(self.Connection().info() )
+        
         self.AddOutgoingMessage(theMsg, self.Connection() )
         
         self.Connection().set_status(connection.C_WAITING)
@@ -93,10 +165,33 @@ class RealtimeClient(ProtocolBase):
         pass
         
 class RealtimeServer(ProtocolBase):
+    ## The replication.nReplicator that decides what each connection is sent.
+    __replicator = None
+    
+    ## The time between ticks, in seconds.
+    __tickinterval = None
+    
+    ## The time of the next tick.
+    __nexttick = None
+    
+    ## The ID of the login message each connection logged in with, keyed by connection key.
+    __logins = None
+    
     ## Constructor.  Pass it a dictionary with any of the following keys to initialize them:
     #      host : the host that will be listened to by the socket.
     #      port : the port on which the socket will listen
     #      name : the name of the server
+    #      history : the number of ticks of object snapshots to keep.  A client that hasn't acked
+    #                an object update in that many ticks is sent the full state.  Defaults to
+    #                snapshot.DEFAULT_DEPTH.
+    #      tickrate : the number of ticks per second, each of which sends the changes to game
+    #                 objects.  Defaults to DEFAULT_TICKRATE.
+    #      cellsize : the size of the cells of the grid used for interest management.  Defaults
+    #                 to interest.DEFAULT_CELL_SIZE.
+    #      objectbandwidth : the bandwidth cap for object updates to each connection, in bytes
+    #                        per second.  When more updates change than fit, the ones with the
+    #                        highest priority are sent first, see priority.py.  Defaults to no
+    #                        cap.
     def __init__(self, **args):
         super().__init__(**args)
 
@@ -105,6 +200,28 @@ class RealtimeServer(ProtocolBase):
         else:
             self.SetName('Test Server')
 
+        if 'cellsize' in args:
+            cellSize = args['cellsize']
+        else:
+            cellSize = interest.DEFAULT_CELL_SIZE
+        
+        if 'tickrate' in args:
+            self.__tickinterval = 1.0 / args['tickrate']
+        else:
+            self.__tickinterval = 1.0 / DEFAULT_TICKRATE
+        
+        budget = None
+        if 'objectbandwidth' in args:
+            budget = self.__budget(args['objectbandwidth'])
+        
+        if 'history' in args:
+            self.__replicator = replication.nReplicator(args['history'], cellSize, budget)
+        else:
+            self.__replicator = replication.nReplicator(cellSize=cellSize, budget=budget)
+        
+        self.__nexttick = 0.0
+        self.__logins = {}
+        
         self.RegisterMessageCallback('login', self.LoginMessage)
         self.RegisterMessageCallback('logout', self.LogoutMessage)
 
@@ -116,17 +233,95 @@ class RealtimeServer(ProtocolBase):
     def Stop(self):
         pass
         
+    ## Limits what a connection is sent to the game objects within radius of a position, and the
+    #  objects of types without a position.  Call it again as the player moves.  Objects coming
+    #  into the circle are created on the client, and objects leaving it are destroyed, and an
+    #  objectenter or objectleave event is emitted for each connection they enter or leave.
+    def SetInterest(self, connection, x, y, radius):
+        self.__replicator.SetInterest(str(connection), x, y, radius)
+    
+    ## Sends a connection every game object again.
+    def ClearInterest(self, connection):
+        self.__replicator.ClearInterest(str(connection) )
+    
+    ## Sets the bandwidth cap for object updates to a connection, in bytes per second, or None
+    #  for no cap.
+    def SetObjectBandwidth(self, connection, bandwidth):
+        self.__replicator.SetBudget(str(connection), self.__budget(bandwidth) )
+    
+    ## Returns the number of bytes of updates per tick for a bandwidth cap.
+    def __budget(self, bandwidth):
+        if bandwidth is None:
+            return None
+        
+        return int(bandwidth * self.__tickinterval)
+    
+    ## Starts a new tick and sends each connection an objectupdate message with what changed
+    #  since the last tick it acked.  Only the objects that changed are looked at.
     def SyncObjects(self):
-        return
-        # Now it's time to sync any game objects that need to be synced.
-        syncList = sync.GetSyncList()
+        timestep = time.time()
         
-        # Start with sending out game object creation messages.
-        for a in syncList.GetNewObjects():
-            pass
+        if timestep < self.__nexttick:
+            return
         
-        # Now sync any objects that need to be synced
-        pass
+        # Keep to the tick rate, but don't try to catch up on ticks missed while busy.
+        self.__nexttick = max(self.__nexttick + self.__tickinterval, timestep)
+        
+        replicator = self.__replicator
+        tick = replicator.Advance()
+        
+        for con in list(self.ConnectionList() ):
+            theMsg = self.Pedia().GetMessageObject('objectupdate')
+            
+            if replicator.BuildUpdate(str(con), theMsg, channels.ResendTimeout(con.ping() ) ):
+                self.AddOutgoingMessage(theMsg, con)
+                replicator.Sent(str(con), theMsg.id, tick)
+            
+            relevance = replicator.Relevance(str(con) )
+            
+            if relevance is not None:
+                self.__emitRelevance(con, relevance)
+    
+    ## Emits the objectenter and objectleave events for a connection.
+    def __emitRelevance(self, connection, relevance):
+        entered, left = relevance
+        
+        if len(entered) > 0:
+            self.EmitEvent( {'name' : 'ObjectEnter',
+                             'type' : 'objectenter',
+                             'data' : { 'connection' : connection,
+                                        'objects' : sorted(entered) } } )
+        
+        if len(left) > 0:
+            self.EmitEvent( {'name' : 'ObjectLeave',
+                             'type' : 'objectleave',
+                             'data' : { 'connection' : connection,
+                                        'objects' : sorted(left) } } )
+    
+    ## Maintains a connection, and removes it once it has timed out.
+    def MaintainConnection(self, con):
+        super().MaintainConnection(con)
+        
+        if con.Status() == connection.C_TIMEOUT:
+            self.RemoveConnection(con)
+    
+    ## Removes a connection, along with what the replicator keeps for it.
+    def RemoveConnection(self, con):
+        super().RemoveConnection(con)
+        
+        self.__replicator.RemoveConnection(str(con) )
+        self.__logins.pop(str(con), None)
+    
+    ## Moves a connection's baseline when it acks an objectupdate.
+    def MessageAcked(self, msgId, connection):
+        self.__replicator.Acked(str(connection), msgId)
+    
+    ## Returns the protocol's statistics, along with the replicator's.
+    def Stats(self):
+        stats = super().Stats()
+        stats.update(self.__replicator.Stats() )
+        
+        return stats
         
         
     ## @name Callback Methods
@@ -134,8 +329,20 @@ class RealtimeServer(ProtocolBase):
     #  These are the callback methods for particular messages.
     #@{
     
-    ## Callback for login messages.  This means that a client is trying to login.
+    ## Callback for login messages.  This means that a client is trying to login.  Logins aren't
+    #  dropped as duplicates by the transport, so a copy of the one a client logged in with is
+    #  only acked again.  Any other login from a connection that's already logged in means the
+    #  client started over, so the old session is removed first.
     def LoginMessage(self, **args):
+        oldConnection = self.Connection(args['connection'])
+        
+        if oldConnection is not None:
+            if self.__logins.get(str(oldConnection) ) == args['message'].id:
+                self.Ack(args['message'].id, oldConnection)
+                return
+            
+            self.RemoveConnection(oldConnection)
+        
         print("Received login request from " + str(args['connection'][0]) + ":" + str(args['connection'][1]) )
         
         newConnection = self.ConnectionList().Create(args['connection'], args['message'].player)
@@ -145,12 +352,17 @@ class RealtimeServer(ProtocolBase):
         self.AddConnection(newConnection)
         self.Ack(args['message'].id, newConnection)
         
+        self.__logins[str(newConnection)] = args['message'].id
+        
         theMsg = self.Pedia().GetMessageObject('login')
         theMsg.con_id = newConnection.id()
         theMsg.player = newConnection.player()
         
         self.AddOutgoingMessage(theMsg, newConnection)
         
+        # The new client has no baseline, so it'll be sent the full state of the game objects.
+        self.__replicator.RemoveConnection(str(newConnection) )
+        
         #TODO: emit an event for the login so the game can create a player for this connection
         self.EmitEvent( {'name' : 'Login',
                          'type' : 'login',
@@ -160,9 +372,16 @@ class RealtimeServer(ProtocolBase):
     ## Callback for logout messages.  This means that a client is signaling it is disconnecting
     #  from the server.
     def LogoutMessage(self, **args):
+        con = self.Connection(args['connection'])
+        
+        if con is None:
+            return
+        
+        self.RemoveConnection(con)
+        
         self.EmitEvent( {'name' : "Logout",
                          'type' : 'logout',
-                         'data' : args['data'] } )
+                         'data' : con } )
     
     #@}
     
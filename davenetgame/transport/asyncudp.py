@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file
+#
+#  This file contains the AsyncUdp transport, which does the same job as the Udp transport
+#  but is driven by an asyncio event loop instead of its own thread.  Datagrams are handed to
+#  the transport by the event loop as soon as they arrive, and the protocol runs connection
+#  maintenance and the send flush as asyncio tasks.  Start it with DispatcherBase.StartAsync
+#  from inside a running event loop.
+
+import asyncio, socket
+
+from davenetgame import exceptions
+from davenetgame.transport.base import TransportBase, M_ASYNC
+from davenetgame.transport import fragment
+
+## The asyncio side of the AsyncUdp transport.  It does nothing but hand events from the event
+#  loop to the transport that owns it.
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    ## The AsyncUdp object that owns this protocol
+    __owner = None
+    
+    def __init__(self, owner):
+        super().__init__()
+        
+        self.__owner = owner
+    
+    def datagram_received(self, data, addr):
+        self.__owner.DatagramReceived(data, addr)
+    
+    def error_received(self, exc):
+        print("Socket error: " + str(exc) )
+    
+    ## Called by the event loop when the socket's write buffer goes over its high-water mark.
+    def pause_writing(self):
+        self.__owner.PauseWriting()
+    
+    ## Called by the event loop when the socket's write buffer has drained.
+    def resume_writing(self):
+        self.__owner.ResumeWriting()
+
+## This class implements the UDP Transport class on top of asyncio.  It never starts a thread;
+#  the mode is always M_ASYNC.
+class AsyncUdp(TransportBase):
+    ## The asyncio datagram transport, created when the transport is started.
+    __endpoint = None
+    
+    ## This event is set whenever the socket can take more data.  The send flush waits on it,
+    #  so outgoing messages back up in the protocol instead of in the socket buffer.
+    __writable = None
+    
+    ## Whether or not the socket is bound with SO_REUSEPORT.
+    __reuseport = None
+    
+    ## Splits messages too big for one datagram, and puts them back together.
+    __fragmenter = None
+    
+    ## Takes the same arguments as the Udp transport.  The mode is always M_ASYNC.
+    def __init__(self, **args):
+        args['mode'] = M_ASYNC
+        
+        super().__init__(**args)
+        
+        self.__reuseport = False
+        
+        if 'reuseport' in args:
+            self.__reuseport = args['reuseport']
+        
+        self.__fragmenter = fragment.Fragmenter(self.Buffersize() )
+    
+    ## AsyncUdp can only be started from inside an event loop.  Use DispatcherBase.StartAsync.
+    def _start(self):
+        raise exceptions.dngExceptionNotImplemented("AsyncUdp must be started with DispatcherBase.StartAsync.")
+    
+    ## Used internally to start the transport on the running event loop.  It is called by the
+    #  Protocol object.
+    async def _start_async(self):
+        self.SetContinue(True)
+        
+        await self.StartAsync()
+    
+    ## Creates the datagram endpoint.  Server sockets bind to ClientInfo(), client sockets bind
+    #  to a random local port.
+    async def StartAsync(self):
+        loop = asyncio.get_event_loop()
+        
+        self.__writable = asyncio.Event()
+        self.__writable.set()
+        
+        reusePort = None
+        
+        if self.IsServer():
+            localAddr = self.ClientInfo()
+            
+            if self.__reuseport:
+                reusePort = True
+        else:
+            localAddr = ('0.0.0.0', 0)
+        
+        try:
+            self.__endpoint, proto = await loop.create_datagram_endpoint(
+                                                lambda: _DatagramProtocol(self),
+                                                local_addr=localAddr,
+                                                family=socket.AF_INET,
+                                                reuse_port=reusePort)
+        except OSError as msg:
+            print('Failed to create socket: ' + str(msg) )
+            raise
+        
+        print('Socket created')
+    
+    ## Cleanup the socket.
+    def Stop(self):
+        if self.__endpoint is not None:
+            self.__endpoint.close()
+            self.__endpoint = None
+    
+    ## Datagrams are delivered by the event loop as they arrive, so there's nothing to poll
+    #  beyond throwing away messages whose fragments didn't all arrive in time.
+    def PollSocket(self):
+        self.__fragmenter.Maintain()
+    
+    ## Also throws away any message from the connection still being reassembled.
+    def ForgetConnection(self, connectInfo):
+        super().ForgetConnection(connectInfo)
+        
+        self.__fragmenter.Forget(connectInfo)
+    
+    ## Called by the event loop for each datagram received.
+    def DatagramReceived(self, data, addr):
+        if not data:
+            return
+        
+        self.AddBytesReceived(len(data) )
+        
+        message = self.__fragmenter.Decode(data, addr)
+        
+        if message is None:
+            return
+        
+        theId, payload = message
+        
+        self.ProcessMessage(theId, payload, addr)
+    
+    ## Encode and send the message, in several datagrams if it's bigger than Buffersize().
+    def SendMessage(self, msg):
+        for payload in self.__fragmenter.Encode(msg['type'], msg['message']):
+            self.AddBytesSent(len(payload) )
+            
+            self.__endpoint.sendto(payload, msg['connection'] )
+    
+    ## Adds the fragmentation counters to the transport stats.
+    def Stats(self):
+        stats = super().Stats()
+        
+        stats.update(self.__fragmenter.Stats() )
+        
+        return stats
+    
+    ## Stop sending until the socket's write buffer has drained.
+    def PauseWriting(self):
+        self.__writable.clear()
+    
+    ## The socket's write buffer has drained.
+    def ResumeWriting(self):
+        self.__writable.set()
+    
+    ## Waits until the socket can take more data.  This is the backpressure point: the protocol's
+    #  send flush awaits this before sending anything.
+    async def Drain(self):
+        await self.__writable.wait()
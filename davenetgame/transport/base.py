@@ -23,6 +23,8 @@ import threading, time
 from davenetgame import callback
 from davenetgame import exceptions
 from davenetgame import pedia
+from davenetgame.protocol import channels
+from davenetgame.transport import capture
 
 ## @file
 #
@@ -32,10 +34,41 @@ from davenetgame import pedia
 #  associated with a transport as well.  All the transport does is send and receive messages.
 #  When a message is received, it will call a message callback that the Protocol object must
 #  implement.  When a message is sent, the Protocol object must tell the transport layer where
-#  it is going.  For UDP connections, a host:port pair is needed.  For TCP connections, a socket
-#  is needed.  This information is stored in the Connection object.
-#
-#  Currently, only UDP is implemented.
+#  it is going.  Connections are known by a host:port pair, whether they are UDP or TCP; the
+#  TCP transport keeps track of which socket belongs to which pair.  This information is stored
+#  in the Connection object.
+
+## The transport runs in its own thread, polling the socket, maintaining connections and sending
+#  outgoing messages on its own.  This is the default.
+M_THREADED = 0
+## The transport does not start a thread.  Instead, DispatcherBase.Update drives it from the
+#  game loop by calling Step, so the socket is polled, connections are maintained and outgoing
+#  messages are flushed in the main thread.  No locks are taken in this mode.
+M_INLINE = 1
+## The transport does not start a thread.  It is driven by an asyncio event loop: the socket
+#  delivers datagrams as they arrive, and the protocol runs maintenance and the send flush as
+#  asyncio tasks.  See asyncudp.AsyncUdp and DispatcherBase.StartAsync.
+M_ASYNC = 2
+
+## The most connections whose recent message IDs are remembered for dropping duplicates.  Past
+#  this, the ones heard from first are forgotten, so traffic from many addresses that never log
+#  in can't grow the table without bound.
+MAX_DEDUP_PEERS = 4096
+
+## A lock that does nothing.  It's handed out by transports that don't run their own thread,
+#  since there's nothing to protect against when everything happens in the main thread.
+class NullLock(object):
+    def acquire(self, blocking=True, timeout=-1):
+        return True
+    
+    def release(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        pass
 
 class TransportBase(threading.Thread):
     ## This is the lock that must be called to avoid thread collisions
@@ -84,10 +117,55 @@ class TransportBase(threading.Thread):
     
     ## Do we continue the thread?
     __continue = None
+    
+    ## If set, received messages are handed to this function instead of being processed.  See
+    #  SetReceiver.
+    __receiver = None
+    
+    ## The capture.CaptureWriter recording this transport's traffic, if any.
+    __capture = None
 
     ## Whether or not this socket is a server.
     __isserver = None
     
+    ## The threading mode of this transport, one of M_THREADED, M_INLINE or M_ASYNC.
+    __mode = None
+    
+    ## The message IDs recently received from each connection, as a channels.SequenceWindow
+    #  keyed by (host, port).  None if duplicates aren't being dropped.
+    __seen = None
+    
+    ## How many message IDs each connection's window remembers.
+    __dedupwindow = None
+    
+    ## The number of duplicate messages dropped.
+    __duplicates = None
+    
+    ## A smoothed average, in seconds, of how long received messages waited between arriving
+    #  and being handed to the protocol.
+    __delay = None
+    
+    ## The longest such wait, in seconds.
+    __maxdelay = None
+    
+    ## Pass any of the following keyword arguments:
+    #      owner : the protocol object that owns this transport.  Required.
+    #      isserver : True if this transport will listen as a server.
+    #      clienthost : the local host to bind to.
+    #      clientport : the local port to bind to.
+    #      mode : one of M_THREADED, M_INLINE or M_ASYNC.  Default is M_THREADED.
+    #      capture : the name of a file to record all traffic to.  See SetCapture.
+    #      buffersize : the largest datagram sent or received.  Default is 1024.  Bigger
+    #                   messages are fragmented, see fragment.py.  Both sides must agree.
+    #      dedup : if True, messages whose ID was recently received from the same connection are
+    #              dropped before they're parsed.  A message whose ID is too old to be
+    #              remembered can't be told from a new one, so it's let through.  Messages of
+    #              types with the 'nologin' option, like login, are never dropped, so a peer
+    #              that restarted with new IDs can log in again.  Default is True.
+    #      dedupwindow : how many message IDs are remembered for each connection.  Message IDs
+    #                    are shared by every connection of the sender, so on clients of busy
+    #                    servers fewer duplicates are caught unless it's raised.  Default is
+    #                    1024.
     def __init__(self, **args):
         super().__init__()
 
@@ -110,16 +188,40 @@ class TransportBase(threading.Thread):
         if 'clientport' in args:
             self.__clientport = args['clientport']
 
-        self.__lock = threading.RLock()
+        self.__mode = M_THREADED
+        
+        if 'mode' in args:
+            self.__mode = args['mode']
+        
+        self.__lock = self.NewLock()
         
         self.__bytesreceived = 0
         self.__bytessent = 0
         
         self.__buffersize = 1024
         
+        if 'buffersize' in args:
+            self.__buffersize = args['buffersize']
+        
         self.__callbacks = callback.CallbackList()
         
         self.__continue = False
+        
+        self.__seen = {}
+        self.__dedupwindow = 1024
+        self.__duplicates = 0
+        
+        self.__delay = 0.0
+        self.__maxdelay = 0.0
+        
+        if 'dedup' in args and not args['dedup']:
+            self.__seen = None
+        
+        if 'dedupwindow' in args:
+            self.__dedupwindow = args['dedupwindow']
+        
+        if 'capture' in args:
+            self.SetCapture(args['capture'])
     
     ## Call to tell the subclass it will function as a server.  It is needed for sockets to
     #  bind to a listening socket as a server.  Clients typically don't need to worry about
@@ -144,6 +246,30 @@ class TransportBase(threading.Thread):
     def ClientInfo(self):
         return (self.__clienthost, self.__clientport)
     
+    ## Returns the threading mode for this transport, one of M_THREADED, M_INLINE or M_ASYNC.
+    def Mode(self):
+        return self.__mode
+    
+    ## Returns True if this transport runs its own thread.
+    def IsThreaded(self):
+        return self.__mode == M_THREADED
+    
+    ## Returns True if this transport is driven from the game loop by DispatcherBase.Update.
+    def IsInline(self):
+        return self.__mode == M_INLINE
+    
+    ## Returns True if this transport is driven by an asyncio event loop.
+    def IsAsync(self):
+        return self.__mode == M_ASYNC
+    
+    ## Returns a new lock object suitable for this transport's threading mode.  Protocols use
+    #  this so they don't pay for locking when there's only one thread.
+    def NewLock(self):
+        if self.IsThreaded():
+            return threading.RLock()
+        
+        return NullLock()
+    
     def Buffersize(self):
         return self.__buffersize
 
@@ -151,7 +277,27 @@ class TransportBase(threading.Thread):
         return self.__bytessent
     
     def BytesReceived(self):
-        return self.__bandwidth
+        return self.__bytesreceived
+    
+    ## Subclasses call this with the size of every datagram they send.
+    def AddBytesSent(self, count):
+        self.__bytessent += count
+    
+    ## Subclasses call this with the size of every datagram they receive.
+    def AddBytesReceived(self, count):
+        self.__bytesreceived += count
+    
+    ## Returns a dictionary of statistics for this transport.  Every value is a number.  Most
+    #  are counts, which can be added together across transports, but processing_delay is an
+    #  average and processing_delay_max a maximum.  See dispatch.shard for how those are
+    #  combined.  Subclasses that keep their own counters should extend the dictionary returned
+    #  by this method.
+    def Stats(self):
+        return { 'bytes_sent' : self.__bytessent,
+                 'bytes_received' : self.__bytesreceived,
+                 'duplicates' : self.__duplicates,
+                 'processing_delay' : self.__delay,
+                 'processing_delay_max' : self.__maxdelay }
 
     ## Call to determine if the thread should continue.
     def Continue(self):
@@ -165,6 +311,22 @@ class TransportBase(threading.Thread):
     def SetContinue(self, cont = True):
         self.__continue = cont
     
+    ## Starts or stops recording every message this transport receives and sends to a capture
+    #  file.  Recording stops by itself when the transport stops.  See capture.py.
+    #
+    #  @param filename the capture file to append to, or None to stop recording.
+    def SetCapture(self, filename):
+        if self.__capture is not None:
+            self.__capture.Close()
+            self.__capture = None
+        
+        if filename is not None:
+            self.__capture = capture.CaptureWriter(filename)
+    
+    ## Returns True if this transport is recording its traffic.
+    def IsCapturing(self):
+        return self.__capture is not None
+    
     ## Used internally to actually start the thread.  It is called by the Protocol object, and
     #  calls Transport.Start() when it's done, which is where the subclasses' initialization
     #  happens.
@@ -174,8 +336,10 @@ class TransportBase(threading.Thread):
         # Call the subclass's start method.
         self.Start()
         
-        # Call the threading.Thread.start() method to actually start the thread.
-        self.start()
+        # Call the threading.Thread.start() method to actually start the thread.  Inline
+        # transports are driven by the dispatcher instead.
+        if self.IsThreaded():
+            self.start()
     
     ## Call to start the transport object.  Subclasses must implement this.
     def Start(self):
@@ -211,10 +375,12 @@ class TransportBase(threading.Thread):
     def _stopI(self, blocking=True):
         self.SetContinue(False)
     
-        if blocking:
+        if blocking and self.IsThreaded():
             self.Join()
             
         self.Stop()
+        
+        self.SetCapture(None)
 
     ## Call this to join the thread and wait until it closes.  Be careful doing this, because if you haven't
     #  signaled in any way that the thread should end, then your process will continue forever.
@@ -230,16 +396,85 @@ class TransportBase(threading.Thread):
     #  @param connectInfo The connection information for the connection from which the message
     #                     was received, usually a (host,port) tuple.  It has to be understood
     #                     by the connection object.
-    def ProcessMessage(self, typeId, msg, connectInfo):
+    #  @param timestamp When the message arrived.  Transports that can ask the kernel pass its
+    #                   timestamp, so time spent waiting to be read doesn't count toward the
+    #                   ping.  Defaults to now.  Handlers get it as their timestamp.
+    def ProcessMessage(self, typeId, msg, connectInfo, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        
+        if self.__capture is not None:
+            self.__capture.Write(capture.D_IN, typeId, connectInfo, msg, timestamp)
+        
+        if self.__receiver is not None:
+            self.__receiver(typeId, msg, connectInfo)
+            return
+        
+        options = pedia.getPedia().GetMessageOptions(typeId)
+        channel = channels.GetChannel(options)
+        
+        # Reliable channels drop their own duplicates, since they have to ack them again.
+        if self.__seen is not None and not channels.IsReliable(channel) and 'nologin' not in options:
+            if self.__isDuplicate(channel, msg, connectInfo):
+                self.__duplicates += 1
+                return
+        
+        if channel == channels.UNRELIABLE:
+            self.__dispatch(typeId, msg, connectInfo, timestamp)
+            return
+        
+        # The channel may hold the message back, or let several go at once.
+        for theType, payload in self.__owner.ReceiveChannel(channel, typeId, msg, connectInfo):
+            self.__dispatch(theType, payload, connectInfo, timestamp)
+    
+    ## Returns True if the message's ID was recently received from the same connection, and
+    #  remembers it otherwise.  The ID is read without parsing the message.
+    def __isDuplicate(self, channel, msg, connectInfo):
+        offset = 0
+        if channel != channels.UNRELIABLE:
+            offset = channels.HEADER_SIZE
+        
+        msgId = channels.PeekMessageId(msg, offset)
+        
+        if msgId is None:
+            return False
+        
+        window = self.__seen.get(connectInfo)
+        
+        if window is None:
+            if len(self.__seen) >= MAX_DEDUP_PEERS:
+                del self.__seen[next(iter(self.__seen) )]
+            
+            window = channels.SequenceWindow(self.__dedupwindow, 32, True)
+            self.__seen[connectInfo] = window
+        
+        return not window.Check(msgId)
+    
+    ## Forgets whatever the transport keeps about a connection that's gone, so a new session
+    #  from the same address starts clean.  Called by the protocol when it removes a connection.
+    #  Subclasses that keep their own state for each connection should extend it.
+    #
+    #  @param connectInfo the connection's (host, port) tuple.
+    def ForgetConnection(self, connectInfo):
+        if self.__seen is not None:
+            self.__seen.pop(connectInfo, None)
+    
+    ## Parses a message and hands it to the owner and the registered callbacks.
+    def __dispatch(self, typeId, msg, connectInfo, timestep):
+        # How long the message waited for us, as opposed to on the network.
+        delay = time.time() - timestep
+        
+        self.__delay += (delay - self.__delay) / 8
+        if delay > self.__maxdelay:
+            self.__maxdelay = delay
+        
         buf = pedia.getPedia().GetMessageObject(typeId)
         
         typeName = pedia.getPedia().GetTypeName(typeId)
-
+        
         buf.ParseFromString(msg)
         
-        # We pass a timestep to every handler so they can update connections accordingly
-        timestep = time.time()
-
+        # We pass the arrival time to every handler so they can update connections accordingly
         self.__owner.ReceiveMessage(buf, connectInfo, timestep)
         
         theCbs = self.GetCallbacks(typeName)
@@ -250,6 +485,15 @@ class TransportBase(threading.Thread):
                           'timestamp' : timestep } )
             cb.Call()
 
+    ## Hands every received message to func instead of processing it.  This is how a transport
+    #  that wraps another one, such as emulator.Emulator, gets at the wrapped transport's
+    #  messages.
+    #
+    #  @param func a function taking the typeId, msg and connectInfo arguments of
+    #              ProcessMessage, or None to process messages normally again.
+    def SetReceiver(self, func):
+        self.__receiver = func
+
     ## Call to get outgoing messages from the owner object.  Each message will be already
     #  serialized, so the return value of this method is a list of dicts, where each item
     #  is of the form:
@@ -260,24 +504,45 @@ class TransportBase(threading.Thread):
     def GetOutgoingMessages(self):
         return self.__owner.GetOutgoingMessages()
 
+    ## Sends all outgoing messages waiting on the owner, then whatever the transport batched.
+    def Flush(self):
+        for msg in self.GetOutgoingMessages():
+            if self.__capture is not None:
+                self.__capture.Write(capture.D_OUT, msg['type'], msg['connection'], msg['message'])
+            
+            self.SendMessage(msg)
+        
+        self.FlushBatch()
+    
+    ## Sends the messages SendMessage batched instead of sending them right away.  Transports
+    #  that batch override this rather than Flush, so a transport wrapping them can flush their
+    #  batch without also draining the owner.  The base implementation does nothing.
+    def FlushBatch(self):
+        pass
+
+    ## Runs one iteration of the transport: poll the socket, maintain connections, and send
+    #  outgoing messages.  In threaded mode, this is called from run().  In inline mode, the
+    #  dispatcher calls it from the game loop, once per Update.
+    def Step(self):
+        # First, poll the socket and handle incoming messages
+        self.PollSocket()
+        
+        # Second, maintain connections.  This is in the middle because outgoing messages
+        # will be generated, and we want to make sure to send those in this loop iteration
+        # rather than waiting for the next time around.
+        self.__owner.MaintainConnections()
+        
+        # Last, send all outgoing messages.
+        self.Flush()
+
     ## Starts the socket polling.  Don't call this directly, instead call Start().  Also,
     #  you *must* implement PollSocket in your subclass.  It will be called automatically,
     #  and leaves you not having to worry about the threading details, while providing support
-    #  for the Transport object to operate in a single-threaded environment.
+    #  for the Transport object to operate in a single-threaded environment.  See M_INLINE.
     def run(self):
         # now keep talking with the other side
         while self.Continue():
-            # First, poll the socket and handle incoming messages
-            self.PollSocket()
-            
-            # Second, maintain connections.  This is in the middle because outgoing messages
-            # will be generated, and we want to make sure to send those in this loop iteration
-            # rather than waiting for the next time around.
-            self.__owner.MaintainConnections()
-            
-            # Last, send all outgoing messages.
-            for msg in self.GetOutgoingMessages():
-                self.SendMessage(msg)
+            self.Step()
             
             time.sleep(0.01)
             
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file capture
+#
+#  This file contains the capture file format used to record a transport's traffic, and the
+#  replay driver that feeds a recorded session back through a transport.  Any transport can
+#  record by passing capture=filename to its constructor, or by calling SetCapture.  Inbound
+#  messages are recorded as they reach ProcessMessage and outbound messages as they are
+#  flushed, so the file holds exactly what the protocol saw, whichever transport is underneath.
+#
+#  A capture file is the magic string below followed by records, each made of a header and then
+#  the host and the payload.  Records are only ever appended, so a file that was being written
+#  when the process died is still readable up to its last whole record.
+#
+#  To profile the message handling path with recorded traffic:
+#
+#      theTransport = loopback.Loopback(owner=theProtocol, isserver=True, mode=M_INLINE)
+#      count = capture.Replay(theTransport, "session.dngcap")
+
+import mmap, struct, time
+
+from davenetgame import exceptions
+
+## The first bytes of every capture file.
+MAGIC = b'DNGCAP01'
+
+## Direction of a record: received by the transport.
+D_IN = 0
+## Direction of a record: sent by the transport.
+D_OUT = 1
+
+## The header of each record: timestamp, direction, message type ID, port, length of the host
+#  string, and length of the payload.
+_RECORD = struct.Struct("!dBIHBI")
+
+## How much the writer buffers before it goes to the disk, by default.
+DEFAULT_BUFFER = 64 * 1024
+
+## Appends records to a capture file.  Writes are buffered, so call Flush if you need the file
+#  to be complete while it's still open.
+class CaptureWriter(object):
+    ## The open file
+    __file = None
+    
+    ## The number of records written so far
+    __count = None
+    
+    ## Opens a capture file for appending, creating it if needed.
+    #
+    #  @param filename the name of the capture file.
+    #  @param buffersize how many bytes are buffered before they are written out.
+    def __init__(self, filename, buffersize=DEFAULT_BUFFER):
+        self.__file = open(filename, 'ab', buffering=buffersize)
+        self.__count = 0
+        
+        if self.__file.tell() == 0:
+            self.__file.write(MAGIC)
+    
+    ## Returns the number of records written by this writer.
+    def Count(self):
+        return self.__count
+    
+    ## Appends one record.
+    #
+    #  @param direction D_IN or D_OUT.
+    #  @param typeId the message type ID.
+    #  @param connectInfo the (host, port) tuple the message came from or is going to.
+    #  @param payload the serialized message.
+    #  @param timestamp when the message was seen.  Defaults to now.
+    def Write(self, direction, typeId, connectInfo, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        
+        host = str(connectInfo[0]).encode('utf-8')
+        
+        if len(host) > 255:
+            raise exceptions.dngExceptionNotImplemented("Host name too long to capture: " + connectInfo[0])
+        
+        write = self.__file.write
+        
+        write(_RECORD.pack(timestamp, direction, typeId, connectInfo[1], len(host), len(payload) ) )
+        write(host)
+        write(payload)
+        
+        self.__count += 1
+    
+    ## Writes out everything buffered so far.
+    def Flush(self):
+        self.__file.flush()
+    
+    def Close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+## Reads a capture file.  The file is memory-mapped, so even large captures are read without
+#  copying them into memory first.  Iterate over the reader to get each record as a tuple of
+#  (timestamp, direction, typeId, (host, port), payload).
+class CaptureReader(object):
+    ## The open file
+    __file = None
+    
+    ## The memory map of the file
+    __map = None
+    
+    def __init__(self, filename):
+        self.__file = open(filename, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if self.__map[:len(MAGIC)] != MAGIC:
+            self.Close()
+            
+            raise exceptions.dngExceptionNotImplemented("Not a capture file: " + filename)
+    
+    def __iter__(self):
+        data = self.__map
+        size = len(data)
+        offset = len(MAGIC)
+        
+        while offset + _RECORD.size <= size:
+            timestamp, direction, typeId, port, hostLength, payloadLength = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            
+            # A record cut short by a crash ends the capture.
+            if offset + hostLength + payloadLength > size:
+                break
+            
+            host = data[offset:offset + hostLength].decode('utf-8')
+            offset += hostLength
+            
+            payload = data[offset:offset + payloadLength]
+            offset += payloadLength
+            
+            yield (timestamp, direction, typeId, (host, port), payload)
+    
+    def Close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__file.close()
+            
+            self.__map = None
+            self.__file = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.Close()
+
+## Feeds the inbound messages of a capture file through a transport's ProcessMessage, so the
+#  owner protocol and the registered callbacks handle them as if they had just arrived.
+#  Outbound records are skipped.  The transport doesn't need to be started.
+#
+#  @param transport the transport to feed the messages to.
+#  @param filename the name of the capture file.
+#  @param realtime if True, messages are spaced out as they were when they were captured.  If
+#                  False, they're replayed as fast as possible.
+#  @param speed with realtime, how much faster than real time to replay.  2.0 is twice as fast.
+#  @returns the number of messages replayed.
+def Replay(transport, filename, realtime=False, speed=1.0):
+    count = 0
+    
+    with CaptureReader(filename) as reader:
+        first = None
+        start = time.time()
+        
+        for timestamp, direction, typeId, connectInfo, payload in reader:
+            if direction != D_IN:
+                continue
+            
+            if realtime:
+                if first is None:
+                    first = timestamp
+                
+                wait = (timestamp - first) / speed - (time.time() - start)
+                
+                if wait > 0:
+                    time.sleep(wait)
+            
+            transport.ProcessMessage(typeId, payload, connectInfo)
+            
+            count += 1
+    
+    return count
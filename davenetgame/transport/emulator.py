@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file emulator
+#
+#  This file contains the Emulator transport, which wraps any other transport and makes the
+#  network look worse than it is.  Messages going through it can be delayed, jittered, dropped,
+#  duplicated and reordered, so you can see how the protocol behaves at 5% loss and 150 ms
+#  round trip time without needing netem or a bad wifi connection.
+#
+#  Build the real transport as usual, then wrap it and give the wrapper to the protocol:
+#
+#      theTransport = udp.Udp(isserver=True, clienthost=HOST, clientport=PORT, owner=theProtocol)
+#      theEmulator = emulator.Emulator(transport=theTransport, owner=theProtocol,
+#                                      seed=1234, latency=0.075, loss=0.05)
+#      theProtocol.SetTransport(theEmulator)
+#
+#  The wrapped transport is never started as a thread; the Emulator drives it.  Conditions
+#  apply to each direction separately, so latency=0.075 gives 150 ms round trip time when only
+#  one side is emulated.  Conditions can be set per connection with SetConditions.  Given the
+#  same seed and the same traffic, the same messages are dropped, duplicated and reordered.
+
+import heapq, random, time
+
+from davenetgame.transport.base import TransportBase
+
+## The names of the conditions an Emulator understands, and their default values.
+#      latency : seconds every message is delayed.
+#      jitter : up to this many seconds are randomly added to or taken from the latency.
+#      loss : the chance, from 0.0 to 1.0, that a message is dropped.
+#      duplicate : the chance that a message is delivered twice.
+#      reorder : the chance that a message is held back so later messages overtake it.
+#      reorderdelay : the extra seconds a reordered message is held back.
+#      direction : which messages are affected: 'in', 'out' or 'both'.
+DEFAULT_CONDITIONS = {
+    'latency' : 0.0,
+    'jitter' : 0.0,
+    'loss' : 0.0,
+    'duplicate' : 0.0,
+    'reorder' : 0.0,
+    'reorderdelay' : 0.05,
+    'direction' : 'both',
+}
+
+## Direction markers for messages waiting in the emulator.
+_INBOUND = 0
+_OUTBOUND = 1
+
+## The stats kept by the emulator itself rather than the wrapped transport.
+_OWN_STATS = ('duplicates', 'processing_delay', 'processing_delay_max')
+
+## This class wraps another transport and emulates a bad network on top of it.
+class Emulator(TransportBase):
+    ## The wrapped transport.
+    __transport = None
+    
+    ## The random number generator.  Seed it for reproducible runs.
+    __random = None
+    
+    ## The default conditions.
+    __defaults = None
+    
+    ## Conditions for particular connections, keyed by (host, port).
+    __conditions = None
+    
+    ## Messages waiting to be delivered, as a heap of (due time, sequence, direction, message).
+    __pending = None
+    
+    ## Increases with every message queued, so the heap never has to compare messages.
+    __sequence = None
+    
+    ## Counters for the stats.
+    __dropped = None
+    __duplicated = None
+    __reordered = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      transport : the transport to wrap.  Required.  It should have the same owner.
+    #      seed : the seed for the random number generator.
+    #  Any of the names in DEFAULT_CONDITIONS may be passed as well, to set the default
+    #  conditions for every connection.
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        self.__transport = args['transport']
+        self.__transport.SetReceiver(self.__received)
+        
+        seed = None
+        if 'seed' in args:
+            seed = args['seed']
+        
+        self.__random = random.Random(seed)
+        
+        self.__defaults = dict(DEFAULT_CONDITIONS)
+        for key in DEFAULT_CONDITIONS:
+            if key in args:
+                self.__defaults[key] = args[key]
+        
+        self.__conditions = {}
+        self.__pending = []
+        self.__sequence = 0
+        
+        self.__dropped = 0
+        self.__duplicated = 0
+        self.__reordered = 0
+    
+    ## Returns the wrapped transport.
+    def Transport(self):
+        return self.__transport
+    
+    ## Sets the conditions for one connection, or the defaults for all of them.  Conditions not
+    #  given keep their current value.
+    #
+    #  @param connectInfo a (host, port) tuple, or None to change the defaults.
+    #  @param conditions any of the names in DEFAULT_CONDITIONS.
+    def SetConditions(self, connectInfo=None, **conditions):
+        if connectInfo is None:
+            self.__defaults.update(conditions)
+        else:
+            if connectInfo not in self.__conditions:
+                self.__conditions[connectInfo] = dict(self.__defaults)
+            
+            self.__conditions[connectInfo].update(conditions)
+    
+    ## Returns the conditions in effect for a connection.
+    def GetConditions(self, connectInfo):
+        if connectInfo in self.__conditions:
+            return self.__conditions[connectInfo]
+        
+        return self.__defaults
+    
+    def Start(self):
+        self.__transport.Start()
+    
+    def Stop(self):
+        self.__transport.Stop()
+    
+    ## Polls the wrapped transport, then delivers every message that is due.
+    def PollSocket(self):
+        self.__transport.PollSocket()
+        
+        self.__release()
+    
+    ## Queues the message according to the conditions for its connection.
+    def SendMessage(self, msg):
+        self.__schedule(_OUTBOUND, msg['connection'], msg)
+    
+    ## Sends every outgoing message that is due, then has the wrapped transport send whatever it
+    #  batched.  Only its batch is flushed: the owner's messages have to go through the
+    #  emulation, and the wrapped transport would send them straight out.
+    def FlushBatch(self):
+        self.__release()
+        
+        self.__transport.FlushBatch()
+    
+    ## Forgets a connection in the wrapped transport too.
+    def ForgetConnection(self, connectInfo):
+        super().ForgetConnection(connectInfo)
+        
+        self.__transport.ForgetConnection(connectInfo)
+    
+    ## Adds the emulator's counters to the wrapped transport's stats.  Received messages are
+    #  deduplicated and dispatched by the emulator, not the wrapped transport, so those counters
+    #  are the emulator's own.
+    def Stats(self):
+        stats = self.__transport.Stats()
+        own = super().Stats()
+        
+        for key in _OWN_STATS:
+            stats[key] = own[key]
+        
+        stats['emulated_dropped'] = self.__dropped
+        stats['emulated_duplicated'] = self.__duplicated
+        stats['emulated_reordered'] = self.__reordered
+        stats['emulated_pending'] = len(self.__pending)
+        
+        return stats
+    
+    ## The wrapped transport hands every message it receives to this method.
+    def __received(self, typeId, msg, connectInfo):
+        self.__schedule(_INBOUND, connectInfo, (typeId, msg, connectInfo) )
+    
+    ## Decides the fate of one message and queues it.
+    def __schedule(self, direction, connectInfo, item):
+        conditions = self.GetConditions(connectInfo)
+        
+        affected = conditions['direction']
+        if affected != 'both':
+            if (affected == 'in') != (direction == _INBOUND):
+                self.__push(0.0, direction, item)
+                return
+        
+        rand = self.__random.random
+        
+        if rand() < conditions['loss']:
+            self.__dropped += 1
+            return
+        
+        copies = 1
+        if rand() < conditions['duplicate']:
+            self.__duplicated += 1
+            copies = 2
+        
+        for copy in range(copies):
+            delay = conditions['latency']
+            
+            if conditions['jitter'] > 0.0:
+                delay += self.__random.uniform(-conditions['jitter'], conditions['jitter'])
+            
+            if rand() < conditions['reorder']:
+                self.__reordered += 1
+                delay += conditions['reorderdelay']
+            
+            self.__push(max(delay, 0.0), direction, item)
+    
+    ## Puts a message on the heap, due delay seconds from now.
+    def __push(self, delay, direction, item):
+        self.__sequence += 1
+        
+        heapq.heappush(self.__pending, (time.time() + delay, self.__sequence, direction, item) )
+    
+    ## Delivers every message that is due, in the order they are due.
+    def __release(self):
+        pending = self.__pending
+        now = time.time()
+        
+        while len(pending) > 0 and pending[0][0] <= now:
+            due, sequence, direction, item = heapq.heappop(pending)
+            
+            if direction == _OUTBOUND:
+                self.__transport.SendMessage(item)
+            else:
+                TransportBase.ProcessMessage(self, item[0], item[1], item[2])
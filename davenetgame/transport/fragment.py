@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file fragment
+#
+#  This file contains the datagram framing shared by the UDP transports, including the splitting
+#  of messages too big for one datagram and their reassembly on the other side.
+#
+#  A datagram is normally the message type ID followed by the serialized message.  When that
+#  won't fit in the transport's Buffersize(), the message is split into fragments.  Each
+#  fragment's type word has FRAGMENT_FLAG set, and is followed by a fragment header: the group
+#  ID shared by all fragments of the message, the fragment's index, and the number of fragments.
+#
+#  Reassembly memory is bounded.  Each connection may have only so many messages in pieces at
+#  once, the oldest being thrown away to make room.  So may all connections together, and the
+#  bytes held for all of them are capped too, since datagrams can come from any number of
+#  made-up addresses.  Messages bigger than a set size are refused,
+#  and messages whose fragments don't all arrive in time are thrown away.  A lost fragment
+#  loses the whole message, just like a lost datagram would.  Transports call Maintain each time
+#  they poll, so late messages are thrown away even when no more fragments arrive, and Forget
+#  when a connection is dropped.
+
+import collections, struct, time
+
+## Set in the type word of every fragment.
+FRAGMENT_FLAG = 0x80000000
+
+## The type word that starts every datagram.
+_TYPE = struct.Struct("!I")
+
+## The type word and fragment header that start every fragment: type ID, group ID, index, and
+#  number of fragments.
+_FRAGMENT = struct.Struct("!IIHH")
+
+## The most fragments one message may be split into.
+MAX_FRAGMENTS = 0xFFFF
+
+## The biggest message reassembled, by default.
+MAX_MESSAGE = 1024 * 1024
+
+## The most messages being reassembled at once, for all connections together, by default.
+MAX_PENDING_GROUPS = 1024
+
+## The most bytes of fragments held for reassembly, for all connections together, by default.
+MAX_PENDING_BYTES = 32 * 1024 * 1024
+
+## This class splits outgoing messages into datagrams and puts incoming datagrams back together
+#  into messages.  Each UDP transport has one.
+class Fragmenter(object):
+    ## The largest datagram to send, and the largest one the other side will receive.
+    __datagramsize = None
+    
+    ## The ID of the last fragmented message sent.
+    __group = None
+    
+    ## Messages being reassembled, keyed by connection and then by group ID.  Each is a list of
+    #  [typeId, fragments, fragments received, bytes received, time of first fragment].
+    __pending = None
+    
+    ## Seconds to wait for all of a message's fragments.
+    __timeout = None
+    
+    ## How many messages each connection may have in pieces at once.
+    __maxgroups = None
+    
+    ## How many messages all connections together may have in pieces at once.
+    __maxpending = None
+    
+    ## How many bytes of fragments all connections together may have held at once.
+    __maxbytes = None
+    
+    ## Every message being reassembled, as (connectInfo, group) keys, oldest first.
+    __order = None
+    
+    ## The bytes of fragments held for all messages being reassembled.
+    __buffered = None
+    
+    ## The biggest message, in bytes, that will be reassembled.
+    __maxmessage = None
+    
+    ## When expired messages were last looked for.
+    __lastexpire = None
+    
+    ## Counters, see Stats.
+    __counters = None
+    
+    ## @param datagramsize the largest datagram sent or received.  Usually Buffersize().
+    #  @param timeout seconds to wait for all of a message's fragments.
+    #  @param maxgroups how many messages each connection may have in pieces at once.
+    #  @param maxmessage the biggest message, in bytes, that will be reassembled.
+    #  @param maxpending how many messages all connections together may have in pieces at once.
+    #  @param maxbytes how many bytes of fragments may be held for all connections together.
+    def __init__(self, datagramsize, timeout=5.0, maxgroups=8, maxmessage=MAX_MESSAGE,
+                 maxpending=MAX_PENDING_GROUPS, maxbytes=MAX_PENDING_BYTES):
+        self.__datagramsize = datagramsize
+        self.__timeout = timeout
+        self.__maxgroups = maxgroups
+        self.__maxmessage = maxmessage
+        self.__maxpending = maxpending
+        self.__maxbytes = maxbytes
+        
+        self.__group = 0
+        self.__pending = {}
+        self.__order = collections.OrderedDict()
+        self.__buffered = 0
+        self.__lastexpire = time.time()
+        
+        self.__counters = { 'fragments_sent' : 0,
+                            'fragments_received' : 0,
+                            'reassembled' : 0,
+                            'reassembly_expired' : 0,
+                            'reassembly_evicted' : 0,
+                            'reassembly_refused' : 0 }
+    
+    ## Turns a message into the datagrams that carry it.
+    #
+    #  @param typeId the message type ID.
+    #  @param payload the serialized message.
+    #  @returns a list of bytes objects, each of which is sent as one datagram.
+    def Encode(self, typeId, payload):
+        if len(payload) + _TYPE.size <= self.__datagramsize:
+            return [ _TYPE.pack(typeId) + payload ]
+        
+        chunk = self.__datagramsize - _FRAGMENT.size
+        count = (len(payload) + chunk - 1) // chunk
+        
+        if count > MAX_FRAGMENTS:
+            raise ValueError("Message of " + str(len(payload) ) + " bytes is too big to fragment")
+        
+        self.__group = (self.__group + 1) & 0xFFFFFFFF
+        
+        typeWord = typeId | FRAGMENT_FLAG
+        
+        datagrams = []
+        
+        for index in range(count):
+            start = index * chunk
+            datagrams.append(_FRAGMENT.pack(typeWord, self.__group, index, count) + payload[start:start + chunk])
+        
+        self.__counters['fragments_sent'] += count
+        
+        return datagrams
+    
+    ## Turns a received datagram back into a message.
+    #
+    #  @param data the datagram.
+    #  @param connectInfo the (host, port) tuple it came from.
+    #  @returns a (typeId, payload) tuple, or None if the datagram was a fragment and the
+    #           message isn't complete yet, or if the datagram was garbage.
+    def Decode(self, data, connectInfo):
+        if len(data) < _TYPE.size:
+            return None
+        
+        typeWord, = _TYPE.unpack_from(data)
+        
+        if not typeWord & FRAGMENT_FLAG:
+            return (typeWord, data[_TYPE.size:])
+        
+        if len(data) < _FRAGMENT.size:
+            return None
+        
+        typeWord, group, index, count = _FRAGMENT.unpack_from(data)
+        
+        self.__counters['fragments_received'] += 1
+        
+        now = time.time()
+        
+        self.Maintain(now)
+        
+        # Refuse messages that can't be smaller than maxmessage, whatever their last fragment.
+        if index >= count or (count - 1) * (self.__datagramsize - _FRAGMENT.size) > self.__maxmessage:
+            self.__counters['reassembly_refused'] += 1
+            return None
+        
+        key = (connectInfo, group)
+        
+        if key not in self.__order:
+            groups = self.__pending.get(connectInfo, {})
+            
+            if len(groups) >= self.__maxgroups:
+                self.__remove(connectInfo, min(groups, key=lambda g: groups[g][4]) )
+                
+                self.__counters['reassembly_evicted'] += 1
+            
+            while len(self.__order) >= self.__maxpending:
+                self.__evictOldest()
+            
+            self.__pending.setdefault(connectInfo, {})[group] = [typeWord & ~FRAGMENT_FLAG, [None] * count, 0, 0, now]
+            self.__order[key] = True
+        
+        entry = self.__pending[connectInfo][group]
+        parts = entry[1]
+        
+        if len(parts) != count or parts[index] is not None:
+            return None
+        
+        piece = data[_FRAGMENT.size:]
+        
+        # Make room for the fragment in the total, oldest messages first, but not by throwing
+        # away the message it belongs to.
+        while self.__buffered + len(piece) > self.__maxbytes and next(iter(self.__order) ) != key:
+            self.__evictOldest()
+        
+        if self.__buffered + len(piece) > self.__maxbytes or entry[3] + len(piece) > self.__maxmessage:
+            self.__remove(connectInfo, group)
+            
+            self.__counters['reassembly_refused'] += 1
+            return None
+        
+        parts[index] = piece
+        entry[2] += 1
+        entry[3] += len(piece)
+        self.__buffered += len(piece)
+        
+        if entry[2] == count:
+            self.__remove(connectInfo, group)
+            
+            self.__counters['reassembled'] += 1
+            
+            return (entry[0], b''.join(parts) )
+        
+        return None
+    
+    ## Throws away a message being reassembled.
+    def __remove(self, connectInfo, group):
+        groups = self.__pending[connectInfo]
+        entry = groups.pop(group)
+        
+        if len(groups) == 0:
+            del self.__pending[connectInfo]
+        
+        del self.__order[ (connectInfo, group) ]
+        self.__buffered -= entry[3]
+    
+    ## Throws away the oldest message being reassembled, for any connection, to make room.
+    def __evictOldest(self):
+        connectInfo, group = next(iter(self.__order) )
+        self.__remove(connectInfo, group)
+        
+        self.__counters['reassembly_evicted'] += 1
+    
+    ## Throws away late messages if it's been a while since they were last looked for.  Cheap
+    #  enough to call on every poll.
+    #
+    #  @param now the current time.  Defaults to time.time().
+    def Maintain(self, now=None):
+        if now is None:
+            now = time.time()
+        
+        if now - self.__lastexpire > self.__timeout / 2:
+            self.Expire(now)
+    
+    ## Throws away messages whose fragments haven't all arrived in time.
+    #
+    #  @param now the current time.  Defaults to time.time().
+    def Expire(self, now=None):
+        if now is None:
+            now = time.time()
+        
+        self.__lastexpire = now
+        
+        limit = now - self.__timeout
+        
+        # Messages are kept oldest first, so the late ones are at the front.
+        while len(self.__order) > 0:
+            connectInfo, group = next(iter(self.__order) )
+            
+            if self.__pending[connectInfo][group][4] >= limit:
+                break
+            
+            self.__remove(connectInfo, group)
+            
+            self.__counters['reassembly_expired'] += 1
+    
+    ## Forgets everything being reassembled for a connection, say, when it's dropped.
+    def Forget(self, connectInfo):
+        for group in list(self.__pending.get(connectInfo, {}) ):
+            self.__remove(connectInfo, group)
+    
+    ## Returns the number of messages being reassembled.
+    def Pending(self):
+        return len(self.__order)
+    
+    ## Returns the number of bytes of fragments held for the messages being reassembled.
+    def Buffered(self):
+        return self.__buffered
+    
+    ## Returns a dictionary of counters, to be added to a transport's stats.
+    def Stats(self):
+        stats = dict(self.__counters)
+        
+        stats['reassembly_pending'] = self.Pending()
+        stats['reassembly_buffered'] = self.Buffered()
+        
+        return stats
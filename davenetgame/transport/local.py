@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file local
+#
+#  This file contains the Local transport, for single-player games and integration tests that
+#  want a real server without a real network.  The client's Local transport spawns the server
+#  in a child process and talks to it through a pair of shared memory ring buffers, or through
+#  pipes if shared memory isn't available or you ask for them.  No sockets are involved, so
+#  there are no system calls per message and no datagram size to fragment to.  A message must
+#  still fit in one ring, ringsize bytes, shm.DEFAULT_SIZE by default, or in shm.DEFAULT_SIZE
+#  with pipes.  Bigger ones are dropped, as are messages sent while a ring's worth is already
+#  waiting for the other side; the send_dropped stat counts them.
+#
+#  You give the client transport a factory function that builds the server's dispatcher.  It
+#  is called in the child process with the keyword arguments the server's LocalServer transport
+#  needs, so it must be a module-level function if your platform spawns processes rather than
+#  forking them.  For example:
+#
+#      def MakeServer(**transportArgs):
+#          theServer = dispatcher.EventDispatcher()
+#          theProtocol = realtime.RealtimeServer(core = True)
+#          theTransport = local.LocalServer(owner=theProtocol, **transportArgs)
+#          theProtocol.SetTransport(theTransport)
+#          theProtocol.BindTransport()
+#          theServer.AddProtocol(theProtocol)
+#          return theServer
+#
+#      theTransport = local.Local(owner=theProtocol, server=MakeServer)
+#
+#  The child's loop polls every interval seconds, 0.001 by default.  Pass interval=0 to the
+#  client transport for the lowest latency, at the cost of the child keeping a core busy.
+
+import collections, multiprocessing, threading, time
+
+from davenetgame import exceptions
+from davenetgame.transport.base import TransportBase, M_INLINE
+from davenetgame.transport import shm
+
+## The address the server sees its one local client as.  The host can't be resolved, which is
+#  the point: it can never be confused with a real client.
+LOCAL_CLIENT = ('local', 1)
+
+## A one-way channel over a multiprocessing pipe.  It has the same Read, Write, Free and Capacity
+#  methods as shm.RingBuffer, so the transports don't care which one they have.  Writing to a
+#  pipe blocks once the pipe is full, and if both sides did that at once, neither would be
+#  reading, so writes are handed to a thread that does the blocking.  Up to shm.DEFAULT_SIZE
+#  bytes may wait for that thread, so the channel fills like a ring when the other side falls
+#  behind.
+class PipeChannel(object):
+    ## The multiprocessing Connection for this end of the pipe
+    __conn = None
+    
+    ## The writes waiting for the writer thread, and the number of bytes in them.
+    __queue = None
+    __queued = None
+    
+    ## Protects the queue, and wakes the writer thread.
+    __condition = None
+    
+    ## The writer thread, started by the first Write.
+    __writer = None
+    
+    ## Set when the channel is closed, to stop the writer thread.
+    __closed = None
+    
+    def __init__(self, conn):
+        self.__conn = conn
+        self.__queue = collections.deque()
+        self.__queued = 0
+        self.__condition = threading.Condition()
+        self.__closed = False
+    
+    ## Returns the most bytes written at once.
+    def Capacity(self):
+        return shm.DEFAULT_SIZE
+    
+    ## Returns the number of bytes that can be written right now.
+    def Free(self):
+        with self.__condition:
+            return shm.DEFAULT_SIZE - self.__queued
+    
+    ## Queues data to be written to the pipe.  Never blocks.
+    #
+    #  @returns False if there isn't room for it.
+    def Write(self, data):
+        with self.__condition:
+            if self.__closed or len(data) > shm.DEFAULT_SIZE - self.__queued:
+                return False
+            
+            self.__queue.append(bytes(data) )
+            self.__queued += len(data)
+            
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__writeLoop, name="davenetgame-pipe", daemon=True)
+                self.__writer.start()
+            
+            self.__condition.notify()
+        
+        return True
+    
+    ## The body of the writer thread.  Writes are taken off the queue and written in order,
+    #  blocking as long as the pipe is full.
+    def __writeLoop(self):
+        while True:
+            with self.__condition:
+                while len(self.__queue) == 0 and not self.__closed:
+                    self.__condition.wait()
+                
+                if self.__closed:
+                    return
+                
+                data = self.__queue[0]
+            
+            try:
+                self.__conn.send_bytes(data)
+            except OSError:
+                return
+            
+            with self.__condition:
+                self.__queue.popleft()
+                self.__queued -= len(data)
+    
+    ## Reads everything waiting in the pipe, without blocking.
+    def Read(self):
+        data = b''
+        
+        while self.__conn.poll():
+            data += self.__conn.recv_bytes()
+        
+        return data
+    
+    def Close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        
+        self.__conn.close()
+
+## Opens the server's end of the channels described by spec.  See Local.Start.
+def _OpenChannels(spec):
+    if spec[0] == 'ring':
+        return shm.RingBuffer(spec[1]), shm.RingBuffer(spec[2])
+    
+    return PipeChannel(spec[1]), PipeChannel(spec[2])
+
+## The body of the server's child process.  Don't call this directly.
+#
+#  @param factory the function that builds the server's dispatcher.
+#  @param channels the description of the channels, passed on to LocalServer.
+#  @param stopEvent a multiprocessing Event set when the server must quit.
+#  @param interval how long, in seconds, to sleep between updates.
+def _RunLocalServer(factory, channels, stopEvent, interval):
+    theServer = factory(channels=channels, mode=M_INLINE)
+    theServer.Start()
+    
+    try:
+        while not stopEvent.is_set():
+            theServer.Update(time.time() )
+            
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    
+    theServer.Stop()
+
+## The parts shared by both ends of a local connection.  Messages are packed into a batch as
+#  they are sent, and each Flush hands the whole batch to the other process at once.
+class _LocalTransportBase(TransportBase):
+    ## The channel messages arrive on
+    __inbound = None
+    
+    ## The channel messages are sent on
+    __outbound = None
+    
+    ## Outgoing records waiting for the next Flush.
+    __batch = None
+    
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        self.__batch = shm.RecordBatch(shm.DEFAULT_SIZE)
+    
+    ## Sets the channels used by this transport.  The outgoing batch is sized to the outbound
+    #  channel.
+    def SetChannels(self, inbound, outbound):
+        self.__inbound = inbound
+        self.__outbound = outbound
+        
+        self.__batch = shm.RecordBatch(outbound.Capacity() )
+    
+    ## Closes both channels.
+    def CloseChannels(self):
+        if self.__inbound is not None:
+            self.__inbound.Close()
+            self.__outbound.Close()
+            
+            self.__inbound = None
+            self.__outbound = None
+    
+    ## Returns the address messages from the other side appear to come from.  Subclasses must
+    #  implement this.
+    def PeerInfo(self):
+        raise NotImplementedError
+    
+    ## Takes everything the other side has sent since the last poll, then processes each message.
+    def PollSocket(self):
+        data = self.__inbound.Read()
+        
+        if len(data) == 0:
+            return
+        
+        peer = self.PeerInfo()
+        
+        for theId, addr, payload in shm.UnpackRecords(data):
+            self.AddBytesReceived(len(payload) )
+            self.ProcessMessage(theId, payload, peer)
+    
+    ## Adds the message to the batch that goes to the other side on the next Flush.  A message
+    #  bigger than the outbound channel, or sent while a channel's worth is already waiting, is
+    #  dropped.
+    def SendMessage(self, msg):
+        if self.__batch.Add(msg['type'], msg['connection'], msg['message']):
+            self.AddBytesSent(len(msg['message']) )
+    
+    ## Sends outgoing messages to the other side.  If the ring, or a pipe's write queue, is too
+    #  full for all of them, as many as fit are sent and the rest wait for the next Flush.
+    def FlushBatch(self):
+        while self.__batch.Pending() > 0 and self.__outbound is not None:
+            if self.__batch.Write(self.__outbound) == 0:
+                break
+    
+    ## Adds the number of messages dropped to the transport stats.
+    def Stats(self):
+        stats = super().Stats()
+        stats['send_dropped'] = self.__batch.Dropped()
+        
+        return stats
+
+## The client end of a local connection.  Starting it starts the server.
+class Local(_LocalTransportBase):
+    ## The function that builds the server's dispatcher
+    __factory = None
+    
+    ## Use pipes even when shared memory is available
+    __pipe = None
+    
+    ## The size of each ring buffer
+    __ringsize = None
+    
+    ## How long the server sleeps between updates
+    __interval = None
+    
+    ## The server's child process
+    __process = None
+    
+    ## Set to tell the server to quit
+    __stopEvent = None
+    
+    ## The address of the server, as the client protocol knows it
+    __peer = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      server : a function that builds the server's dispatcher.  Required.  See the
+    #               description of this file.
+    #      pipe : if True, use pipes even if shared memory is available.
+    #      ringsize : the size, in bytes, of each of the two ring buffers.
+    #      interval : how long, in seconds, the server sleeps between updates.  Default is 0.001.
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        if 'server' in args:
+            self.__factory = args['server']
+        else:
+            raise exceptions.dngExceptionNotImplemented("Local transport has no server to start.")
+        
+        self.__pipe = not shm.HAVE_SHARED_MEMORY
+        if 'pipe' in args:
+            self.__pipe = self.__pipe or args['pipe']
+        
+        self.__ringsize = shm.DEFAULT_SIZE
+        if 'ringsize' in args:
+            self.__ringsize = args['ringsize']
+        
+        self.__interval = 0.001
+        if 'interval' in args:
+            self.__interval = args['interval']
+        
+        self.__peer = LOCAL_CLIENT
+    
+    ## Returns the address of the server, as the client protocol knows it.
+    def PeerInfo(self):
+        return self.__peer
+    
+    ## Creates the channels and starts the server in a child process.
+    def Start(self):
+        context = multiprocessing.get_context()
+        
+        if self.__pipe:
+            toServerRead, toServerWrite = context.Pipe(duplex=False)
+            toClientRead, toClientWrite = context.Pipe(duplex=False)
+            
+            self.SetChannels(PipeChannel(toClientRead), PipeChannel(toServerWrite) )
+            spec = ('pipe', toServerRead, toClientWrite)
+        else:
+            toServer = shm.RingBuffer(size=self.__ringsize)
+            toClient = shm.RingBuffer(size=self.__ringsize)
+            
+            self.SetChannels(toClient, toServer)
+            spec = ('ring', toServer.Name(), toClient.Name() )
+        
+        self.__stopEvent = context.Event()
+        
+        self.__process = context.Process(target=_RunLocalServer,
+                                         args=(self.__factory,
+                                               spec,
+                                               self.__stopEvent,
+                                               self.__interval),
+                                         name="davenetgame-local-server",
+                                         daemon=True)
+        self.__process.start()
+        
+        print('Local server started')
+    
+    ## Stops the server and closes the channels.
+    def Stop(self):
+        if self.__process is not None:
+            self.__stopEvent.set()
+            self.__process.join(5.0)
+            
+            if self.__process.is_alive():
+                self.__process.terminate()
+                self.__process.join()
+            
+            self.__process = None
+        
+        self.CloseChannels()
+    
+    ## Remembers where the client protocol thinks the server is, so that messages from the
+    #  server can be handed back with the same address.
+    def SendMessage(self, msg):
+        self.__peer = msg['connection']
+        
+        super().SendMessage(msg)
+
+## The server end of a local connection.  It is created by the server factory in the child
+#  process, and it only ever has the one client.
+class LocalServer(_LocalTransportBase):
+    ## The description of the channels, as passed to the server factory.
+    __spec = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      channels : the description of the channels.  Required.  Pass on whatever the server
+    #                 factory was given.
+    def __init__(self, **args):
+        args['isserver'] = True
+        
+        super().__init__(**args)
+        
+        self.__spec = args['channels']
+    
+    ## The one client always appears as LOCAL_CLIENT.
+    def PeerInfo(self):
+        return LOCAL_CLIENT
+    
+    ## Opens the server's end of the channels.
+    def Start(self):
+        inbound, outbound = _OpenChannels(self.__spec)
+        
+        self.SetChannels(inbound, outbound)
+    
+    def Stop(self):
+        self.CloseChannels()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file loopback
+#
+#  This file contains the Loopback transport, which connects a server and any number of clients
+#  living in the same process through in-memory queues.  It's useful for measuring how much
+#  the protocol, the pedia and object syncing cost without the kernel getting in the way, and
+#  for embedding a listen server in a game client without paying for a socket.
+#
+#  A server Loopback is found by the address it's given with clienthost and clientport, just
+#  like a Udp server.  A server bound to '' answers for any host on its port.  Clients are
+#  given made-up addresses of the form ('loopback', n).  Messages sent to an address nobody
+#  is listening on are dropped, just like datagrams.
+
+import collections, threading
+
+from davenetgame.transport.base import TransportBase
+
+## Every started Loopback transport, keyed by its address.
+__endpoints = {}
+
+## Protects __endpoints, since transports may start and stop in different threads.
+__endpointLock = threading.Lock()
+
+## The last port handed out to a client.
+__lastPort = 0
+
+## Registers a transport at an address.  Used internally.
+def _Register(address, transport):
+    with __endpointLock:
+        __endpoints[address] = transport
+
+## Removes the transport at an address.  Used internally.
+def _Unregister(address):
+    with __endpointLock:
+        __endpoints.pop(address, None)
+
+## Returns the transport listening on an address, or None.  Used internally.
+def _Find(address):
+    if address in __endpoints:
+        return __endpoints[address]
+    
+    return __endpoints.get( ('', address[1]) )
+
+## Returns a new, unique address for a client.  Used internally.
+def _NewClientAddress():
+    global __lastPort
+    
+    with __endpointLock:
+        __lastPort += 1
+        
+        return ('loopback', __lastPort)
+
+## This class implements an in-process transport.
+class Loopback(TransportBase):
+    ## Messages waiting to be processed.  Each item is (typeId, payload, fromAddress).
+    __inbox = None
+    
+    ## The address this transport is registered at.
+    __address = None
+    
+    ## Messages sent to an address nobody is listening on.
+    __dropped = None
+    
+    ## The address we used to reach each transport, keyed by that transport's own address.
+    #  A server bound to '' is reached as, say, ('127.0.0.1', 8888), and its replies must
+    #  come back from that address, or the protocol won't recognize the connection.
+    __aliases = None
+    
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        self.__inbox = collections.deque()
+        self.__dropped = 0
+        self.__aliases = {}
+    
+    ## Returns the address of this transport.
+    def Address(self):
+        return self.__address
+    
+    ## Registers this transport so other Loopback transports can reach it.
+    def Start(self):
+        if self.IsServer():
+            self.__address = self.ClientInfo()
+        else:
+            self.__address = _NewClientAddress()
+        
+        _Register(self.__address, self)
+    
+    def Stop(self):
+        if self.__address is not None:
+            _Unregister(self.__address)
+            self.__address = None
+    
+    ## Called by the sending transport to put a message in this transport's inbox.  Safe to call
+    #  from any thread.
+    def Deliver(self, typeId, payload, fromAddress):
+        self.__inbox.append( (typeId, payload, fromAddress) )
+    
+    ## Processes every message in the inbox.
+    def PollSocket(self):
+        inbox = self.__inbox
+        aliases = self.__aliases
+        
+        while len(inbox) > 0:
+            typeId, payload, fromAddress = inbox.popleft()
+            
+            if fromAddress in aliases:
+                fromAddress = aliases[fromAddress]
+            
+            self.AddBytesReceived(len(payload) )
+            self.ProcessMessage(typeId, payload, fromAddress)
+    
+    ## Puts the message in the inbox of the transport at its destination.
+    def SendMessage(self, msg):
+        destination = _Find(msg['connection'])
+        
+        if destination is None:
+            self.__dropped += 1
+            return
+        
+        if destination.Address() != msg['connection']:
+            self.__aliases[destination.Address()] = msg['connection']
+        
+        self.AddBytesSent(len(msg['message']) )
+        
+        destination.Deliver(msg['type'], msg['message'], self.__address)
+    
+    def Stats(self):
+        stats = super().Stats()
+        
+        stats['dropped'] = self.__dropped
+        
+        return stats
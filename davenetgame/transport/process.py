@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file process
+#
+#  This file contains the ProcessUdp transport.  It speaks exactly the same UDP wire format as
+#  the Udp transport, but the socket lives in a child process.  The child does all of the
+#  system calls and the datagram framing, and exchanges batches of already-framed records with
+#  the game process through a pair of shared memory ring buffers (see shm.py).  On the game
+#  side, each PollSocket and each Flush is a single copy in or out of shared memory, so socket
+#  I/O no longer competes with the game simulation for the GIL.
+#
+#  Connection maintenance, acks and pings stay in the Protocol object in the game process,
+#  because that's where the state they work on lives.
+#
+#  If the child dies, it's restarted the next time the socket is polled, at most once every
+#  RESTART_INTERVAL seconds.  A server's child binds the same address again, but a client's
+#  gets a new port, so the server sees a new connection and the client must log in again.
+
+import multiprocessing, select, socket, time
+
+from davenetgame.transport.base import TransportBase
+from davenetgame.transport import shm, fragment
+
+## The fewest seconds between restarts of a child process that died.
+RESTART_INTERVAL = 1.0
+
+## The body of the child process that owns the socket.  Don't call this directly.
+#
+#  @param inName the name of the ring the child writes received datagrams to.
+#  @param outName the name of the ring the child reads datagrams to send from.
+#  @param bindInfo a (host, port) tuple to bind to, or None for a client socket.
+#  @param reuseport whether to bind with SO_REUSEPORT.
+#  @param buffersize the largest datagram that will be sent or received.
+#  @param stopEvent a multiprocessing Event set when the child must quit.
+#  @param stats a multiprocessing Array of five counters: bytes sent, bytes received,
+#               datagrams sent, datagrams dropped because the inbound ring was full, and
+#               messages that couldn't be sent.
+def _RunSocket(inName, outName, bindInfo, reuseport, buffersize, stopEvent, stats):
+    inRing = shm.RingBuffer(inName)
+    outRing = shm.RingBuffer(outName)
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    if bindInfo is not None:
+        if reuseport:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        sock.bind(bindInfo)
+    
+    sock.setblocking(False)
+    
+    fragmenter = fragment.Fragmenter(buffersize)
+    
+    try:
+        while not stopEvent.is_set():
+            # Wait a little for the socket, but not so long that outgoing messages are held up.
+            inF, outF, errF = select.select( [sock], [], [], 0.001)
+            
+            batch = bytearray()
+            received = 0
+            count = 0
+            
+            while len(inF) > 0:
+                try:
+                    data, addr = sock.recvfrom(buffersize)
+                except BlockingIOError:
+                    break
+                
+                received += len(data)
+                
+                message = fragmenter.Decode(data, addr)
+                
+                if message is None:
+                    continue
+                
+                count += 1
+                
+                shm.PackRecord(batch, message[0], addr, message[1])
+            
+            if len(batch) > 0:
+                if inRing.Write(batch):
+                    stats[1] += received
+                else:
+                    stats[3] += count
+            
+            # The parent can't reach the fragmenter, so dropped connections are left to expire.
+            fragmenter.Maintain()
+            
+            outgoing = outRing.Read()
+            
+            if len(outgoing) > 0:
+                for theId, addr, payload in shm.UnpackRecords(outgoing):
+                    for datagram in fragmenter.Encode(theId, payload):
+                        # A full send buffer or a bad address loses the message, not the
+                        # socket.  Without one fragment the rest are no use, so they're not
+                        # sent either.
+                        try:
+                            sock.sendto(datagram, addr)
+                        except OSError:
+                            stats[4] += 1
+                            break
+                        
+                        stats[0] += len(datagram)
+                        stats[2] += 1
+    except KeyboardInterrupt:
+        pass
+    
+    sock.close()
+    inRing.Close()
+    outRing.Close()
+
+## This class implements a UDP Transport whose socket is owned by a child process.
+class ProcessUdp(TransportBase):
+    ## The ring the child writes received datagrams to.
+    __inring = None
+    
+    ## The ring this process writes outgoing datagrams to.
+    __outring = None
+    
+    ## The child process.
+    __process = None
+    
+    ## Set to tell the child to quit.
+    __stopEvent = None
+    
+    ## Counters shared with the child process.
+    __childstats = None
+    
+    ## Outgoing records waiting for the next Flush.
+    __batch = None
+    
+    ## Whether or not the server socket is bound with SO_REUSEPORT.
+    __reuseport = None
+    
+    ## The size of each ring buffer.
+    __ringsize = None
+    
+    ## How many times the child has been restarted after dying.
+    __restarts = None
+    
+    ## When the child was last started.
+    __started = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      reuseport : if True, the server socket is bound with SO_REUSEPORT.
+    #      ringsize : the size, in bytes, of each of the two ring buffers.
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        self.__reuseport = False
+        if 'reuseport' in args:
+            self.__reuseport = args['reuseport']
+        
+        self.__ringsize = shm.DEFAULT_SIZE
+        if 'ringsize' in args:
+            self.__ringsize = args['ringsize']
+        
+        self.__batch = shm.RecordBatch(self.__ringsize)
+        self.__restarts = 0
+    
+    ## Creates the ring buffers and starts the child process that owns the socket.
+    def Start(self):
+        self.__inring = shm.RingBuffer(size=self.__ringsize)
+        self.__outring = shm.RingBuffer(size=self.__ringsize)
+        
+        context = multiprocessing.get_context()
+        
+        self.__stopEvent = context.Event()
+        self.__childstats = context.Array('Q', 5, lock=False)
+        
+        self.__spawn()
+        
+        print('Socket process started')
+    
+    ## Starts the child process, on the rings and counters already made.
+    def __spawn(self):
+        context = multiprocessing.get_context()
+        
+        bindInfo = None
+        if self.IsServer():
+            bindInfo = self.ClientInfo()
+        
+        self.__process = context.Process(target=_RunSocket,
+                                         args=(self.__inring.Name(),
+                                               self.__outring.Name(),
+                                               bindInfo,
+                                               self.__reuseport,
+                                               self.Buffersize(),
+                                               self.__stopEvent,
+                                               self.__childstats),
+                                         name="davenetgame-socket",
+                                         daemon=True)
+        self.__process.start()
+        
+        self.__started = time.time()
+    
+    ## Returns True if the child is running.  If it died, it's restarted, unless it was started
+    #  less than RESTART_INTERVAL seconds ago.
+    def __checkChild(self):
+        if self.__process is None:
+            return False
+        
+        if self.__process.is_alive():
+            return True
+        
+        if self.__stopEvent.is_set() or time.time() - self.__started < RESTART_INTERVAL:
+            return False
+        
+        print('Socket process exited with code ' + str(self.__process.exitcode) + ', restarting.')
+        
+        self.__process.join()
+        self.__restarts += 1
+        self.__spawn()
+        
+        return True
+    
+    ## Stops the child process and frees the ring buffers.
+    def Stop(self):
+        if self.__process is not None:
+            self.__stopEvent.set()
+            self.__process.join(5.0)
+            
+            if self.__process.is_alive():
+                self.__process.terminate()
+                self.__process.join()
+            
+            self.__process = None
+        
+        if self.__inring is not None:
+            self.__inring.Close()
+            self.__outring.Close()
+            
+            self.__inring = None
+            self.__outring = None
+    
+    ## Takes everything the child has received since the last poll in one copy, then processes
+    #  each message.
+    def PollSocket(self):
+        if not self.__checkChild():
+            return
+        
+        data = self.__inring.Read()
+        
+        if len(data) == 0:
+            return
+        
+        for theId, addr, payload in shm.UnpackRecords(data):
+            self.AddBytesReceived(len(payload) + 4)
+            self.ProcessMessage(theId, payload, addr)
+    
+    ## Adds the message to the batch that goes to the child on the next Flush.  If a ring's worth
+    #  of messages is already waiting, it's dropped.
+    def SendMessage(self, msg):
+        if self.__batch.Add(msg['type'], msg['connection'], msg['message']):
+            self.AddBytesSent(len(msg['message']) + 4)
+    
+    ## Sends outgoing messages to the child in one copy.  If the ring is too full for all of
+    #  them, as many as fit are sent and the rest wait for the next Flush.
+    def FlushBatch(self):
+        if self.__batch.Pending() > 0:
+            self.__batch.Write(self.__outring)
+    
+    ## Adds the child's own counters, and the messages dropped here, to the transport stats.
+    def Stats(self):
+        stats = super().Stats()
+        
+        if self.__childstats is not None:
+            stats['socket_bytes_sent'] = self.__childstats[0]
+            stats['socket_bytes_received'] = self.__childstats[1]
+            stats['socket_datagrams_sent'] = self.__childstats[2]
+            stats['ring_drops'] = self.__childstats[3]
+            stats['socket_send_dropped'] = self.__childstats[4]
+            stats['socket_process_alive'] = 1 if self.__process is not None and self.__process.is_alive() else 0
+        
+        stats['socket_restarts'] = self.__restarts
+        stats['send_dropped'] = self.__batch.Dropped()
+        
+        return stats
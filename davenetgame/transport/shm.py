@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file shm
+#
+#  This file contains a single-producer, single-consumer ring buffer in shared memory, used by
+#  transports that move messages between processes, and the record format those transports
+#  put in it.  One process only ever writes to a ring, and the other only ever reads from it,
+#  so no locks are needed: the writer copies its data in and then moves the tail, the reader
+#  copies everything between head and tail out and then moves the head.
+#
+#  Writers are expected to write whole records at a time, so the reader never sees half of a
+#  record.  RecordBatch collects records and writes as many whole ones as the ring has room
+#  for.
+
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from davenetgame import exceptions
+
+## True if this Python has multiprocessing.shared_memory, which is needed for RingBuffer.
+HAVE_SHARED_MEMORY = shared_memory is not None
+
+## The default size, in bytes, of a ring buffer's data area.
+DEFAULT_SIZE = 4 * 1024 * 1024
+
+## The ring header: head (bytes read so far), tail (bytes written so far), and the capacity of
+#  the data area.  Head and tail only ever grow; their difference is the amount of data waiting.
+_HEADER = struct.Struct("!QQQ")
+
+## Offset of the tail in the header.  The head is at offset 0.
+_TAIL = 8
+
+_COUNTER = struct.Struct("!Q")
+
+## The header of each record: message type ID, port, length of the host string, and length of
+#  the payload.  The host and the payload follow it.
+_RECORD = struct.Struct("!IHBI")
+
+## A ring buffer living in shared memory.  Create it in one process, then pass Name() to the
+#  other process and attach to it there by passing the name to the constructor.
+class RingBuffer(object):
+    ## The shared memory block
+    __shm = None
+    
+    ## A memoryview of the shared memory block
+    __buf = None
+    
+    ## The size of the data area, which follows the header
+    __capacity = None
+    
+    ## Whether or not this object created the shared memory, and so must unlink it.
+    __creator = None
+    
+    ## Creates a new ring buffer, or attaches to an existing one.
+    #
+    #  @param name the name of an existing ring buffer to attach to.  If None, a new one is
+    #              created.
+    #  @param size the size of the data area of a new ring buffer.  Ignored when attaching.
+    def __init__(self, name=None, size=DEFAULT_SIZE):
+        if name is None:
+            self.__shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + size)
+            self.__creator = True
+            
+            _HEADER.pack_into(self.__shm.buf, 0, 0, 0, size)
+        else:
+            self.__shm = _attach(name)
+            self.__creator = False
+        
+        self.__buf = self.__shm.buf
+        self.__capacity = _HEADER.unpack_from(self.__buf, 0)[2]
+    
+    ## Returns the name of the shared memory block, to be passed to the other process.
+    def Name(self):
+        return self.__shm.name
+    
+    ## Returns the size of the data area.
+    def Capacity(self):
+        return self.__capacity
+    
+    ## Returns the number of bytes waiting to be read.
+    def Pending(self):
+        head, tail, capacity = _HEADER.unpack_from(self.__buf, 0)
+        
+        return tail - head
+    
+    ## Returns the number of bytes that can be written right now.
+    def Free(self):
+        head, tail, capacity = _HEADER.unpack_from(self.__buf, 0)
+        
+        return capacity - (tail - head)
+    
+    ## Writes data to the ring.  Either all of it is written, or none of it.
+    #
+    #  @param data a bytes-like object.
+    #  @returns True if the data was written, False if there wasn't enough room.
+    def Write(self, data):
+        head, tail, capacity = _HEADER.unpack_from(self.__buf, 0)
+        
+        count = len(data)
+        
+        if count == 0:
+            return True
+        
+        if count > capacity - (tail - head):
+            return False
+        
+        start = _HEADER.size + (tail % capacity)
+        first = min(count, _HEADER.size + capacity - start)
+        
+        self.__buf[start:start + first] = data[:first]
+        
+        # Wrap around to the beginning of the data area.
+        if first < count:
+            self.__buf[_HEADER.size:_HEADER.size + count - first] = data[first:]
+        
+        _COUNTER.pack_into(self.__buf, _TAIL, tail + count)
+        
+        return True
+    
+    ## Reads everything waiting in the ring.
+    #
+    #  @returns a bytes object, empty if there was nothing to read.
+    def Read(self):
+        head, tail, capacity = _HEADER.unpack_from(self.__buf, 0)
+        
+        count = tail - head
+        
+        if count == 0:
+            return b''
+        
+        start = _HEADER.size + (head % capacity)
+        first = min(count, _HEADER.size + capacity - start)
+        
+        data = bytes(self.__buf[start:start + first])
+        
+        if first < count:
+            data += bytes(self.__buf[_HEADER.size:_HEADER.size + count - first])
+        
+        _COUNTER.pack_into(self.__buf, 0, tail)
+        
+        return data
+    
+    ## Detaches from the shared memory.  The creator also removes it from the system.
+    def Close(self):
+        if self.__shm is not None:
+            self.__buf.release()
+            self.__buf = None
+            
+            self.__shm.close()
+            
+            if self.__creator:
+                self.__shm.unlink()
+            
+            self.__shm = None
+
+## Attaches to an existing shared memory block.  Where Python allows it, the block is kept away
+#  from this process's resource tracker, since only the process that created it may remove it.
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+## Appends one record to a batch.
+#
+#  @param batch a bytearray the record is appended to.
+#  @param typeId the message type ID.
+#  @param connectInfo the (host, port) tuple the message is going to or coming from.
+#  @param payload the serialized message.
+def PackRecord(batch, typeId, connectInfo, payload):
+    host = connectInfo[0].encode('utf-8')
+    
+    if len(host) > 255:
+        raise exceptions.dngExceptionNotImplemented("Host name too long to pack: " + connectInfo[0])
+    
+    batch += _RECORD.pack(typeId, connectInfo[1], len(host), len(payload) )
+    batch += host
+    batch += payload
+
+## Unpacks every record in a batch.
+#
+#  @param data a bytes object containing whole records, as read from a RingBuffer.
+#  @returns a list of (typeId, (host, port), payload) tuples.
+def UnpackRecords(data):
+    records = []
+    
+    offset = 0
+    size = len(data)
+    
+    while offset < size:
+        typeId, port, hostLength, payloadLength = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        
+        host = data[offset:offset + hostLength].decode('utf-8')
+        offset += hostLength
+        
+        payload = data[offset:offset + payloadLength]
+        offset += payloadLength
+        
+        records.append( (typeId, (host, port), payload) )
+    
+    return records
+
+## Returns the length of the whole records at the start of data that fit in size bytes.
+def FitRecords(data, size):
+    offset = 0
+    
+    while offset + _RECORD.size <= len(data):
+        typeId, port, hostLength, payloadLength = _RECORD.unpack_from(data, offset)
+        end = offset + _RECORD.size + hostLength + payloadLength
+        
+        if end > size:
+            break
+        
+        offset = end
+    
+    return offset
+
+## Outgoing records waiting to be written to a ring or other channel.  Each Write writes as many
+#  whole records as the channel has room for, and keeps the rest for the next one.  The batch
+#  never holds more than one channel's capacity, so a record too big for the channel, or one
+#  sent while the other side has fallen that far behind, is dropped and counted instead.
+class RecordBatch(object):
+    ## The packed records
+    __data = None
+    
+    ## The most bytes of records the batch holds
+    __limit = None
+    
+    ## The number of records dropped
+    __dropped = None
+    
+    ## @param limit the most bytes of records the batch holds, normally the capacity of the
+    #               channel it's written to.
+    def __init__(self, limit):
+        self.__data = bytearray()
+        self.__limit = limit
+        self.__dropped = 0
+    
+    ## Adds a record, as PackRecord does.
+    #
+    #  @returns False if the record was dropped because the batch is full.
+    def Add(self, typeId, connectInfo, payload):
+        start = len(self.__data)
+        
+        PackRecord(self.__data, typeId, connectInfo, payload)
+        
+        if len(self.__data) > self.__limit:
+            del self.__data[start:]
+            self.__dropped += 1
+            
+            return False
+        
+        return True
+    
+    ## Writes as many whole records as fit in the channel, and forgets them.
+    #
+    #  @param channel a RingBuffer, or anything with the same Free and Write methods.
+    #  @returns the number of bytes written.
+    def Write(self, channel):
+        data = self.__data
+        
+        count = FitRecords(data, channel.Free() )
+        
+        if count == 0:
+            return 0
+        
+        if count < len(data):
+            data = data[:count]
+        
+        if not channel.Write(data):
+            return 0
+        
+        del self.__data[:count]
+        
+        return count
+    
+    ## Returns the number of bytes of records waiting to be written.
+    def Pending(self):
+        return len(self.__data)
+    
+    ## Returns the number of records dropped because the batch was full.
+    def Dropped(self):
+        return self.__dropped
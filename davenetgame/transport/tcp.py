@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file tcp
+#
+#  This file contains the Tcp transport, for traffic that is large and must arrive in order,
+#  like lobbies and inventories.  Each message is sent as a frame: its length and its type ID,
+#  then the serialized message.  There is no size limit beyond MAX_FRAME.
+#
+#  All sockets are non-blocking and watched by one selector, so a server can hold many
+#  connections without a thread for each.  Nagle's algorithm is turned off, and instead every
+#  message sent to a connection during a tick is gathered into one buffer and written with a
+#  single send when the transport flushes.  Incoming data is parsed incrementally out of a
+#  per-connection receive buffer, so a frame split over several reads costs nothing extra.
+#
+#  Connections are still known to the protocol by (host, port).  On the server, that is the
+#  client's address as accepted.  On the client, the connection to the server is opened the
+#  first time a message is sent to it, and messages from it are reported with the address
+#  they were sent to.
+
+import errno, selectors, socket, struct
+
+from davenetgame.transport.base import TransportBase
+
+## The header of each frame: the length of the payload, and the message type ID.
+_FRAME = struct.Struct("!II")
+
+## The largest payload accepted.  A peer that sends a bigger frame is disconnected, since it's
+#  either broken or hostile.
+MAX_FRAME = 16 * 1024 * 1024
+
+## How many bytes are read from a socket at a time.
+READ_SIZE = 64 * 1024
+
+## The state of one stream connection.  Used internally.
+class _Stream(object):
+    ## The socket
+    sock = None
+    
+    ## The address the protocol knows this connection by
+    address = None
+    
+    ## Bytes received but not yet parsed into frames
+    inbuf = None
+    
+    ## Bytes waiting to be sent
+    outbuf = None
+    
+    ## Whether the selector is watching this socket for writing
+    writing = None
+    
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.writing = False
+
+## This class implements a TCP Transport.
+class Tcp(TransportBase):
+    ## The selector watching every socket
+    __selector = None
+    
+    ## The listening socket, on a server
+    __listener = None
+    
+    ## Open connections, keyed by the address the protocol knows them by
+    __streams = None
+    
+    ## The buffer each read goes into before it's added to a connection's receive buffer
+    __readbuf = None
+    
+    ## How many connections can be waiting to be accepted
+    __backlog = None
+    
+    ## Messages dropped because their connection was closed
+    __dropped = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      backlog : how many connections may wait to be accepted.  Default is 128.
+    def __init__(self, **args):
+        super().__init__(**args)
+        
+        self.__backlog = 128
+        if 'backlog' in args:
+            self.__backlog = args['backlog']
+        
+        self.__streams = {}
+        self.__readbuf = memoryview(bytearray(READ_SIZE) )
+        self.__dropped = 0
+    
+    ## Creates the selector and, on a server, the listening socket.
+    def Start(self):
+        self.__selector = selectors.DefaultSelector()
+        
+        if self.IsServer():
+            try:
+                self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.__listener.bind(self.ClientInfo() )
+                self.__listener.listen(self.__backlog)
+                self.__listener.setblocking(False)
+            except OSError as msg:
+                print('Bind failed: ' + str(msg) )
+                return
+            
+            self.__selector.register(self.__listener, selectors.EVENT_READ, None)
+            
+            print('Socket listening')
+    
+    ## Closes every connection and the listening socket.
+    def Stop(self):
+        for stream in list(self.__streams.values() ):
+            self.__close(stream)
+        
+        if self.__listener is not None:
+            self.__selector.unregister(self.__listener)
+            self.__listener.close()
+            self.__listener = None
+        
+        if self.__selector is not None:
+            self.__selector.close()
+            self.__selector = None
+    
+    ## Returns the number of open connections.
+    def StreamCount(self):
+        return len(self.__streams)
+    
+    ## Accepts new connections, reads from every readable connection, processes every complete
+    #  frame, and keeps writing to connections that couldn't take all of their data last time.
+    #  Never blocks.
+    def PollSocket(self):
+        for key, events in self.__selector.select(0):
+            stream = key.data
+            
+            if stream is None:
+                self.__accept()
+                continue
+            
+            if events & selectors.EVENT_WRITE:
+                self.__write(stream)
+            
+            if events & selectors.EVENT_READ:
+                self.__read(stream)
+    
+    ## Adds the framed message to its connection's send buffer.  Nothing is sent until Flush.
+    def SendMessage(self, msg):
+        address = msg['connection']
+        
+        if address in self.__streams:
+            stream = self.__streams[address]
+        elif not self.IsServer():
+            stream = self.__connect(address)
+        else:
+            stream = None
+        
+        if stream is None:
+            self.__dropped += 1
+            return
+        
+        payload = msg['message']
+        
+        stream.outbuf += _FRAME.pack(len(payload), msg['type'])
+        stream.outbuf += payload
+    
+    ## Sends the batched messages, with one send per connection.
+    def FlushBatch(self):
+        for stream in list(self.__streams.values() ):
+            if len(stream.outbuf) > 0 and not stream.writing:
+                self.__write(stream)
+    
+    def Stats(self):
+        stats = super().Stats()
+        
+        stats['streams'] = len(self.__streams)
+        stats['dropped'] = self.__dropped
+        
+        return stats
+    
+    ## Accepts every waiting connection.
+    def __accept(self):
+        while True:
+            try:
+                sock, address = self.__listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            
+            self.__add(sock, address)
+    
+    ## Opens a client connection.  The connection completes in the background; anything sent
+    #  before then waits in the send buffer.
+    def __connect(self, address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        
+        result = sock.connect_ex(address)
+        
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            print('Connect failed: ' + errno.errorcode.get(result, str(result) ) )
+            sock.close()
+            return None
+        
+        return self.__add(sock, address)
+    
+    ## Sets up a new connected socket.
+    def __add(self, sock, address):
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        stream = _Stream(sock, address)
+        
+        self.__streams[address] = stream
+        self.__selector.register(sock, selectors.EVENT_READ, stream)
+        
+        return stream
+    
+    ## Closes a connection.  Anything left in its buffers is lost.
+    def __close(self, stream):
+        if self.__streams.get(stream.address) is stream:
+            del self.__streams[stream.address]
+        
+        try:
+            self.__selector.unregister(stream.sock)
+        except (KeyError, ValueError):
+            pass
+        
+        stream.sock.close()
+    
+    ## Reads everything waiting on a connection and processes every complete frame.
+    def __read(self, stream):
+        readbuf = self.__readbuf
+        
+        while True:
+            try:
+                count = stream.sock.recv_into(readbuf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.__close(stream)
+                return
+            
+            if count == 0:
+                self.__close(stream)
+                break
+            
+            stream.inbuf += readbuf[:count]
+            self.AddBytesReceived(count)
+            
+            if count < len(readbuf):
+                break
+        
+        self.__parse(stream)
+    
+    ## Processes every complete frame in a connection's receive buffer, then drops the bytes
+    #  that were used, leaving any partial frame at the front for the next read.
+    def __parse(self, stream):
+        data = stream.inbuf
+        size = len(data)
+        offset = 0
+        
+        while size - offset >= _FRAME.size:
+            length, typeId = _FRAME.unpack_from(data, offset)
+            
+            if length > MAX_FRAME:
+                print('Frame too large from ' + str(stream.address) + ', disconnecting')
+                self.__close(stream)
+                return
+            
+            end = offset + _FRAME.size + length
+            
+            if end > size:
+                break
+            
+            self.ProcessMessage(typeId, bytes(data[offset + _FRAME.size:end]), stream.address)
+            
+            offset = end
+        
+        if offset > 0:
+            del data[:offset]
+    
+    ## Sends as much of a connection's send buffer as the socket will take.  If some is left,
+    #  the selector watches the socket until it can take more.
+    def __write(self, stream):
+        if len(stream.outbuf) > 0:
+            try:
+                count = stream.sock.send(stream.outbuf)
+            except (BlockingIOError, InterruptedError):
+                count = 0
+            except OSError:
+                self.__dropped += 1
+                self.__close(stream)
+                return
+            
+            if count > 0:
+                self.AddBytesSent(count)
+                del stream.outbuf[:count]
+        
+        waiting = len(stream.outbuf) > 0
+        
+        if waiting != stream.writing:
+            events = selectors.EVENT_READ
+            if waiting:
+                events |= selectors.EVENT_WRITE
+            
+            self.__selector.modify(stream.sock, events, stream)
+            stream.writing = waiting
@@ -21,17 +21,115 @@
 ## This file contains the basic Client class, which creates a UDP client capable of connecting to
 #  the UDP server created by this library.
 
-import socket, select, struct
+import socket, select, struct, sys
 
 from davenetgame.transport.base import TransportBase
+from davenetgame.transport import fragment
+
+## The Linux socket option that makes the kernel report, with every datagram received, how many
+#  datagrams it has dropped on the socket because its receive buffer was full.  Python doesn't
+#  always define it.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+
+## The drop counter sent with SO_RXQ_OVFL.
+_OVERFLOW = struct.Struct("=I")
+
+## The socket option that makes the kernel send, with every datagram received, the time it
+#  arrived, to the nanosecond.  Python doesn't always define it, even on Linux, where it's 35 on
+#  the usual architectures.  Its value differs elsewhere, so on other platforms it's None unless
+#  Python defines it, and kernel timestamps aren't used.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', None)
+
+if SO_TIMESTAMPNS is None and sys.platform.startswith('linux'):
+    SO_TIMESTAMPNS = 35
+
+## The struct timespec sent with SO_TIMESTAMPNS: seconds and nanoseconds.
+_TIMESPEC = struct.Struct("@ll")
 
 ## This class implements the UDP Transport class.
 class Udp(TransportBase):
     ## The socket object that will be polled.
     __socket = None
     
+    ## Whether or not the socket is bound with SO_REUSEPORT.
+    __reuseport = None
+    
+    ## Splits messages too big for one datagram, and puts them back together.
+    __fragmenter = None
+    
+    ## The receive buffer size to ask the kernel for, or None to leave the default.
+    __rcvbuf = None
+    
+    ## The send buffer size to ask the kernel for, or None to leave the default.
+    __sndbuf = None
+    
+    ## Whether the socket is non-blocking.
+    __nonblocking = None
+    
+    ## The size of the ancillary data buffer for recvmsg, or 0 if the kernel doesn't send any and
+    #  recvfrom is used instead.
+    __ancsize = None
+    
+    ## The number of datagrams the kernel has dropped because the receive buffer was full, as
+    #  last reported with SO_RXQ_OVFL.
+    __kerneldropped = None
+    
+    ## The number of messages that couldn't be sent because the send buffer was full.  A message
+    #  counts once, however many of its fragments didn't go.
+    __senddropped = None
+    
+    ## Whether to ask the kernel for the arrival time of each datagram.
+    __timestamps = None
+    
+    ## The kernel's arrival time of the datagram just read, or None.
+    __arrival = None
+    
+    ## Takes every argument TransportBase does, plus:
+    #      reuseport : if True, the server socket is bound with SO_REUSEPORT, so several
+    #                  processes can listen on the same port and the kernel spreads clients
+    #                  between them.  See dispatch.shard.
+    #      rcvbuf : the socket receive buffer size, in bytes.  A bigger buffer rides out load
+    #               spikes that would otherwise make the kernel drop datagrams.  Linux caps it
+    #               at net.core.rmem_max.
+    #      sndbuf : the socket send buffer size, in bytes.  Linux caps it at net.core.wmem_max.
+    #      nonblocking : if True, the socket is non-blocking.  Polling reads until the socket is
+    #                    empty without calling select first, and a message that doesn't fit
+    #                    in the send buffer is dropped and counted instead of waiting.
+    #      timestamps : if True, the kernel stamps each datagram with the time it arrived
+    #                   (SO_TIMESTAMPNS), and that time is what handlers and ping measurements
+    #                   see.  Time the datagram spent in the socket buffer, or waiting for the
+    #                   GIL, then shows up in the processing_delay stat instead of the ping.
+    #                   Where the kernel can't do this, the time the datagram is read is used,
+    #                   as it is by default.
     def __init__(self, **args):
         super().__init__(**args)
+        
+        self.__reuseport = False
+        
+        if 'reuseport' in args:
+            self.__reuseport = args['reuseport']
+        
+        self.__nonblocking = False
+        
+        if 'rcvbuf' in args:
+            self.__rcvbuf = args['rcvbuf']
+        
+        if 'sndbuf' in args:
+            self.__sndbuf = args['sndbuf']
+        
+        if 'nonblocking' in args:
+            self.__nonblocking = args['nonblocking']
+        
+        self.__timestamps = False
+        
+        if 'timestamps' in args:
+            self.__timestamps = args['timestamps']
+        
+        self.__ancsize = 0
+        self.__kerneldropped = 0
+        self.__senddropped = 0
+        
+        self.__fragmenter = fragment.Fragmenter(self.Buffersize() )
 
     ## Call to start the client.
     def Start(self):
@@ -45,10 +143,16 @@ class Udp(TransportBase):
             print('Failed to create socket. Error Code : ' + str(msg[0]) + ' Message ' + msg[1] )
             error = True
         
+        if error is False:
+            self.__configure()
+            
         # If this is a server socket, bind and listen for messages.
         if self.IsServer():
             # Bind socket to local host and port
             try:
+                if self.__reuseport:
+                    self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                
                 self.__socket.bind(self.ClientInfo() )
             except OSError as msg:
                 print('Bind failed. Error Code : ' + str(msg[0]) + ' Message ' + msg[1])
@@ -66,36 +170,142 @@ class Udp(TransportBase):
             del self.__socket
             self.__socket = None
 
-    ## Polls the socket.
-    def PollSocket(self):
-        inF, outF, errF = select.select( [self.__socket],  [self.__socket], [self.__socket], 5)
+    ## Sets the socket options asked for in the constructor, and turns on the kernel's drop
+    #  counter where there is one.
+    def __configure(self):
+        sock = self.__socket
+        
+        for option, size, name in ( (socket.SO_RCVBUF, self.__rcvbuf, 'receive'),
+                                    (socket.SO_SNDBUF, self.__sndbuf, 'send') ):
+            if size is None:
+                continue
+            
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+            except OSError as msg:
+                print('Could not set the ' + name + ' buffer size: ' + str(msg) )
+                continue
+            
+            # Linux doubles the size asked for, to allow for its own bookkeeping.
+            if sock.getsockopt(socket.SOL_SOCKET, option) < size:
+                print('Warning: the ' + name + ' buffer is smaller than the ' + str(size) + ' bytes asked for')
+        
+        if self.__nonblocking:
+            sock.setblocking(False)
+        
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.__ancsize += socket.CMSG_SPACE(_OVERFLOW.size)
+            except OSError:
+                pass
+        
+        if self.__timestamps:
+            try:
+                if SO_TIMESTAMPNS is None:
+                    raise OSError("SO_TIMESTAMPNS is not defined on this platform")
+                
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.__ancsize += socket.CMSG_SPACE(_TIMESPEC.size)
+            except (OSError, AttributeError):
+                self.__timestamps = False
+                print('Kernel timestamps are not available, using the time datagrams are read')
+    
+    ## Reads one datagram.  If the kernel sent its arrival time, it's left in __arrival.
+    #
+    #  @returns a (data, address) tuple.
+    def __receive(self):
+        self.__arrival = None
+        
+        if self.__ancsize == 0:
+            return self.__socket.recvfrom(self.Buffersize() )
+        
+        data, ancdata, flags, addr = self.__socket.recvmsg(self.Buffersize(), self.__ancsize)
+        
+        for level, kind, value in ancdata:
+            if level != socket.SOL_SOCKET:
+                continue
+            
+            if kind == SO_RXQ_OVFL and len(value) >= _OVERFLOW.size:
+                self.__kerneldropped = _OVERFLOW.unpack_from(value)[0]
+            elif kind == SO_TIMESTAMPNS and len(value) >= _TIMESPEC.size:
+                seconds, nanoseconds = _TIMESPEC.unpack_from(value)
+                self.__arrival = seconds + nanoseconds / 1e9
         
+        return (data, addr)
+    
+    ## Polls the socket.  Every datagram already waiting on the socket is read, but the poll
+    #  never blocks, so it is safe to call from the game loop in inline mode.
+    def PollSocket(self):
         # Get each message one at a time and call its callbacks
-        for ins in inF:
-            # receive data from server (data, addr)
-            data, addr = self.__socket.recvfrom(self.Buffersize())
+        while True:
+            if self.__nonblocking:
+                try:
+                    data, addr = self.__receive()
+                except (BlockingIOError, InterruptedError):
+                    break
+            else:
+                inF, outF, errF = select.select( [self.__socket], [], [], 0)
+                
+                if len(inF) == 0:
+                    break
+                
+                # receive data from server (data, addr)
+                data, addr = self.__receive()
             
             if not data: 
                 break
             
-            # TODO: Add the bandwidth calculation
-            #self.__bandwidth += len(data)
-                            
-            padding = len(data) - 4
-            formatString = "!I" + str(padding) + "s"
-            theId, payload = struct.unpack(formatString, data)
+            self.AddBytesReceived(len(data) )
+            
+            # Fragments of a bigger message give nothing until the last one arrives.
+            message = self.__fragmenter.Decode(data, addr)
+            
+            if message is None:
+                continue
+            
+            theId, payload = message
             
-            self.ProcessMessage(theId, payload, addr)
+            self.ProcessMessage(theId, payload, addr, self.__arrival)
         
-    ## Encode and send the message.
+        self.__fragmenter.Maintain()
+    
+    ## Also throws away any message from the connection still being reassembled.
+    def ForgetConnection(self, connectInfo):
+        super().ForgetConnection(connectInfo)
+        
+        self.__fragmenter.Forget(connectInfo)
+        
+    ## Encode and send the message, in several datagrams if it's bigger than Buffersize().
     def SendMessage(self, msg):
-        # Encode the message
-        payload = struct.pack("!I", msg['type']) + msg['message']
-        #print(msg)
-        ## TODO: do the bandwidth calculation
-        #self.__bytessent += len(payload)
+        for payload in self.__fragmenter.Encode(msg['type'], msg['message']):
+            try:
+                self.__socket.sendto(payload, msg['connection'] )
+            except BlockingIOError:
+                # Without this fragment the rest are no use to the other side, so the message
+                # is dropped as a whole.
+                self.__senddropped += 1
+                break
+            
+            self.AddBytesSent(len(payload) )
+    
+    ## Adds the fragmentation counters and the socket's drop counters to the transport stats.
+    #  kernel_dropped counts datagrams the kernel threw away because the receive buffer was
+    #  full, which never reach the transport, so they're told apart from losses on the network
+    #  or in reassembly.  It's always 0 where the kernel doesn't report it.
+    def Stats(self):
+        stats = super().Stats()
+        
+        stats.update(self.__fragmenter.Stats() )
+        
+        stats['kernel_dropped'] = self.__kerneldropped
+        stats['send_dropped'] = self.__senddropped
+        
+        if self.__socket is not None:
+            stats['rcvbuf'] = self.__socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            stats['sndbuf'] = self.__socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
         
-        self.__socket.sendto(payload, msg['connection'] )
+        return stats
                 
 
 
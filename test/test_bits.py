@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_bits.py
+#
+#  Tests bit-level writing and reading, and the bit-packed attributes that use them.
+
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame import exceptions
+from davenetgame.gameobjects import bits
+from davenetgame.gameobjects import layout
+from davenetgame.gameobjects import sync
+from davenetgame.gameobjects.attributes import builtin
+from davenetgame.gameobjects.attributes import packed
+
+## Starts the library over with nothing registered.
+def _Reset():
+    setattr(sync, '__synclist', None)
+    setattr(sync, '__gameobjlist', None)
+
+## Returns an attribute of an object type.  Attributes are replaced by properties when their type
+#  is registered, so they're looked up by name.
+def _Attr(objType, name):
+    for attr in objType._syncattributes:
+        if attr.Name() == name:
+            return attr
+
+class TestBits(unittest.TestCase):
+    def testZigZag(self):
+        self.assertEqual([ bits.ZigZag(v) for v in (0, -1, 1, -2, 2) ], [0, 1, 2, 3, 4])
+        
+        for value in (0, 1, -1, 63, -64, 2 ** 40, -2 ** 40):
+            self.assertEqual(bits.UnZigZag(bits.ZigZag(value) ), value)
+    
+    def testFields(self):
+        writer = bits.nBitWriter()
+        writer.WriteBits(5, 3)
+        writer.WriteBool(True)
+        writer.WriteBits(0x1ff, 9)
+        
+        self.assertEqual(writer.BitCount(), 13)
+        self.assertEqual(writer.Bytes(), bytes( (0b10111111, 0b11111000) ) )
+        
+        reader = bits.nBitReader(writer.Bytes() )
+        
+        self.assertEqual( (reader.ReadBits(3), reader.ReadBool(), reader.ReadBits(9) ), (5, True, 0x1ff) )
+        self.assertEqual(reader.Offset(), 2)
+    
+    def testRoundTrip(self):
+        rand = random.Random(1)
+        writer = bits.nBitWriter()
+        values = []
+        
+        for index in range(2000):
+            kind = rand.randrange(5)
+            
+            if kind == 0:
+                count = rand.randrange(1, 40)
+                value = rand.getrandbits(count)
+                writer.WriteBits(value, count)
+            elif kind == 1:
+                count = 0
+                value = rand.random() < 0.5
+                writer.WriteBool(value)
+            elif kind == 2:
+                count = 0
+                value = rand.getrandbits(rand.randrange(1, 70) )
+                writer.WriteVarint(value)
+            elif kind == 3:
+                count = 0
+                value = rand.randrange(-10 ** 12, 10 ** 12)
+                writer.WriteSigned(value)
+            else:
+                count = rand.randrange(5)
+                value = bytes(rand.getrandbits(8) for b in range(count) )
+                writer.WriteBytes(value)
+            
+            values.append( (kind, count, value) )
+        
+        # Start partway into a buffer, as records in an update do.
+        reader = bits.nBitReader(b'xx' + writer.Bytes(), 2)
+        
+        for kind, count, value in values:
+            if kind == 0:
+                self.assertEqual(reader.ReadBits(count), value)
+            elif kind == 1:
+                self.assertEqual(reader.ReadBool(), value)
+            elif kind == 2:
+                self.assertEqual(reader.ReadVarint(), value)
+            elif kind == 3:
+                self.assertEqual(reader.ReadSigned(), value)
+            else:
+                self.assertEqual(reader.ReadBytes(count), value)
+        
+        self.assertEqual(reader.Offset() - 2, len(writer.Bytes() ) )
+    
+    def testPastEnd(self):
+        reader = bits.nBitReader(b'\x01')
+        reader.ReadBits(5)
+        
+        with self.assertRaises(exceptions.dngException):
+            reader.ReadBits(4)
+
+class TestPackedAttributes(unittest.TestCase):
+    def setUp(self):
+        _Reset()
+        
+        self.syncList = sync.GetSyncList()
+        
+        class Ship(sync.nSyncObject):
+            __slots__ = ()
+            
+            x = packed.nSyncAttributeQuantizedFloat(initial=0.0, minimum=-512.0, maximum=512.0, precision=0.02)
+            hp = packed.nSyncAttributeRangedInt(initial=100, minimum=0, maximum=100)
+            boosting = packed.nSyncAttributeBool(initial=False)
+            score = packed.nSyncAttributeVarInt(initial=0)
+            name = builtin.nSyncAttributeString(initial='s')
+            
+            def __init__(self):
+                super().__init__()
+                self.Finalize()
+        
+        class Plain(sync.nSyncObject):
+            __slots__ = ()
+            
+            x = builtin.nSyncAttributeFloat(initial=0.0)
+            hp = builtin.nSyncAttributeInt(initial=100)
+            
+            def __init__(self):
+                super().__init__()
+                self.Finalize()
+        
+        sync.RegisterGameObjectType(Ship)
+        sync.RegisterGameObjectType(Plain)
+        
+        self.Ship = Ship
+        self.Plain = Plain
+    
+    def tearDown(self):
+        _Reset()
+    
+    def testLayout(self):
+        self.assertIsInstance(self.Ship.Layout(), layout.nBitLayout)
+        self.assertNotIsInstance(self.Plain.Layout(), layout.nBitLayout)
+        self.assertEqual(_Attr(self.Ship, 'hp').Bits(), 7)
+        self.assertEqual(_Attr(self.Ship, 'x').Bits(), 16)
+    
+    def testSmaller(self):
+        ship = self.Ship()
+        plain = self.Plain()
+        
+        mask = _Attr(self.Ship, 'x').Bit() | _Attr(self.Ship, 'hp').Bit()
+        
+        self.assertLess(len(ship.EncodeUpdate(mask) ), len(plain.EncodeUpdate(plain.FullMask() ) ) )
+    
+    def testRoundTrip(self):
+        ship = self.Ship()
+        ship.x = 123.456
+        ship.hp = 42
+        ship.boosting = True
+        ship.score = -300
+        ship.name = 'hello'
+        
+        replica = self.Ship.NewReplica(99999)
+        replica.ApplyState(replica.FullMask(), ship.EncodeState(ship.FullMask() ) )
+        
+        self.assertAlmostEqual(replica.x, 123.46, delta=0.01)
+        self.assertEqual( (replica.hp, replica.boosting, replica.score, replica.name), (42, True, -300, 'hello') )
+        
+        # The sending end keeps the value it was set to.
+        self.assertEqual(ship.x, 123.456)
+    
+    def testQuantizedRange(self):
+        ship = self.Ship()
+        replica = self.Ship.NewReplica(99999)
+        
+        for value in (-512.0, 512.0, 0.01, -0.03):
+            ship.x = value
+            replica.ApplyState(replica.FullMask(), ship.EncodeState(ship.FullMask() ) )
+            
+            self.assertAlmostEqual(replica.x, value, delta=0.01)
+            self.assertTrue(-512.0 <= replica.x <= 512.0)
+    
+    def testUpdates(self):
+        ship = self.Ship()
+        plain = self.Plain()
+        self.syncList.GetNewObjects()
+        
+        ship.hp = 7
+        ship.boosting = True
+        plain.hp = 8
+        
+        data = ship.EncodeUpdate(_Attr(self.Ship, 'hp').Bit() | _Attr(self.Ship, 'boosting').Bit() ) + plain.EncodeUpdate(plain.FullMask() )
+        
+        ship.hp = 100
+        ship.boosting = False
+        plain.hp = 0
+        
+        updated = sync.ApplyUpdates(data)
+        
+        self.assertEqual(len(updated), 2)
+        self.assertEqual( (ship.hp, ship.boosting, plain.hp), (7, True, 8) )
+    
+    def testRangeErrors(self):
+        ship = self.Ship()
+        
+        with self.assertRaises(exceptions.dngSyncAttributeRangeError):
+            ship.hp = 101
+        
+        with self.assertRaises(exceptions.dngSyncAttributeRangeError):
+            ship.x = 600.0
+        
+        with self.assertRaises(exceptions.dngSyncAttributeTypeError):
+            ship.boosting = 1
+        
+        with self.assertRaises(exceptions.dngSyncAttributeTypeError):
+            ship.hp = True
+        
+        self.assertEqual(ship.hp, 100)
+    
+    def testBadDeclarations(self):
+        with self.assertRaises(exceptions.dngSyncObjectAttributeError):
+            packed.nSyncAttributeRangedInt(initial=0, minimum=0)
+        
+        with self.assertRaises(exceptions.dngSyncObjectAttributeError):
+            packed.nSyncAttributeQuantizedFloat(initial=0.0, minimum=0.0, maximum=1.0, precision=0.0)
+
+if __name__ == '__main__':
+    unittest.main()
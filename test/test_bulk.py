@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_bulk.py
+#
+#  Tests blob transfers between two BulkTransfers objects, joined by a simulated link that
+#  loses messages, and the limits on what a receiver buffers.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame import pedia
+from davenetgame.protocol import bulk
+from davenetgame.protocol import connection
+
+## Stands in for the protocol a BulkTransfers object sends and receives through.  Messages it
+#  sends go to the other peer, unless the link loses them.
+class nPeer(object):
+    def __init__(self, host, port, rand, loss=0.0):
+        self.info = (host, port)
+        self.random = rand
+        self.loss = loss
+        self.other = None
+        self.connection = None
+        self.outbox = []
+        self.events = []
+        self.locked = 0
+        self.bulk = bulk.BulkTransfers(self)
+    
+    ## Joins two peers.
+    def Connect(self, other):
+        self.other = other
+        self.connection = connection.Connection(host=other.info[0], port=other.info[1], player='test')
+    
+    def Connection(self, info):
+        if info == self.other.info:
+            return self.connection
+        
+        return None
+    
+    def ConnectionList(self):
+        return [ self.connection ]
+    
+    def Pedia(self):
+        return pedia.getPedia()
+    
+    def AcquireLock(self):
+        self.locked += 1
+    
+    def ReleaseLock(self):
+        self.locked -= 1
+    
+    def AddOutgoingMessage(self, theMsg, con):
+        # Every message is sent by Update, which the protocol calls with its lock held, or by
+        # a message callback, which has to take it.
+        if self.locked == 0:
+            raise AssertionError("sent without the lock")
+        
+        if self.random.random() >= self.loss:
+            self.outbox.append(theMsg)
+    
+    def EmitEvent(self, event):
+        self.events.append(event)
+    
+    ## Returns the events of a type.
+    def Events(self, eventType):
+        return [ event for event in self.events if event['type'] == eventType ]
+    
+    ## Hands the messages sent since the last call to the other peer.
+    def Deliver(self, timestep):
+        callbacks = { 'blob' : self.other.bulk.BlobMessage,
+                      'bloback' : self.other.bulk.BlobAckMessage }
+        
+        outbox = self.outbox
+        self.outbox = []
+        
+        for theMsg in outbox:
+            callback = callbacks[pedia.getPedia().GetTypeName(theMsg.mtype)]
+            callback(message=theMsg, connection=self.info, timestamp=timestep)
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+        self.sender = nPeer('10.0.0.1', 1000, self.random)
+        self.receiver = nPeer('10.0.0.2', 2000, self.random)
+        self.sender.Connect(self.receiver)
+        self.receiver.Connect(self.sender)
+    
+    ## Runs both sides until nothing is left to send, or time runs out.
+    def Run(self, seconds=20.0, step=0.01):
+        timestep = bulk.time.time()
+        
+        for count in range(int(seconds / step) ):
+            timestep += step
+            
+            for peer in (self.sender, self.receiver):
+                peer.AcquireLock()
+                peer.bulk.Update(timestep)
+                peer.ReleaseLock()
+            
+            for peer in (self.sender, self.receiver):
+                peer.Deliver(timestep)
+            
+            if self.sender.bulk.Stats()['bulk_sending'] == 0:
+                break
+    
+    def testRoundTrip(self):
+        data = os.urandom(100000)
+        
+        transfer = self.sender.bulk.Send(self.sender.connection, data=data, name='map')
+        self.Run()
+        
+        complete = self.receiver.Events('blob_complete')
+        
+        self.assertEqual(len(complete), 1)
+        self.assertEqual(complete[0]['data'], data)
+        self.assertEqual(complete[0]['name'], 'map')
+        self.assertEqual(self.sender.Events('blob_sent')[0]['transfer'], transfer)
+        self.assertEqual(self.receiver.bulk.Stats()['bulk_buffered'], 0)
+    
+    def testLoss(self):
+        self.sender.loss = 0.2
+        self.receiver.loss = 0.2
+        
+        data = os.urandom(60000)
+        
+        self.sender.bulk.Send(self.sender.connection, data=data)
+        self.Run()
+        
+        complete = self.receiver.Events('blob_complete')
+        
+        self.assertEqual(len(complete), 1)
+        self.assertEqual(complete[0]['data'], data)
+        self.assertGreater(self.sender.bulk.Stats()['bulk_retransmits'], 0)
+    
+    def testEmpty(self):
+        self.sender.bulk.Send(self.sender.connection, data=b'')
+        self.Run()
+        
+        self.assertEqual(self.receiver.Events('blob_complete')[0]['data'], b'')
+    
+    def testTooManyTransfers(self):
+        blobs = [ os.urandom(50000) for index in range(bulk.MAX_INCOMING + 1) ]
+        
+        # Enough bandwidth that every transfer starts at once.
+        self.sender.bulk.SetBandwidth(64 * 1024 * 1024)
+        
+        for data in blobs:
+            self.sender.bulk.Send(self.sender.connection, data=data)
+        
+        self.Run()
+        
+        failed = self.sender.Events('blob_failed')
+        
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['reason'], 'refused')
+        self.assertEqual(len(self.receiver.Events('blob_complete') ), bulk.MAX_INCOMING)
+        self.assertEqual(self.receiver.bulk.Stats()['bulk_refused'], 1)
+    
+    def testTakingTurns(self):
+        # Only a few chunks' worth of bandwidth, so the cap runs out every update.
+        self.sender.bulk.SetBandwidth(bulk.DEFAULT_CHUNK * 30)
+        
+        transfers = [ self.sender.bulk.Send(self.sender.connection, data=os.urandom(200000) )
+                      for index in range(3) ]
+        
+        self.Run(seconds=2.0)
+        
+        for transfer in transfers:
+            self.assertGreater(self.sender.bulk.Progress(transfer)[0], 0)
+    
+    def testTooBig(self):
+        # The receiver only looks at the total the first chunk claims, so there's no need to
+        # have that much data.
+        theMsg = pedia.getPedia().GetMessageObject('blob')
+        theMsg.transfer = 7
+        theMsg.index = 0
+        theMsg.total = bulk.MAX_BUFFERED + 1
+        theMsg.chunksize = bulk.DEFAULT_CHUNK
+        theMsg.data = bytes(bulk.DEFAULT_CHUNK)
+        
+        self.receiver.bulk.BlobMessage(message=theMsg, connection=self.sender.info, timestamp=bulk.time.time() )
+        
+        stats = self.receiver.bulk.Stats()
+        
+        self.assertEqual(stats['bulk_receiving'], 0)
+        self.assertEqual(stats['bulk_buffered'], 0)
+        self.assertEqual(stats['bulk_refused'], 1)
+        self.assertEqual(len(self.receiver.outbox), 1)
+
+if __name__ == '__main__':
+    unittest.main()
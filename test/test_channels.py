@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_channels.py
+#
+#  Tests the delivery channels, and that a protocol forgets a connection's channels when the
+#  connection goes away.
+
+import asyncio
+import sys
+import time
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.protocol import channels
+from davenetgame.protocol import connection
+from davenetgame.protocol import realtime
+from davenetgame.transport import base
+from davenetgame.transport import emulator
+from davenetgame.transport import udp
+
+## Sends payloads on a channel from one ChannelState and receives them on another, in the order
+#  given by order, a list of indexes into payloads.
+def _Deliver(channel, typeIds, order):
+    sender = channels.ChannelState()
+    receiver = channels.ChannelState()
+    
+    sent = [ sender.Send(channel, typeId, index, b'%d' % index, 0.0) for index, typeId in enumerate(typeIds) ]
+    
+    delivered = []
+    
+    for index in order:
+        delivered.extend(receiver.Receive(channel, typeIds[index], sent[index]) )
+    
+    return delivered
+
+class TestSequenceWindow(unittest.TestCase):
+    def testDuplicates(self):
+        window = channels.SequenceWindow(64)
+        
+        self.assertTrue(window.Check(10) )
+        self.assertTrue(window.Check(12) )
+        self.assertTrue(window.Check(11) )
+        self.assertFalse(window.Check(11) )
+        self.assertFalse(window.Check(12) )
+    
+    def testWrapAround(self):
+        window = channels.SequenceWindow(64)
+        
+        for seq in range(0xFFF0, 0x10010):
+            self.assertTrue(window.Check(seq & 0xFFFF) )
+        
+        self.assertFalse(window.Check(0xFFFF) )
+        self.assertFalse(window.Check(0x0005) )
+        self.assertTrue(window.Check(0x0010) )
+    
+    def testWrapAround32(self):
+        window = channels.SequenceWindow(64, 32)
+        
+        self.assertTrue(window.Check(0xFFFFFFFE) )
+        self.assertTrue(window.Check(1) )
+        self.assertTrue(window.Check(0xFFFFFFFF) )
+        self.assertFalse(window.Check(0xFFFFFFFE) )
+    
+    def testTooOld(self):
+        window = channels.SequenceWindow(64)
+        
+        window.Check(1000)
+        
+        # Too old to remember, so it can't be told from a duplicate.
+        self.assertFalse(window.Check(900) )
+        self.assertTrue(window.Check(1001) )
+    
+    def testAcceptOld(self):
+        window = channels.SequenceWindow(64, 16, True)
+        
+        window.Check(1000)
+        window.Check(999)
+        
+        # Too old to tell, so it's let through, every time, and the window isn't moved.
+        self.assertTrue(window.Check(900) )
+        self.assertTrue(window.Check(900) )
+        self.assertFalse(window.Check(999) )
+        self.assertTrue(window.Check(1001) )
+
+class TestDuplicates(unittest.TestCase):
+    def setUp(self):
+        self.server = realtime.RealtimeServer(core=True)
+        self.transport = udp.Udp(owner=self.server, isserver=True, mode=base.M_INLINE)
+        self.server.SetTransport(self.transport)
+        
+        self.typeId = self.server.Pedia().GetTypeId('objectupdate')
+    
+    ## Receives an objectupdate with the given message ID from addr.
+    def _Receive(self, msgId, addr=('10.0.0.1', 1000) ):
+        theMsg = self.server.Pedia().GetMessageObject('objectupdate')
+        theMsg.id = msgId
+        theMsg.mtype = self.typeId
+        theMsg.timestamp = 0.0
+        
+        self.transport.ProcessMessage(self.typeId, theMsg.SerializeToString(), addr)
+        
+        return self.transport.Stats()['duplicates']
+    
+    def testLateMessage(self):
+        self._Receive(10000)
+        self._Receive(9999)
+        
+        # Reordered further back than the window reaches, so it can't be told from a new
+        # message and is let through, without disturbing the window.
+        self.assertEqual(self._Receive(5000), 0)
+        self.assertEqual(self._Receive(9999), 1)
+        self.assertEqual(self._Receive(10001), 1)
+    
+    def testForgetConnection(self):
+        self._Receive(5000)
+        self.assertEqual(self._Receive(5000), 1)
+        
+        self.transport.ForgetConnection( ('10.0.0.1', 1000) )
+        
+        self.assertEqual(self._Receive(5000), 1)
+    
+    def testEmulator(self):
+        inner = udp.Udp(owner=self.server, isserver=True, mode=base.M_INLINE)
+        self.transport = emulator.Emulator(transport=inner, owner=self.server, isserver=True, mode=base.M_INLINE)
+        
+        self._Receive(5000)
+        
+        self.assertEqual(self._Receive(5000), 1)
+    
+    def testRemoveConnection(self):
+        con = connection.Connection(host='10.0.0.1', port=1000, player='test')
+        self.server.AddConnection(con)
+        
+        self._Receive(5000)
+        self.server.RemoveConnection(con)
+        
+        self.assertEqual(self._Receive(5000), 0)
+
+class TestChannels(unittest.TestCase):
+    def testOrdered(self):
+        delivered = _Deliver(channels.RELIABLE_ORDERED, [5] * 5, [2, 0, 4, 1, 1, 3])
+        
+        self.assertEqual([ payload for typeId, payload in delivered ], [b'0', b'1', b'2', b'3', b'4'])
+    
+    def testUnordered(self):
+        delivered = _Deliver(channels.RELIABLE_UNORDERED, [5] * 4, [3, 1, 3, 0, 2, 1])
+        
+        self.assertEqual([ payload for typeId, payload in delivered ], [b'3', b'1', b'0', b'2'])
+    
+    def testSequencedPerType(self):
+        # Type 7's second message arrives before type 8's first, which is still the newest of
+        # its own type.
+        delivered = _Deliver(channels.SEQUENCED, [7, 8, 7, 8], [2, 1, 0, 3])
+        
+        self.assertEqual(delivered, [ (7, b'2'), (8, b'1'), (8, b'3') ])
+    
+    def testSequencedWrapAround(self):
+        sender = channels.ChannelState()
+        receiver = channels.ChannelState()
+        
+        count = 0
+        
+        for index in range(70000):
+            data = sender.Send(channels.SEQUENCED, 7, index, b'', 0.0)
+            count += len(receiver.Receive(channels.SEQUENCED, 7, data) )
+        
+        self.assertEqual(count, 70000)
+        self.assertEqual(receiver.Receive(channels.SEQUENCED, 7, data), [])
+    
+    def testResendLimit(self):
+        state = channels.ChannelState()
+        state.Send(channels.RELIABLE_ORDERED, 5, 1, b'x', 0.0)
+        
+        resends = 0
+        
+        for step in range(1, channels.MAX_RESENDS + 5):
+            resends += len(state.Resends(float(step), 0.5) )
+        
+        stats = state.Stats()
+        
+        self.assertEqual(resends, channels.MAX_RESENDS)
+        self.assertEqual(stats['channel_abandoned'], 1)
+        self.assertEqual(stats['channel_unacked'], 0)
+    
+    def testAcked(self):
+        state = channels.ChannelState()
+        state.Send(channels.RELIABLE_UNORDERED, 5, 1, b'x', 0.0)
+        state.Acked(1)
+        
+        self.assertEqual(state.Resends(10.0, 0.5), [])
+        self.assertEqual(state.Stats()['channel_unacked'], 0)
+
+class TestRemoveConnection(unittest.TestCase):
+    def testRemove(self):
+        server = realtime.RealtimeServer(core=True)
+        server.SetTransport(udp.Udp(owner=server, isserver=True, mode=base.M_INLINE) )
+        
+        con = connection.Connection(host='10.0.0.1', port=1000, player='test')
+        server.AddConnection(con)
+        
+        theMsg = server.Pedia().GetMessageObject('chat')
+        theMsg.msg = 'hello'
+        server.AddOutgoingMessage(theMsg, con)
+        
+        self.assertEqual(len(server.GetOutgoingMessages() ), 1)
+        self.assertEqual(server.Stats()['channel_unacked'], 1)
+        
+        server.AddOutgoingMessage(server.Pedia().GetMessageObject('chat'), con)
+        server.RemoveConnection(con)
+        
+        self.assertEqual(len(server.ConnectionList() ), 0)
+        self.assertEqual(server.Stats().get('channel_unacked', 0), 0)
+        self.assertEqual(server.GetOutgoingMessages(), [])
+
+class TestResendWakesFlush(unittest.TestCase):
+    def testResend(self):
+        server = realtime.RealtimeServer(core=True)
+        server.SetTransport(udp.Udp(owner=server, isserver=True, mode=base.M_INLINE) )
+        
+        con = connection.Connection(host='10.0.0.1', port=1000, player='test')
+        server.AddConnection(con)
+        
+        theMsg = server.Pedia().GetMessageObject('chat')
+        theMsg.msg = 'hello'
+        server.AddOutgoingMessage(theMsg, con)
+        server.GetOutgoingMessages()
+        
+        # Stands in for the event FlushTask waits on in M_ASYNC mode.
+        event = asyncio.Event()
+        server._ProtocolBase__flush_event = event
+        
+        time.sleep(channels.MIN_RESEND + 0.05)
+        server.MaintainConnection(con)
+        
+        self.assertTrue(event.is_set() )
+        self.assertEqual(len(server.GetOutgoingMessages() ), 1)
+
+if __name__ == '__main__':
+    unittest.main()
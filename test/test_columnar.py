@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_columnar.py
+#
+#  Tests that columnar types sync like any other: changes made through the attributes and
+#  straight to the columns are both found, and the records built a column at a time are the same
+#  as those built an object at a time.  Run with and without numpy.
+
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.gameobjects import columnar
+from davenetgame.gameobjects import sync
+from davenetgame.gameobjects.attributes import builtin
+
+## Starts the library over with nothing registered.
+def _Reset():
+    setattr(sync, '__synclist', None)
+    setattr(sync, '__gameobjlist', None)
+
+## Returns the dirty bit of an attribute.  The attributes of columnar types are replaced by
+#  properties, so they're looked up by name.
+def _Bit(objType, name):
+    for attr in objType._syncattributes:
+        if attr.Name() == name:
+            return attr.Bit()
+
+class TestColumnar(unittest.TestCase):
+    ## Whether the column stores use numpy.
+    useNumpy = True
+    
+    def setUp(self):
+        _Reset()
+        
+        self.numpy = columnar.numpy
+        
+        if not self.useNumpy:
+            columnar.numpy = None
+        elif columnar.numpy is None:
+            self.skipTest("numpy isn't installed")
+        
+        class Bullet(sync.nSyncObject):
+            __slots__ = ()
+            
+            x = builtin.nSyncAttributeFloat(initial=0.0)
+            y = builtin.nSyncAttributeFloat(initial=0.0)
+            hp = builtin.nSyncAttributeInt(initial=5)
+            
+            def __init__(self):
+                super().__init__()
+                self.Finalize()
+        
+        sync.RegisterGameObjectType(Bullet, {'columnar' : True} )
+        
+        self.Bullet = Bullet
+        self.store = Bullet._columns
+        self.syncList = sync.GetSyncList()
+    
+    def tearDown(self):
+        columnar.numpy = self.numpy
+        _Reset()
+    
+    ## Makes count bullets and takes their creation out of the sync list.
+    def _Bullets(self, count):
+        bullets = [ self.Bullet() for index in range(count) ]
+        
+        self.syncList.GetNewObjects()
+        self.syncList.TakeDirtyObjects()
+        
+        return bullets
+    
+    def testStore(self):
+        self.assertEqual(self.store.UsesNumpy(), self.useNumpy)
+    
+    def testAttributes(self):
+        bullet = self._Bullets(1)[0]
+        
+        bullet.x = 3
+        bullet.hp = 9
+        
+        self.assertEqual( (bullet.x, bullet.y, bullet.hp), (3.0, 0.0, 9) )
+        self.assertIs(type(bullet.x), float)
+        self.assertIs(type(bullet.hp), int)
+        
+        changed = self.syncList.TakeDirtyObjects()
+        
+        self.assertEqual(changed, [ (bullet, _Bit(self.Bullet, 'x') | _Bit(self.Bullet, 'hp') ) ])
+    
+    def testColumnWrites(self):
+        bullets = self._Bullets(10)
+        
+        column = self.store.Column('x')
+        
+        for row in range(0, self.store.Count(), 2):
+            column[row] += 1.0
+        
+        changed = self.syncList.TakeDirtyObjects()
+        
+        self.assertEqual(sorted(obj.id() for obj, mask in changed), [ obj.id() for obj in bullets[::2] ])
+        self.assertTrue(all(mask == _Bit(self.Bullet, 'x') for obj, mask in changed) )
+        self.assertEqual(self.syncList.TakeDirtyObjects(), [])
+    
+    def testNaN(self):
+        bullet = self._Bullets(1)[0]
+        
+        bullet.x = float('nan')
+        self.syncList.TakeDirtyObjects()
+        
+        self.assertEqual(self.syncList.TakeDirtyObjects(), [])
+    
+    def testEncode(self):
+        bullets = self._Bullets(20)
+        
+        for index, bullet in enumerate(bullets):
+            bullet.x = index * 1.5
+            bullet.hp = index
+        
+        changed = self.syncList.TakeDirtyObjects()
+        
+        buf = bytearray()
+        end = self.syncList.EncodeUpdates(changed, buf)
+        
+        expected = b''.join(obj.EncodeUpdate(mask) for obj, mask in changed)
+        
+        self.assertEqual(bytes(buf[:end]), expected)
+    
+    def testApply(self):
+        bullet = self._Bullets(1)[0]
+        bullet.x = 7.5
+        bullet.hp = 2
+        
+        replica = self.Bullet.NewReplica(99999)
+        replica.ApplyState(replica.FullMask(), bullet.EncodeState(bullet.FullMask() ) )
+        
+        self.assertEqual( (replica.x, replica.hp), (7.5, 2) )
+    
+    def testReuse(self):
+        bullets = self._Bullets(3)
+        row = bullets[1]._row
+        
+        bullets[1].x = 4.0
+        self.syncList.DeleteSyncObject(bullets[1])
+        
+        bullet = self.Bullet()
+        
+        self.assertEqual(bullet._row, row)
+        self.assertEqual( (bullet.x, bullet.hp), (0.0, 5) )
+
+class TestColumnarArrays(TestColumnar):
+    useNumpy = False
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_fragment.py
+#
+#  Tests the splitting of big messages into datagrams and their reassembly.
+
+import sys
+import time
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.transport import fragment
+
+ADDR = ('10.0.0.1', 1000)
+
+class TestFragmenter(unittest.TestCase):
+    def setUp(self):
+        self.sender = fragment.Fragmenter(64)
+        self.receiver = fragment.Fragmenter(64, timeout=5.0)
+        
+        self.payload = bytes(range(256) ) * 2
+    
+    def testSmall(self):
+        datagrams = self.sender.Encode(7, b'hello')
+        
+        self.assertEqual(len(datagrams), 1)
+        self.assertEqual(self.receiver.Decode(datagrams[0], ADDR), (7, b'hello') )
+    
+    def testReassembly(self):
+        datagrams = self.sender.Encode(7, self.payload)
+        
+        self.assertGreater(len(datagrams), 1)
+        self.assertTrue(all(len(d) <= 64 for d in datagrams) )
+        
+        results = [ self.receiver.Decode(d, ADDR) for d in datagrams ]
+        
+        self.assertEqual(results[:-1], [None] * (len(datagrams) - 1) )
+        self.assertEqual(results[-1], (7, self.payload) )
+        self.assertEqual(self.receiver.Pending(), 0)
+    
+    def testOutOfOrder(self):
+        datagrams = self.sender.Encode(7, self.payload)
+        
+        # Reversed, with a duplicate of the first fragment sent.
+        order = list(reversed(datagrams) )
+        order.insert(1, order[0])
+        
+        results = [ self.receiver.Decode(d, ADDR) for d in order ]
+        
+        self.assertEqual([ r for r in results if r is not None ], [ (7, self.payload) ])
+    
+    def testExpire(self):
+        datagrams = self.sender.Encode(7, self.payload)
+        
+        for d in datagrams[:-1]:
+            self.receiver.Decode(d, ADDR)
+        
+        self.receiver.Maintain(time.time() + 1.0)
+        self.assertEqual(self.receiver.Pending(), 1)
+        
+        # No more fragments arrive, but maintenance throws the message away anyway.
+        self.receiver.Maintain(time.time() + 10.0)
+        
+        self.assertEqual(self.receiver.Pending(), 0)
+        self.assertEqual(self.receiver.Stats()['reassembly_expired'], 1)
+        self.assertIsNone(self.receiver.Decode(datagrams[-1], ADDR) )
+    
+    def testForget(self):
+        datagrams = self.sender.Encode(7, self.payload)
+        
+        self.receiver.Decode(datagrams[0], ADDR)
+        self.receiver.Decode(datagrams[0], ('10.0.0.2', 1000) )
+        
+        self.receiver.Forget(ADDR)
+        
+        self.assertEqual(self.receiver.Pending(), 1)
+    
+    def testEvict(self):
+        receiver = fragment.Fragmenter(64, maxgroups=2)
+        
+        for index in range(3):
+            receiver.Decode(self.sender.Encode(7, self.payload)[0], ADDR)
+        
+        self.assertEqual(receiver.Pending(), 2)
+        self.assertEqual(receiver.Stats()['reassembly_evicted'], 1)
+    
+    def testManyAddresses(self):
+        receiver = fragment.Fragmenter(64, maxpending=4)
+        datagram = self.sender.Encode(7, self.payload)[0]
+        
+        for port in range(10):
+            receiver.Decode(datagram, ('10.0.0.1', port) )
+        
+        # The oldest are thrown away, whichever connection they're from.
+        self.assertEqual(receiver.Pending(), 4)
+        self.assertEqual(receiver.Stats()['reassembly_evicted'], 6)
+        
+        receiver.Forget( ('10.0.0.1', 0) )
+        receiver.Forget( ('10.0.0.1', 9) )
+        
+        self.assertEqual(receiver.Pending(), 3)
+    
+    def testBytes(self):
+        receiver = fragment.Fragmenter(64, maxbytes=200)
+        
+        first = self.sender.Encode(7, self.payload)
+        second = self.sender.Encode(8, self.payload)
+        
+        for datagram in first[:3]:
+            receiver.Decode(datagram, ADDR)
+        
+        self.assertEqual(receiver.Buffered(), 3 * (64 - 12) )
+        
+        # The newer message pushes the older one out to stay within the total.
+        for datagram in second[:2]:
+            receiver.Decode(datagram, ('10.0.0.2', 1000) )
+        
+        self.assertEqual(receiver.Pending(), 1)
+        self.assertLessEqual(receiver.Buffered(), 200)
+        
+        # A message that can't fit on its own is refused rather than evicting itself.
+        for datagram in second[2:4]:
+            receiver.Decode(datagram, ('10.0.0.2', 1000) )
+        
+        self.assertEqual(receiver.Pending(), 0)
+        self.assertEqual(receiver.Buffered(), 0)
+        self.assertEqual(receiver.Stats()['reassembly_refused'], 1)
+    
+    def testBufferedReleased(self):
+        datagrams = self.sender.Encode(7, self.payload)
+        
+        for datagram in datagrams:
+            self.receiver.Decode(datagram, ADDR)
+        
+        self.receiver.Decode(datagrams[0], ADDR)
+        self.receiver.Maintain(time.time() + 10.0)
+        
+        self.assertEqual(self.receiver.Buffered(), 0)
+    
+    def testRefuse(self):
+        receiver = fragment.Fragmenter(64, maxmessage=100)
+        
+        receiver.Decode(self.sender.Encode(7, self.payload)[0], ADDR)
+        
+        self.assertEqual(receiver.Pending(), 0)
+        self.assertEqual(receiver.Stats()['reassembly_refused'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
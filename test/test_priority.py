@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_priority.py
+#
+#  Tests the per-connection priorities that decide which updates fit in a byte budget, and the
+#  changes owed for the updates held back.
+
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.gameobjects import priority
+
+## Records of 10 bytes for objects 1 to 4, and the masks they were encoded from.
+RECORDS = [ (objId, b'%010d' % objId) for objId in range(1, 5) ]
+MASKS = { objId : 1 << objId for objId in range(1, 5) }
+
+## Object 4 matters most, and object 1 least.
+def _Weight(objId):
+    return float(objId)
+
+## Returns the object IDs of records.
+def _Ids(records):
+    return [ int(record) for record in records ]
+
+class TestPriority(unittest.TestCase):
+    def testBudget(self):
+        acc = priority.nPriorityAccumulator(25)
+        
+        self.assertEqual(_Ids(acc.Pack(RECORDS, MASKS, _Weight) ), [4, 3])
+        self.assertEqual(acc.Stats()['priority_held'], 2)
+    
+    def testUsed(self):
+        acc = priority.nPriorityAccumulator(25)
+        
+        self.assertEqual(_Ids(acc.Pack(RECORDS, MASKS, _Weight, used=10) ), [4])
+    
+    def testSmallerFits(self):
+        acc = priority.nPriorityAccumulator(15)
+        records = [ (1, b'1'), (2, b'%020d' % 2) ]
+        
+        self.assertEqual(acc.Pack(records, MASKS, _Weight), [b'1'])
+    
+    def testStarvation(self):
+        acc = priority.nPriorityAccumulator(10)
+        
+        sent = []
+        
+        # Priorities build up while held back, so the least important object gets its turn.
+        for tick in range(10):
+            sent.extend(_Ids(acc.Pack(RECORDS, MASKS, _Weight) ) )
+        
+        self.assertEqual(sent[:2], [4, 3])
+        self.assertIn(1, sent)
+    
+    def testOwed(self):
+        acc = priority.nPriorityAccumulator(10)
+        
+        acc.Pack(RECORDS, MASKS, _Weight)
+        acc.Sent(1)
+        
+        acc.Pack(RECORDS[:1], MASKS, _Weight)
+        acc.Sent(2)
+        
+        self.assertEqual(acc.owed, {})
+        
+        acc.Acked(1)
+        
+        self.assertEqual(acc.owed, { 1 : MASKS[1], 2 : MASKS[2], 3 : MASKS[3] })
+        
+        # Everything held back from tick 2 went out.
+        acc.Acked(2)
+        
+        self.assertEqual(acc.owed, {})
+        
+        acc.Acked(1)
+        
+        self.assertEqual(acc.owed, {})
+    
+    def testOwedCreates(self):
+        acc = priority.nPriorityAccumulator(25)
+        
+        # Creates go first, so the update doesn't fit after them.
+        self.assertEqual(_Ids(acc.PackCreates(RECORDS[1:], _Weight) ), [4, 3])
+        self.assertEqual(acc.Pack(RECORDS[:1], MASKS, _Weight, used=20), [])
+        acc.Sent(1)
+        acc.Acked(1)
+        
+        self.assertEqual(acc.owedCreates, frozenset([2]) )
+        self.assertEqual(acc.owed, { 1 : MASKS[1] })
+        
+        acc.Reset()
+        
+        self.assertEqual(acc.owedCreates, frozenset() )
+    
+    def testReset(self):
+        acc = priority.nPriorityAccumulator(10)
+        
+        acc.Pack(RECORDS, MASKS, _Weight)
+        acc.Sent(1)
+        acc.Acked(1)
+        acc.Reset()
+        
+        self.assertEqual(acc.owed, {})
+        self.assertEqual(_Ids(acc.Pack(RECORDS, MASKS, _Weight) ), [4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_replication.py
+#
+#  Tests that clients converge on the server's game state, sent through an nReplicator over a
+#  simulated link that drops, delays and reorders updates and acks.  The server and the client
+#  each get their own sync list, swapped in around everything done on their side.
+
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.gameobjects import replication
+from davenetgame.gameobjects import sync
+from davenetgame.gameobjects.attributes import builtin
+from davenetgame.messages import objectupdate_pb2
+from davenetgame.transport import fragment
+
+## Makes a sync list the one the library uses.
+def _UseList(syncList):
+    setattr(sync, '__synclist', syncList)
+
+## Starts the library over with nothing registered.  Attribute descriptors are bound to the
+#  sync list that's current when their type is registered, so each test registers its own.
+def _Reset():
+    setattr(sync, '__synclist', None)
+    setattr(sync, '__gameobjlist', None)
+
+## Defines and registers the object types used by the tests.
+#
+#  @returns a tuple of a type with a position and a type without one.
+def _RegisterTypes():
+    class Ship(sync.nSyncObject):
+        __slots__ = ()
+        
+        x = builtin.nSyncAttributeFloat(initial=0.0)
+        y = builtin.nSyncAttributeFloat(initial=0.0)
+        hp = builtin.nSyncAttributeInt(initial=100)
+        
+        def __init__(self):
+            super().__init__()
+            self.Finalize()
+    
+    class Score(sync.nSyncObject):
+        __slots__ = ()
+        
+        points = builtin.nSyncAttributeInt(initial=0)
+        name = builtin.nSyncAttributeString(initial='')
+        
+        def __init__(self):
+            super().__init__()
+            self.Finalize()
+    
+    sync.RegisterGameObjectType(Ship, {'position' : ('x', 'y') } )
+    sync.RegisterGameObjectType(Score)
+    
+    return (Ship, Score)
+
+## A server and one client, joined by a link that loses, delays and reorders messages.  The
+#  client applies updates the way RealtimeClient does: newest tick only, acking the ones it
+#  applies.
+class nSimulation(object):
+    ## The connection key of the client.
+    KEY = 'client'
+    
+    def __init__(self, seed, timeout=0.0, **args):
+        self.random = random.Random(seed)
+        
+        _Reset()
+        self.server = sync.GetSyncList()
+        self.client = sync.nSyncList()
+        
+        self.types = _RegisterTypes()
+        self.replicator = replication.nReplicator(**args)
+        self.timeout = timeout
+        
+        self.objects = []
+        self.lasttick = 0
+        self.nextId = 1
+        self.inflight = []
+        self.acks = []
+        self.sizes = []
+    
+    ## Creates a server object of objType.
+    def Create(self, objType, **values):
+        _UseList(self.server)
+        
+        obj = objType()
+        
+        for name, value in values.items():
+            setattr(obj, name, value)
+        
+        self.objects.append(obj)
+        
+        return obj
+    
+    ## Destroys a server object.
+    def Destroy(self, obj):
+        _UseList(self.server)
+        
+        self.objects.remove(obj)
+        self.server.DeleteSyncObject(obj)
+    
+    ## Runs one tick: the server sends an update, then the link delivers whatever is due.
+    #
+    #  @param loss the chance of each message and ack being lost.
+    #  @param delay the most ticks a message or ack is held up by.
+    def Tick(self, loss=0.0, delay=0):
+        _UseList(self.server)
+        
+        tick = self.replicator.Advance()
+        
+        theMsg = objectupdate_pb2.ObjectUpdate()
+        theMsg.id = self.nextId
+        theMsg.mtype = 0
+        theMsg.timestamp = 0.0
+        self.nextId += 1
+        
+        if self.replicator.BuildUpdate(self.KEY, theMsg, self.timeout):
+            self.replicator.Sent(self.KEY, theMsg.id, tick)
+            self.sizes.append( (theMsg.baseline, len(theMsg.creates) + len(theMsg.updates) + len(theMsg.destroys) ) )
+            
+            if self.random.random() >= loss:
+                self.inflight.append( (tick + self.random.randint(0, delay), theMsg.SerializeToString() ) )
+        
+        for msgId in self.__due(self.acks, tick):
+            self.replicator.Acked(self.KEY, msgId)
+        
+        _UseList(self.client)
+        
+        for data in self.__due(self.inflight, tick):
+            msg = objectupdate_pb2.ObjectUpdate.FromString(data)
+            
+            if msg.tick <= self.lasttick:
+                continue
+            
+            self.lasttick = msg.tick
+            
+            if self.random.random() >= loss:
+                self.acks.append( (tick + self.random.randint(0, delay), msg.id) )
+            sync.ApplyObjectUpdate(msg)
+        
+        _UseList(self.server)
+    
+    ## Takes the messages due by tick off a list, in the order they were sent.
+    def __due(self, queue, tick):
+        due = [ item for item in queue if item[0] <= tick ]
+        queue[:] = [ item for item in queue if item[0] > tick ]
+        
+        return [ item[1] for item in due ]
+    
+    ## Returns the state of a sync list, as a dictionary of each object's attribute values keyed
+    #  by object ID.
+    def State(self, syncList, objIds=None):
+        state = {}
+        
+        for obj in syncList.GetObjects():
+            if objIds is None or obj.id() in objIds:
+                state[obj.id()] = tuple(attr._member.__get__(obj, type(obj) ) for attr in type(obj)._syncattributes)
+        
+        return state
+    
+    ## Returns the state of the server's objects.
+    def ServerState(self, objIds=None):
+        return self.State(self.server, objIds)
+    
+    ## Returns the state of the client's replicas.
+    def ClientState(self):
+        return self.State(self.client)
+
+class TestReplication(unittest.TestCase):
+    def tearDown(self):
+        _Reset()
+    
+    ## Moves, damages, creates and destroys objects at random.
+    def Churn(self, sim, rate=0.3):
+        Ship, Score = sim.types
+        rand = sim.random
+        
+        for obj in list(sim.objects):
+            if rand.random() < rate:
+                if isinstance(obj, Ship):
+                    obj.x = obj.x + rand.uniform(-20.0, 20.0)
+                    obj.y = obj.y + rand.uniform(-20.0, 20.0)
+                    obj.hp = rand.randint(0, 100)
+                else:
+                    obj.points = obj.points + 1
+        
+        if rand.random() < 0.1 and len(sim.objects) > 0:
+            sim.Destroy(rand.choice(sim.objects) )
+        
+        if rand.random() < 0.1:
+            sim.Create(Ship, x=rand.uniform(-200.0, 200.0), y=rand.uniform(-200.0, 200.0) )
+    
+    ## Fills the world with ships scattered around the origin and a couple of scores.
+    def Populate(self, sim, ships=40):
+        Ship, Score = sim.types
+        
+        for index in range(ships):
+            sim.Create(Ship, x=sim.random.uniform(-200.0, 200.0), y=sim.random.uniform(-200.0, 200.0) )
+        
+        sim.Create(Score, name='red')
+        sim.Create(Score, name='blue')
+    
+    def testLossless(self):
+        sim = nSimulation(1)
+        self.Populate(sim)
+        
+        for tick in range(50):
+            self.Churn(sim)
+            sim.Tick()
+            
+            self.assertEqual(sim.ClientState(), sim.ServerState() )
+    
+    def testLoss(self):
+        sim = nSimulation(2)
+        self.Populate(sim)
+        
+        for tick in range(400):
+            self.Churn(sim)
+            sim.Tick(loss=0.4, delay=3)
+        
+        for tick in range(30):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState() )
+    
+    def testHistoryOverrun(self):
+        sim = nSimulation(3, history=4)
+        self.Populate(sim)
+        
+        # Nothing gets through for longer than the server keeps snapshots, so the client is
+        # sent the full state again.
+        for tick in range(20):
+            self.Churn(sim)
+            sim.Tick(loss=1.0)
+        
+        for tick in range(5):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState() )
+    
+    def testUnknownObjectSkipped(self):
+        sim = nSimulation(4)
+        Ship, Score = sim.types
+        
+        ships = [ sim.Create(Ship, x=float(index) ) for index in range(3) ]
+        
+        data = b''.join(obj.EncodeUpdate(obj.FullMask() ) for obj in ships)
+        
+        sim.Tick()
+        
+        _UseList(sim.client)
+        sim.client.RemoveReplica(sim.client.GetObject(ships[1].id() ) )
+        
+        for obj in sim.client.GetObjects():
+            obj.ApplyState(obj.FullMask(), Ship.NewReplica(0).EncodeState(obj.FullMask() ) )
+        
+        updated = sync.ApplyUpdates(data)
+        
+        self.assertEqual([ obj.id() for obj in updated ], [ ships[0].id(), ships[2].id() ])
+        self.assertEqual(sim.client.GetObject(ships[2].id() ).x, 2.0)
+        _UseList(sim.server)
+    
+    def testInterestLossless(self):
+        sim = nSimulation(5)
+        self.Populate(sim)
+        
+        sim.replicator.SetInterest(sim.KEY, 0.0, 0.0, 100.0)
+        
+        for tick in range(50):
+            self.Churn(sim)
+            sim.Tick()
+            
+            self.assertEqual(sim.ClientState(), sim.ServerState(sim.replicator.Grid().Query(0.0, 0.0, 100.0) ) )
+    
+    def testInterestLoss(self):
+        sim = nSimulation(6)
+        self.Populate(sim)
+        
+        sim.replicator.SetInterest(sim.KEY, 0.0, 0.0, 100.0)
+        
+        # Ships wander in and out of the circle while updates are lost, so the client destroys
+        # objects in updates the server never hears about.
+        for tick in range(400):
+            self.Churn(sim, 0.6)
+            sim.Tick(loss=0.4, delay=3)
+        
+        for tick in range(30):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState(sim.replicator.Grid().Query(0.0, 0.0, 100.0) ) )
+    
+    def testBudgetLoss(self):
+        sim = nSimulation(7, budget=200)
+        self.Populate(sim)
+        
+        for tick in range(200):
+            self.Churn(sim)
+            sim.Tick(loss=0.3, delay=2)
+        
+        for tick in range(60):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState() )
+    
+    def testBudgetCreates(self):
+        sim = nSimulation(8, budget=200)
+        Ship, Score = sim.types
+        
+        sim.Create(Score, name='red')
+        sim.Tick()
+        
+        # Far more ships than fit in a tick's budget come into the world at once.
+        for index in range(60):
+            sim.Create(Ship, x=float(index), y=float(index) )
+        
+        for tick in range(100):
+            self.Churn(sim, 0.1)
+            sim.Tick(loss=0.3, delay=2)
+        
+        for tick in range(60):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState() )
+        self.assertLessEqual(max(size for baseline, size in sim.sizes if baseline != 0), 200)
+    
+    def testBigWorld(self):
+        sim = nSimulation(9)
+        Ship, Score = sim.types
+        
+        # A full state in one message would be more than the fragmenter reassembles.
+        for index in range(1200):
+            sim.Create(Score, name=str(index) * (1000 // len(str(index) ) ), points=index)
+        
+        for tick in range(20):
+            sim.Tick(loss=0.2, delay=2)
+        
+        for tick in range(10):
+            sim.Tick()
+        
+        self.assertEqual(sim.ClientState(), sim.ServerState() )
+        self.assertGreater(sum(size for baseline, size in sim.sizes), fragment.MAX_MESSAGE)
+        self.assertLess(max(size for baseline, size in sim.sizes), fragment.MAX_MESSAGE)
+    
+    def testFullStateWaits(self):
+        sim = nSimulation(10, timeout=60.0)
+        self.Populate(sim)
+        
+        # The full state isn't acked, so it's only sent once while the timeout runs.
+        for tick in range(5):
+            sim.Tick(loss=1.0)
+        
+        self.assertEqual(len(sim.sizes), 1)
+        self.assertEqual(sim.replicator.Stats()['replication_full'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_shard.py
+#
+#  Tests how the shard supervisor adds up the stats its workers report.
+
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.dispatch import shard
+
+class TestShardStats(unittest.TestCase):
+    def testCombine(self):
+        supervisor = shard.ShardSupervisor(factory=None, workers=2)
+        
+        # Stands in for the reports of two workers.
+        supervisor._ShardSupervisor__stats = {
+            0 : { 'bytes_sent' : 100, 'connections' : 1, 'network_rtt' : 0.1, 'tick' : 50,
+                  'processing_delay' : 0.002, 'processing_delay_max' : 0.01,
+                  'delta_cache_hits' : 3, 'delta_cache_misses' : 1, 'delta_cache_hit_rate' : 0.75 },
+            1 : { 'bytes_sent' : 50, 'connections' : 3, 'network_rtt' : 0.3, 'tick' : 40,
+                  'processing_delay' : 0.004, 'processing_delay_max' : 0.03,
+                  'delta_cache_hits' : 0, 'delta_cache_misses' : 4, 'delta_cache_hit_rate' : 0.0 },
+        }
+        
+        stats = supervisor.Stats()
+        
+        self.assertEqual(stats['bytes_sent'], 150)
+        self.assertEqual(stats['connections'], 4)
+        self.assertAlmostEqual(stats['network_rtt'], 0.25)
+        self.assertAlmostEqual(stats['processing_delay'], 0.003)
+        self.assertEqual(stats['processing_delay_max'], 0.03)
+        self.assertEqual(stats['tick'], 50)
+        self.assertAlmostEqual(stats['delta_cache_hit_rate'], 3 / 8)
+        self.assertEqual(stats['reporting'], 2)
+    
+    def testNoConnections(self):
+        supervisor = shard.ShardSupervisor(factory=None, workers=2)
+        
+        supervisor._ShardSupervisor__stats = { 0 : { 'connections' : 0, 'network_rtt' : 0.0 },
+                                               1 : { 'connections' : 0, 'network_rtt' : 0.0 } }
+        
+        self.assertEqual(supervisor.Stats()['network_rtt'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_shm.py
+#
+#  Tests the shared memory ring buffer and the batches of records written to it.
+
+import multiprocessing
+import sys
+import time
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.transport import local, shm
+
+@unittest.skipUnless(shm.HAVE_SHARED_MEMORY, "needs multiprocessing.shared_memory")
+class TestRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = shm.RingBuffer(size=100)
+    
+    def tearDown(self):
+        self.ring.Close()
+    
+    def testWrapAround(self):
+        for count in range(10):
+            data = bytes(range(count * 7, count * 7 + 70) )
+            
+            self.assertTrue(self.ring.Write(data) )
+            self.assertEqual(self.ring.Read(), data)
+        
+        self.assertFalse(self.ring.Write(bytes(101) ) )
+        self.assertEqual(self.ring.Free(), 100)
+    
+    def testPartialFlush(self):
+        batch = shm.RecordBatch(self.ring.Capacity() )
+        
+        # Each record is 32 bytes, so three fit in the ring.
+        for count in range(3):
+            self.assertTrue(batch.Add(count, ('h', 1), bytes(20) ) )
+        
+        self.assertTrue(self.ring.Write(bytes(40) ) )
+        
+        self.assertEqual(batch.Write(self.ring), 32)
+        self.assertEqual(batch.Pending(), 64)
+        
+        self.ring.Read()
+        
+        self.assertEqual(batch.Write(self.ring), 64)
+        self.assertEqual(batch.Pending(), 0)
+        self.assertEqual([ record[0] for record in shm.UnpackRecords(self.ring.Read() ) ], [1, 2])
+    
+    def testDrops(self):
+        batch = shm.RecordBatch(self.ring.Capacity() )
+        
+        self.assertFalse(batch.Add(1, ('h', 1), bytes(100) ) )
+        
+        for count in range(4):
+            batch.Add(count, ('h', 1), bytes(20) )
+        
+        self.assertEqual(batch.Dropped(), 2)
+        self.assertEqual(batch.Pending(), 96)
+
+class TestPipe(unittest.TestCase):
+    def setUp(self):
+        aRead, aWrite = multiprocessing.Pipe(duplex=False)
+        bRead, bWrite = multiprocessing.Pipe(duplex=False)
+        
+        self.channels = [ local.PipeChannel(conn) for conn in (aRead, aWrite, bRead, bWrite) ]
+    
+    def tearDown(self):
+        for channel in self.channels:
+            channel.Close()
+    
+    def testBothSidesFlush(self):
+        aRead, aWrite, bRead, bWrite = self.channels
+        data = bytes(shm.DEFAULT_SIZE)
+        
+        # Both sides write more than a pipe holds before either reads, as a client and server
+        # flushing on one thread each would.  Neither write may block.
+        self.assertTrue(aWrite.Write(data) )
+        self.assertTrue(bWrite.Write(data) )
+        self.assertFalse(aWrite.Write(b'x') )
+        self.assertEqual(bWrite.Free(), 0)
+        
+        received = { 'a' : b'', 'b' : b'' }
+        deadline = time.monotonic() + 5
+        
+        while aWrite.Free() + bWrite.Free() < 2 * shm.DEFAULT_SIZE and time.monotonic() < deadline:
+            received['a'] += aRead.Read()
+            received['b'] += bRead.Read()
+            time.sleep(0.01)
+        
+        received['a'] += aRead.Read()
+        received['b'] += bRead.Read()
+        
+        self.assertEqual(received['a'], data)
+        self.assertEqual(received['b'], data)
+        self.assertEqual(aWrite.Free(), shm.DEFAULT_SIZE)
+
+if __name__ == '__main__':
+    unittest.main()
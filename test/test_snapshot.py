@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+'''
+
+   Copyright 2016 Dave Fancella
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+'''
+
+## @file test_snapshot.py
+#
+#  Tests the ring of per-tick snapshots: objects' states at past ticks, sharing of unchanged
+#  states, and forgetting what falls out of the ring.
+
+import sys
+import unittest
+
+sys.path.insert(0, '')
+
+from davenetgame.gameobjects import snapshot
+from davenetgame.gameobjects import sync
+from davenetgame.gameobjects.attributes import builtin
+
+## Starts the library over with nothing registered.
+def _Reset():
+    setattr(sync, '__synclist', None)
+    setattr(sync, '__gameobjlist', None)
+
+class TestSnapshotRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = snapshot.nSnapshotRing(4)
+    
+    ## Adds a tick where the objects in states changed.
+    def _Tick(self, states={}, created=[], destroyed=[]):
+        return self.ring.Add({ objId : 1 for objId in states }, created, destroyed, states,
+                             { objId : 7 for objId in created })
+    
+    def testHistory(self):
+        self._Tick({ 1 : b'a', 2 : b'x' }, created=[1, 2])
+        self._Tick({ 1 : b'b' })
+        self._Tick()
+        
+        self.assertEqual([ self.ring.GetState(tick, 1) for tick in (1, 2, 3) ], [b'a', b'b', b'b'])
+        self.assertEqual([ self.ring.GetState(tick, 2) for tick in (1, 2, 3) ], [b'x'] * 3)
+        self.assertEqual(self.ring.GetType(2), 7)
+        self.assertIsNone(self.ring.GetState(4, 1) )
+        self.assertEqual(self.ring.Get(2).changes, { 1 : 1 })
+    
+    def testRing(self):
+        self._Tick({ 1 : b'a', 2 : b'x' }, created=[1, 2])
+        
+        for index in range(10):
+            self._Tick({ 1 : b'%d' % index })
+        
+        self.assertEqual(self.ring.Tick(), 11)
+        self.assertEqual(self.ring.OldestTick(), 8)
+        self.assertIsNone(self.ring.Get(7) )
+        self.assertIsNone(self.ring.GetState(7, 1) )
+        
+        # An object that never changed still has its state from before the ring.
+        self.assertEqual(self.ring.GetState(8, 2), b'x')
+        self.assertEqual(self.ring.GetState(8, 1), b'6')
+        
+        # One state for each tick in the ring, plus the unchanged object's.
+        self.assertEqual(self.ring.StateCount(), 5)
+    
+    def testDestroyed(self):
+        self._Tick({ 1 : b'a' }, created=[1])
+        self._Tick(destroyed=[1])
+        
+        self.assertEqual(self.ring.GetState(1, 1), b'a')
+        self.assertIsNone(self.ring.GetState(2, 1) )
+        
+        for index in range(4):
+            self._Tick()
+        
+        self.assertEqual(self.ring.StateCount(), 0)
+        self.assertIsNone(self.ring.GetType(1) )
+    
+    def testSetDepth(self):
+        for index in range(6):
+            self._Tick({ 1 : b'%d' % index }, created=[1] if index == 0 else [])
+        
+        self.ring.SetDepth(2)
+        
+        self.assertEqual(self.ring.OldestTick(), 5)
+        self.assertIsNone(self.ring.Get(4) )
+        self.assertEqual(self.ring.GetState(5, 1), b'4')
+        self.assertEqual(self.ring.StateCount(), 2)
+
+class TestSyncListSnapshots(unittest.TestCase):
+    def setUp(self):
+        _Reset()
+        
+        class Ship(sync.nSyncObject):
+            __slots__ = ()
+            
+            x = builtin.nSyncAttributeFloat(initial=0.0)
+            name = builtin.nSyncAttributeString(initial='s')
+            
+            def __init__(self):
+                super().__init__()
+                self.Finalize()
+        
+        sync.RegisterGameObjectType(Ship)
+        
+        self.Ship = Ship
+        self.syncList = sync.GetSyncList()
+        self.syncList.SetSnapshotDepth(4)
+    
+    def tearDown(self):
+        _Reset()
+    
+    ## Returns the x and name of an object at a tick.
+    def _Values(self, tick, objId):
+        attributes = self.syncList.GetAttributes(tick, objId)
+        
+        return (attributes['x'], attributes['name'])
+    
+    def testAttributes(self):
+        a = self.Ship()
+        b = self.Ship()
+        
+        for index in range(6):
+            a.x = float(index)
+            
+            if index == 3:
+                b.name = 'three'
+            
+            self.syncList.TakeSnapshot()
+        
+        tick = self.syncList.SnapshotTick()
+        
+        self.assertEqual(self.syncList.OldestSnapshotTick(), tick - 3)
+        self.assertEqual(self._Values(tick - 3, a.id() ), (2.0, 's') )
+        self.assertEqual(self._Values(tick, a.id() ), (5.0, 's') )
+        self.assertEqual(self._Values(tick - 3, b.id() ), (0.0, 's') )
+        self.assertEqual(self._Values(tick - 2, b.id() ), (0.0, 'three') )
+        self.assertIsNone(self.syncList.GetAttributes(tick - 4, a.id() ) )
+        self.assertEqual(self.syncList.GetState(tick, a.id() ), a.EncodeState(a.FullMask() ) )
+    
+    def testDeleted(self):
+        ship = self.Ship()
+        self.syncList.TakeSnapshot()
+        
+        self.syncList.DeleteSyncObject(ship)
+        snap = self.syncList.TakeSnapshot()
+        
+        self.assertEqual(snap.destroyed, [ship.id()])
+        self.assertIsNone(self.syncList.GetState(snap.tick, ship.id() ) )
+        self.assertIsNotNone(self.syncList.GetState(snap.tick - 1, ship.id() ) )
+
+if __name__ == '__main__':
+    unittest.main()